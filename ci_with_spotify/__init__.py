@@ -0,0 +1,163 @@
+"""
+Reusable data pipeline behind the Spotify EDA notebook.
+
+The submodules are only imported once one of their names is first used, so that
+``import ci_with_spotify`` does not wait for Polars, NumPy and every submodule.
+"""
+
+# The `TYPE_CHECKING` imports are only read by type checkers, `__getattr__` imports the names
+# ruff: noqa: F401
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from ci_with_spotify.aggregations import PopularArtists
+    from ci_with_spotify.approx import (
+        HyperLogLog,
+        Progressive,
+        QuantileSketch,
+        StratifiedSample,
+        approx_n_unique,
+        duration_summary,
+    )
+    from ci_with_spotify.artists import ArtistModel
+    from ci_with_spotify.cache import LRUCache, TracksCache, source_version
+    from ci_with_spotify.classifier import GenreClassifier
+    from ci_with_spotify.collaborations import CollaborationIndex
+    from ci_with_spotify.crossfilter import Crossfilter
+    from ci_with_spotify.dedup import (
+        TRACK_KEY,
+        clean_unique_tracks,
+        duplicate_summary,
+        unique_tracks,
+        with_track_key,
+    )
+    from ci_with_spotify.density import (
+        DENSITY_THRESHOLD,
+        density_grid,
+        filter_ranges,
+        scatter_frame,
+    )
+    from ci_with_spotify.incremental import IncrementalTracks
+    from ci_with_spotify.pipeline import (
+        DEFAULT_SOURCE,
+        GENRES,
+        ROW_ID,
+        artist_combinations,
+        clean_tracks,
+        collect,
+        duration_counts,
+        duration_in_range,
+        explode_artists,
+        filter_duration,
+        filter_genre,
+        genre_listings,
+        genre_means,
+        genres,
+        match_tracks,
+        most_popular_artists,
+        scan_tracks,
+        score_match_text,
+    )
+    from ci_with_spotify.profiling import Profiler
+    from ci_with_spotify.report import build_report, genre_report
+    from ci_with_spotify.schema import (
+        clean_compact_tracks,
+        compact_tracks,
+        memory_report,
+    )
+    from ci_with_spotify.search import SearchIndex
+    from ci_with_spotify.selection import selected_row_ids, take_rows
+    from ci_with_spotify.service import QueryServer, QueryService, make_server
+    from ci_with_spotify.similarity import SimilarityIndex
+    from ci_with_spotify.startup import (
+        DEFAULT_DURATION,
+        Warmup,
+        lazy_import,
+        start_warmup,
+    )
+    from ci_with_spotify.synthetic import synthetic_tracks
+    from ci_with_spotify.trendline import Trendlines, lowess
+    from ci_with_spotify.utils import get_extremes
+
+# The submodule of every public name, mirroring the imports above
+_EXPORTS = {
+    "ArtistModel": "artists",
+    "CollaborationIndex": "collaborations",
+    "Crossfilter": "crossfilter",
+    "DEFAULT_DURATION": "startup",
+    "DEFAULT_SOURCE": "pipeline",
+    "DENSITY_THRESHOLD": "density",
+    "GENRES": "pipeline",
+    "GenreClassifier": "classifier",
+    "HyperLogLog": "approx",
+    "IncrementalTracks": "incremental",
+    "LRUCache": "cache",
+    "PopularArtists": "aggregations",
+    "Profiler": "profiling",
+    "Progressive": "approx",
+    "QuantileSketch": "approx",
+    "QueryServer": "service",
+    "QueryService": "service",
+    "ROW_ID": "pipeline",
+    "SearchIndex": "search",
+    "SimilarityIndex": "similarity",
+    "StratifiedSample": "approx",
+    "TRACK_KEY": "dedup",
+    "TracksCache": "cache",
+    "Trendlines": "trendline",
+    "Warmup": "startup",
+    "approx_n_unique": "approx",
+    "artist_combinations": "pipeline",
+    "build_report": "report",
+    "clean_compact_tracks": "schema",
+    "clean_tracks": "pipeline",
+    "clean_unique_tracks": "dedup",
+    "collect": "pipeline",
+    "compact_tracks": "schema",
+    "density_grid": "density",
+    "duplicate_summary": "dedup",
+    "duration_counts": "pipeline",
+    "duration_summary": "approx",
+    "duration_in_range": "pipeline",
+    "explode_artists": "pipeline",
+    "filter_duration": "pipeline",
+    "filter_genre": "pipeline",
+    "filter_ranges": "density",
+    "genre_listings": "pipeline",
+    "genre_means": "pipeline",
+    "genre_report": "report",
+    "genres": "pipeline",
+    "get_extremes": "utils",
+    "lazy_import": "startup",
+    "lowess": "trendline",
+    "make_server": "service",
+    "match_tracks": "pipeline",
+    "memory_report": "schema",
+    "most_popular_artists": "pipeline",
+    "scan_tracks": "pipeline",
+    "scatter_frame": "density",
+    "score_match_text": "pipeline",
+    "selected_row_ids": "selection",
+    "source_version": "cache",
+    "start_warmup": "startup",
+    "synthetic_tracks": "synthetic",
+    "take_rows": "selection",
+    "unique_tracks": "dedup",
+    "with_track_key": "dedup",
+}
+
+__all__ = tuple(sorted(_EXPORTS))
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{_EXPORTS[name]}"), name)
+    # Cached as a module attribute, so the next lookups skip this function
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted([*globals(), *__all__])
@@ -0,0 +1,315 @@
+"""
+Pre-aggregated artist rankings for the notebook's genre dropdown.
+
+``pipeline.most_popular_artists`` splits, explodes and groups the whole table
+again every time the genre filter changes. ``PopularArtists`` instead runs a
+single ``group_by(track_genre, artists)`` pass that keeps just enough state per
+group to derive both the per-genre tables and the "all genres" rollup, and
+caches the finished tables in an LRU, so switching genre is a lookup.
+
+The state is mergeable: ``PopularArtists.update`` folds the state of a batch of new
+tracks into the groups it touches, and only evicts the finished tables of the
+genres of the batch.
+"""
+
+import polars as pl
+
+from ci_with_spotify.artists import ArtistModel
+from ci_with_spotify.cache import LRUCache
+from ci_with_spotify.pipeline import (
+    GENRES,
+    explode_artists,
+    genre_listings,
+    is_unique_view,
+)
+
+
+def _finish(grouped: pl.LazyFrame) -> pl.LazyFrame:
+    """Turn the per-group state into the columns of ``most_popular_artists``."""
+    return grouped.select(
+        "artists",
+        pl.col("top_popularity").list.mean().alias("popularity"),
+        pl.col("track_names")
+        .list.sort(descending=True)
+        .list.head(5)
+        .alias("track_name"),
+        pl.col("album_names")
+        .list.sort(descending=True)
+        .list.head(5)
+        .alias("album_name"),
+        pl.concat_list("track_genre").alias("Most popular genre"),
+        pl.col("track_names").list.len().alias("tracks_count"),
+    ).sort("popularity", "artists", descending=[True, False])
+
+
+def _group(exploded: pl.LazyFrame) -> pl.LazyFrame:
+    """The per ``(track_genre, artists)`` state of the tracks exploded on their artists."""
+    return (
+        exploded
+        # The order within each group is preserved, so after sorting the top 10
+        # is just the head of the group, which is far cheaper than a top_k per group
+        .sort("popularity", descending=True)
+        .group_by("track_genre", "artists")
+        .agg(
+            pl.col("popularity").head(10).alias("top_popularity"),
+            pl.col("track_name").unique().alias("track_names"),
+            pl.col("album_name").unique().alias("album_names"),
+            pl.col("popularity").first().alias("max_popularity"),
+        )
+        .with_columns(pl.col("artists").cast(pl.String))
+    )
+
+
+def _merge(state: pl.LazyFrame, keys: list[str]) -> pl.LazyFrame:
+    """Merge the states of the same groups, e.g. computed on different batches."""
+    return (
+        # Ties go to the first genre, as in ``_rollup``, whatever the batch order
+        state.sort("max_popularity", "track_genre", descending=[True, False])
+        .group_by(keys)
+        .agg(
+            pl.col("top_popularity").flatten().sort(descending=True).head(10),
+            pl.col("track_names").flatten().unique(),
+            pl.col("album_names").flatten().unique(),
+            pl.col("max_popularity").first(),
+            # The genre of the most popular track, for the per-artist state
+            *([] if "track_genre" in keys else [pl.col("track_genre").first()]),
+        )
+        .select(state.collect_schema().names())
+    )
+
+
+def _replace(state: pl.DataFrame, new: pl.DataFrame, keys: list[str]) -> pl.DataFrame:
+    """The state with the groups of ``new`` merged in, leaving the other groups as is."""
+    touched = new.lazy().select(keys).unique()
+    lf = state.lazy()
+    merged = _merge(
+        pl.concat(
+            [lf.join(touched, on=keys, how="semi", nulls_equal=True), new.lazy()]
+        ),
+        keys,
+    )
+    return pl.concat(
+        [lf.join(touched, on=keys, how="anti", nulls_equal=True), merged]
+    ).collect()
+
+
+def _row_index(grouped: pl.DataFrame) -> dict[str, pl.Series]:
+    """The rows of each genre in the state."""
+    rows = (
+        grouped.select("track_genre")
+        .with_row_index("row")
+        .group_by("track_genre")
+        .agg("row")
+    )
+    return dict(zip(rows["track_genre"].to_list(), rows["row"]))
+
+
+def _positions(artists: pl.Series, offset: int = 0) -> dict[str | None, int]:
+    """The row of each artist name, counted from ``offset``."""
+    return dict(zip(artists.to_list(), range(offset, offset + artists.len())))
+
+
+class PopularArtists:
+    """
+    The most popular artists of every genre, aggregated once.
+
+    Each ``(track_genre, artists)`` group keeps the popularity of its top 10 tracks,
+    its distinct track and album names and its maximum popularity. That is enough
+    to merge the groups of an artist across genres for the "all genres" rollup,
+    because the top 10 of a union is always contained in the union of the top 10s.
+
+    Args:
+        grouped (pl.DataFrame): The per ``(track_genre, artists)`` state.
+        max_entries (int): Maximum number of finished tables kept in the LRU cache.
+        rollup (pl.DataFrame | None): The state to merge for the "all genres"
+            rollup, if not ``grouped``. In the per-track view ``grouped`` holds a
+            track once per genre, so the rollup is merged from the groups of the
+            tracks under their primary genre instead, counting each track once.
+
+    Example:
+        >>> popular = PopularArtists.build(filtered_tracks)
+        >>> popular.get("pop")  # computed from the "pop" groups, then cached
+        >>> popular.get(None)  # every genre
+    """
+
+    def __init__(
+        self,
+        grouped: pl.DataFrame,
+        max_entries: int = 32,
+        rollup: pl.DataFrame | None = None,
+    ) -> None:
+        self.grouped = grouped
+        # Gathering the rows of a genre is much cheaper than partitioning the list columns
+        self.rows = _row_index(grouped)
+        # The same state per artist, with the genre of their most popular track
+        self.artist_state = self._rollup(grouped if rollup is None else rollup)
+        self.all_genres = _finish(self.artist_state.lazy()).collect()
+        self.cache = LRUCache(max_entries)
+        # The row of each artist in ``artist_state``, built on the first update
+        self._artist_rows: dict[str | None, int] | None = None
+
+    @classmethod
+    def build(
+        cls,
+        tracks: pl.DataFrame | pl.LazyFrame,
+        *,
+        streaming: bool = False,
+        artists: ArtistModel | None = None,
+    ) -> "PopularArtists":
+        """
+        Aggregate the cleaned tracks in a single grouped pass.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): The cleaned tracks, per listing or
+                per unique track.
+            streaming (bool): Run the aggregation with the streaming engine.
+            artists (ArtistModel | None): The artists of the tracks, joined instead
+                of splitting the names again.
+
+        Returns:
+            PopularArtists: The per-genre artist rankings.
+        """
+        lf = explode_artists(tracks.lazy(), artists)
+        engine = "streaming" if streaming else "auto"
+        if not is_unique_view(lf):
+            return cls(_group(lf).collect(engine=engine))
+        grouped, rollup = pl.collect_all(
+            [_group(genre_listings(lf)), _group(lf.drop(GENRES))], engine=engine
+        )
+        return cls(grouped, rollup=rollup)
+
+    def update(
+        self,
+        tracks: pl.DataFrame | pl.LazyFrame,
+        *,
+        streaming: bool = False,
+        artists: ArtistModel | None = None,
+    ) -> list[str]:
+        """
+        Merge a batch of new tracks into the rankings.
+
+        Only the groups of the genres of the batch and the rollup rows of its artists
+        are merged again, and only the cached tables of its genres are evicted.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): The new cleaned tracks, in the same
+                view as the tracks the rankings were built from.
+            streaming (bool): Run the aggregation with the streaming engine.
+            artists (ArtistModel | None): The artists of the new tracks.
+
+        Returns:
+            list[str]: The genres of the batch, whose rankings changed.
+        """
+        batch = PopularArtists.build(tracks, streaming=streaming, artists=artists)
+        keys = ["track_genre", "artists"]
+        # The groups of the touched genres are merged again and appended. The rows they
+        # supersede are left behind, so the rest of the table is never copied.
+        old = [self.rows[genre] for genre in batch.rows if genre in self.rows]
+        current = self.grouped[pl.concat(old)] if old else self.grouped.clear()
+        merged = _replace(current, batch.grouped, keys)
+        self.rows.update(
+            (genre, rows + self.grouped.height)
+            for genre, rows in _row_index(merged).items()
+        )
+        self.grouped = pl.concat([self.grouped, merged], rechunk=False)
+
+        # Same for the artists of the batch, whose rows are found with a dict lookup
+        if self._artist_rows is None:
+            self._artist_rows = _positions(self.artist_state["artists"])
+        names = batch.artist_state["artists"].to_list()
+        old = [self._artist_rows[name] for name in names if name in self._artist_rows]
+        merged = _merge(
+            pl.concat(
+                [
+                    self.artist_state[pl.Series(old, dtype=pl.UInt32)].lazy(),
+                    batch.artist_state.lazy(),
+                ]
+            ),
+            ["artists"],
+        ).collect()
+        self._artist_rows.update(
+            _positions(merged["artists"], offset=self.artist_state.height)
+        )
+        self.artist_state = pl.concat([self.artist_state, merged], rechunk=False)
+        # Only the rows of these artists move in the rollup
+        self.all_genres = pl.concat(
+            [
+                self.all_genres.filter(
+                    ~pl.col("artists").is_in(
+                        merged["artists"].implode(), nulls_equal=True
+                    )
+                ),
+                _finish(merged.lazy()).collect(),
+            ]
+        ).sort("popularity", "artists", descending=[True, False])
+        self._compact()
+
+        touched = sorted(genre for genre in batch.rows if genre is not None)
+        for genre in touched:
+            self.cache.discard(genre)
+        return touched
+
+    def get(self, genre: str | None = None) -> pl.DataFrame:
+        """
+        The artists ranked by the average popularity of their top 10 tracks.
+
+        Args:
+            genre (str | None): Only consider the tracks of this genre, or all of
+                them if None.
+
+        Returns:
+            pl.DataFrame: The same columns as ``pipeline.most_popular_artists``.
+        """
+        if genre is None:
+            return self.all_genres
+        return self.cache.get_or_compute(genre, lambda: self._genre(genre))
+
+    def _genre(self, genre: str) -> pl.DataFrame:
+        rows = self.rows.get(genre)
+        if rows is None:
+            return self.all_genres.clear()
+        return _finish(self.grouped[rows].lazy()).collect()
+
+    def _compact(self) -> None:
+        """Drop the superseded rows once they outnumber the live ones."""
+        live = sum(rows.len() for rows in self.rows.values())
+        if self.grouped.height > 2 * live:
+            self.grouped = self.grouped[pl.concat(list(self.rows.values()))]
+            self.rows = _row_index(self.grouped)
+        if self.artist_state.height > 2 * len(self._artist_rows):
+            live = sorted(self._artist_rows.values())
+            self.artist_state = self.artist_state[pl.Series(live, dtype=pl.UInt32)]
+            self._artist_rows = _positions(self.artist_state["artists"])
+
+    @staticmethod
+    def _rollup(grouped: pl.DataFrame) -> pl.DataFrame:
+        """Merge the groups of each artist across genres, one column at a time."""
+        lf = grouped.lazy()
+        popularity, track_names, album_names, top_genre = pl.collect_all(
+            [
+                lf.select("artists", "top_popularity")
+                .explode("top_popularity")
+                .sort("top_popularity", descending=True)
+                .group_by("artists")
+                .agg(pl.col("top_popularity").head(10)),
+                lf.select("artists", "track_names")
+                .explode("track_names")
+                .group_by("artists")
+                .agg(pl.col("track_names").unique()),
+                lf.select("artists", "album_names")
+                .explode("album_names")
+                .group_by("artists")
+                .agg(pl.col("album_names").unique()),
+                lf.sort("max_popularity", "track_genre", descending=[True, False])
+                .group_by("artists")
+                .agg(pl.col("max_popularity", "track_genre").first()),
+            ]
+        )
+        return (
+            popularity.lazy()
+            .join(track_names.lazy(), on="artists", nulls_equal=True)
+            .join(album_names.lazy(), on="artists", nulls_equal=True)
+            .join(top_genre.lazy(), on="artists", nulls_equal=True)
+            .select(grouped.columns)
+            .collect()
+        )
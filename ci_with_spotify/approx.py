@@ -0,0 +1,579 @@
+"""
+Approximate aggregations, to show results while the exact ones are computed.
+
+On large dumps, the exact ``group_by`` calls behind the duration histogram and the
+genre scatter, and the distinct counts, are what the notebook waits for. This
+module estimates them in a fraction of the time, each with a 95% error bound:
+
+- ``StratifiedSample`` keeps about ``fraction`` of the tracks of every genre, and
+  at least ``min_rows`` of each, so small genres are not left out. A track is kept
+  when a hash of its ``row_id`` falls below the rate of its genre, so the sample
+  is the same on every run, and each sampled track stands for ``1 / rate`` tracks
+  (its ``sample_weight``). The histogram counts and the genre means are weighted
+  (Horvitz-Thompson and Hájek) estimates, whose bounds come from their variance
+  under this (Poisson) sampling design;
+- ``HyperLogLog`` counts distinct values in a fixed number of registers, within
+  about ``1.04 / sqrt(2 ** precision)`` of the exact count, and
+  ``approx_n_unique`` runs it per group in a single pass, e.g. for the
+  ``tracks_count`` of each artist;
+- ``QuantileSketch`` keeps counts in logarithmic buckets, so every quantile it
+  returns is within ``relative_accuracy`` of the exact one, and
+  ``duration_summary`` uses it for the extremes of the durations;
+- ``Progressive`` holds an approximate result and computes the exact one on a
+  background thread, calling back once it is ready, so the UI can show the
+  estimate immediately and switch over::
+
+    sample = StratifiedSample.build(tracks, fraction=0.05)
+    counts = Progressive(
+        sample.duration_counts(),
+        lambda: duration_counts(tracks).collect(),
+        on_exact=lambda _: rerun(),
+    )
+    value, exact = counts.get()  # the estimate, False; later the counts, True
+"""
+
+import math
+import threading
+from collections.abc import Callable, Iterable, Sequence
+from concurrent.futures import Future
+from typing import Any
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify.pipeline import ROW_ID, genre_listings
+
+# Normal quantile of the two-sided 95% bounds
+Z_95 = 1.959964
+WEIGHT = "sample_weight"
+DEFAULT_QUANTILES = (0.0, 0.01, 0.5, 0.99, 1.0)
+
+
+def _uniform(seed: int) -> pl.Expr:
+    """A pseudo-random number in [0, 1) per track, from the hash of its row ID."""
+    # The top 53 bits of the hash, which a Float64 holds exactly
+    return (pl.col(ROW_ID).hash(seed) // (1 << 11)).cast(pl.Float64) / (1 << 53)
+
+
+class StratifiedSample:
+    """
+    A sample of the tracks of every genre, weighted to stand for all of them.
+
+    Args:
+        sample (pl.DataFrame): The sampled tracks, with their ``sample_weight``.
+        sizes (pl.DataFrame): The number of tracks (``len``) of each ``track_genre``.
+
+    Example:
+        >>> sample = StratifiedSample.build(tracks, fraction=0.05)
+        >>> sample.duration_counts()  # duration_seconds, count, count_error
+        >>> sample.genre_means(duration_in_range(120, 360))
+    """
+
+    def __init__(self, sample: pl.DataFrame, sizes: pl.DataFrame) -> None:
+        self.sample = sample
+        self.sizes = sizes
+
+    @classmethod
+    def build(
+        cls,
+        tracks: pl.DataFrame | pl.LazyFrame,
+        fraction: float = 0.05,
+        *,
+        min_rows: int = 100,
+        seed: int = 0,
+        streaming: bool = False,
+    ) -> "StratifiedSample":
+        """
+        Sample the cleaned tracks, genre by genre.
+
+        Only the number of tracks of each genre is counted over the whole table,
+        which is far cheaper than the aggregations estimated from the sample.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): The cleaned tracks, with a
+                ``row_id``. In the per-track view, a track is sampled at the rate
+                of its first genre.
+            fraction (float): The share of the tracks of each genre to keep.
+            min_rows (int): Keep at least about this many tracks of each genre (all
+                of them, for smaller genres).
+            seed (int): Seed of the hash, picking another sample.
+            streaming (bool): Run the queries with the streaming engine.
+
+        Returns:
+            StratifiedSample: The sampled tracks.
+
+        Raises:
+            ValueError: If ``fraction`` is not within (0, 1].
+        """
+        if not 0 < fraction <= 1:
+            raise ValueError(f"fraction must be within (0, 1], got {fraction}")
+        engine = "streaming" if streaming else "auto"
+        lf = tracks.lazy()
+        sizes = lf.group_by("track_genre").len().collect(engine=engine)
+        rates = sizes.select(
+            "track_genre",
+            pl.max_horizontal(pl.lit(fraction), min_rows / pl.col("len"))
+            .clip(upper_bound=1.0)
+            .alias("rate"),
+        )
+        sample = (
+            lf.join(rates.lazy(), on="track_genre", nulls_equal=True)
+            .filter(_uniform(seed) < pl.col("rate"))
+            .with_columns((1 / pl.col("rate")).alias(WEIGHT))
+            .drop("rate")
+            .collect(engine=engine)
+        )
+        return cls(sample, sizes)
+
+    @property
+    def population(self) -> int:
+        """The number of tracks the sample stands for."""
+        return int(self.sizes["len"].sum())
+
+    @property
+    def fraction(self) -> float:
+        """The share of the tracks that were sampled."""
+        return self.sample.height / max(self.population, 1)
+
+    def duration_counts(self, where: pl.Expr | None = None) -> pl.DataFrame:
+        """
+        Estimated number of tracks for each duration in seconds.
+
+        Args:
+            where (pl.Expr | None): Only count the tracks matching this predicate.
+
+        Returns:
+            pl.DataFrame: The columns of ``pipeline.duration_counts``, with the
+                ``count`` estimated, and ``count_error``, the half width of its 95%
+                bounds. Durations absent from the sample are missing.
+        """
+        lf = self._filtered(where)
+        return (
+            lf.group_by("duration_seconds")
+            .agg(
+                pl.col(WEIGHT).sum().alias("count"),
+                # The variance of a Horvitz-Thompson total: sum of (1 - p) / p² = w (w - 1)
+                (Z_95 * (pl.col(WEIGHT) * (pl.col(WEIGHT) - 1)).sum().sqrt()).alias(
+                    "count_error"
+                ),
+            )
+            .sort("duration_seconds")
+            .collect()
+        )
+
+    def genre_means(self, where: pl.Expr | None = None) -> pl.DataFrame:
+        """
+        Estimated average duration and popularity of each genre.
+
+        Args:
+            where (pl.Expr | None): Only average the tracks matching this predicate,
+                e.g. ``duration_in_range(min_dur, max_dur)``.
+
+        Returns:
+            pl.DataFrame: The columns of ``pipeline.genre_means``, with the
+                ``duration_seconds_error`` and ``popularity_error`` half widths of
+                their 95% bounds, and the estimated number of ``tracks``.
+        """
+        columns = ["duration_seconds", "popularity"]
+        lf = genre_listings(self._filtered(where))
+        w = pl.col(WEIGHT)
+
+        def mean(column: str) -> pl.Expr:
+            return (w * pl.col(column)).sum() / w.sum()
+
+        def error(column: str) -> pl.Expr:
+            # Linearized variance of the (Hájek) weighted mean
+            residual = pl.col(column) - mean(column)
+            variance = (w * (w - 1) * residual.pow(2)).sum() / w.sum().pow(2)
+            return (Z_95 * variance.sqrt()).alias(f"{column}_error")
+
+        return (
+            lf.group_by("track_genre")
+            .agg(
+                *[mean(column).round(2).alias(column) for column in columns],
+                *[error(column) for column in columns],
+                w.sum().alias("tracks"),
+            )
+            .sort("track_genre", descending=True)
+            .collect()
+        )
+
+    def _filtered(self, where: pl.Expr | None) -> pl.LazyFrame:
+        lf = self.sample.lazy()
+        return lf if where is None else lf.filter(where)
+
+
+def _registers(values: pl.Expr, precision: int) -> tuple[pl.Expr, pl.Expr]:
+    """The register of each hashed value, and the rank of its first set bit."""
+    hashed = values.hash(0)
+    rest = hashed & ((1 << (64 - precision)) - 1)
+    register = (hashed // (1 << (64 - precision))).cast(pl.UInt32).alias("register")
+    # The leading zeros after the register bits, plus one
+    rank = (rest.bitwise_leading_zeros() - precision + 1).cast(pl.UInt8).alias("rank")
+    return register, rank
+
+
+def _alpha(m: int) -> float:
+    """The bias correction of the raw HyperLogLog estimate for ``m`` registers."""
+    return {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+
+
+def _check_precision(precision: int) -> None:
+    if not 4 <= precision <= 18:
+        raise ValueError(f"precision must be within 4 and 18, got {precision}")
+
+
+class HyperLogLog:
+    """
+    Approximate count of distinct values, in ``2 ** precision`` bytes.
+
+    Each value is hashed: the first ``precision`` bits pick a register, which keeps
+    the longest run of leading zeros seen in the rest of the hash. Two sketches
+    merge by taking the largest value of each register, e.g. to combine shards.
+
+    Args:
+        precision (int): Number of bits picking the register, from 4 to 18. The
+            relative standard error is ``1.04 / sqrt(2 ** precision)``, 1.6% for 12.
+
+    Example:
+        >>> hll = HyperLogLog().add(tracks["track_name"])
+        >>> hll.estimate(), hll.bounds()
+    """
+
+    def __init__(self, precision: int = 12) -> None:
+        _check_precision(precision)
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def relative_error(self) -> float:
+        """The relative standard error of the estimate."""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, values: pl.Series | Iterable[Any]) -> "HyperLogLog":
+        """Add values (nulls are ignored), returning the sketch itself."""
+        if not isinstance(values, pl.Series):
+            values = pl.Series(list(values))
+        hashed = (
+            values.drop_nulls()
+            .to_frame("value")
+            .select(_registers(pl.col("value"), self.precision))
+        )
+        np.maximum.at(
+            self.registers, hashed["register"].to_numpy(), hashed["rank"].to_numpy()
+        )
+        return self
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Add the values of another sketch of the same precision."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precisions")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self) -> float:
+        """The estimated number of distinct values."""
+        m = len(self.registers)
+        zeros = int((self.registers == 0).sum())
+        raw = _alpha(m) * m * m / np.ldexp(1.0, -self.registers.astype(int)).sum()
+        # Linear counting is more accurate while many registers are still empty
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return float(raw)
+
+    def bounds(self) -> tuple[float, float]:
+        """The 95% bounds of the number of distinct values."""
+        estimate = self.estimate()
+        margin = Z_95 * self.relative_error * estimate
+        return max(estimate - margin, 0.0), estimate + margin
+
+
+def approx_n_unique(
+    tracks: pl.DataFrame | pl.LazyFrame,
+    column: str,
+    by: str | Sequence[str] | None = None,
+    *,
+    precision: int = 12,
+    streaming: bool = False,
+) -> pl.DataFrame:
+    """
+    HyperLogLog estimates of the number of distinct values of a column, per group.
+
+    The registers are aggregated with a ``group_by`` on the groups and the register,
+    so the values themselves are never collected into per-group sets.
+
+    Args:
+        tracks (pl.DataFrame | pl.LazyFrame): The tracks.
+        column (str): The column whose distinct values are counted.
+        by (str | Sequence[str] | None): The columns to group by, if any.
+        precision (int): The precision of the sketch of each group.
+        streaming (bool): Run the aggregation with the streaming engine.
+
+    Returns:
+        pl.DataFrame: The ``by`` columns, ``n_unique`` and its 95% bounds
+            ``n_unique_low`` and ``n_unique_high``.
+
+    Example:
+        >>> # About the `tracks_count` of `pipeline.most_popular_artists`
+        >>> approx_n_unique(explode_artists(tracks), "track_name", by="artists")
+    """
+    _check_precision(precision)
+    keys = [] if by is None else [by] if isinstance(by, str) else list(by)
+    m = 1 << precision
+    rse = 1.04 / math.sqrt(m)
+    registers = (
+        tracks.lazy()
+        .filter(pl.col(column).is_not_null())
+        .select(*keys, *_registers(pl.col(column), precision))
+        .group_by(*keys, "register")
+        .agg(pl.col("rank").max())
+    )
+    sums = [
+        pl.lit(2.0).pow(-pl.col("rank").cast(pl.Float64)).sum().alias("harmonic"),
+        (m - pl.len()).alias("zeros"),
+    ]
+    grouped = registers.group_by(keys).agg(sums) if keys else registers.select(sums)
+    raw = _alpha(m) * m * m / (pl.col("harmonic") + pl.col("zeros"))
+    estimate = (
+        pl.when((raw <= 2.5 * m) & (pl.col("zeros") > 0))
+        .then(m * (m / pl.col("zeros").cast(pl.Float64)).log())
+        .otherwise(raw)
+    )
+    result = (
+        grouped.select(*keys, estimate.alias("n_unique"))
+        .with_columns(
+            (pl.col("n_unique") * (1 - Z_95 * rse))
+            .clip(lower_bound=0)
+            .alias("n_unique_low"),
+            (pl.col("n_unique") * (1 + Z_95 * rse)).alias("n_unique_high"),
+        )
+        .collect(engine="streaming" if streaming else "auto")
+    )
+    if not keys and result.is_empty():
+        return pl.DataFrame(
+            {"n_unique": [0.0], "n_unique_low": [0.0], "n_unique_high": [0.0]}
+        )
+    return result.sort(keys) if keys else result
+
+
+class QuantileSketch:
+    """
+    Approximate quantiles within a relative accuracy, in logarithmic buckets.
+
+    A positive value ``x`` is counted in bucket ``ceil(log(x) / log(gamma))``, with
+    ``gamma = (1 + a) / (1 - a)``, so every value of a bucket is within ``a`` of
+    its midpoint. Negative values are bucketed by their magnitude, and zeros are
+    counted apart. Sketches merge by adding the counts of their buckets.
+
+    Args:
+        relative_accuracy (float): The accuracy ``a`` of the quantiles, e.g. 0.01
+            for estimates within 1% of the exact values.
+
+    Example:
+        >>> sketch = QuantileSketch().add(tracks["duration_seconds"])
+        >>> sketch.quantile(0.99)  # (estimate, low, high)
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(
+                f"relative_accuracy must be within (0, 1), got {relative_accuracy}"
+            )
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: dict[int, int] = {}
+        self.negative: dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values: pl.Series | np.ndarray | Iterable[float]) -> "QuantileSketch":
+        """Add values (nulls and NaNs are ignored), returning the sketch itself."""
+        if isinstance(values, pl.Series):
+            values = values.drop_nulls().cast(pl.Float64).to_numpy()
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return self
+        self.count += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.zeros += int((values == 0).sum())
+        for store, magnitudes in [
+            (self.positive, values[values > 0]),
+            (self.negative, -values[values < 0]),
+        ]:
+            keys = np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+            for key, count in zip(*np.unique(keys, return_counts=True)):
+                store[int(key)] = store.get(int(key), 0) + int(count)
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """Add the values of another sketch of the same accuracy."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches of different accuracies")
+        for store, others in [
+            (self.positive, other.positive),
+            (self.negative, other.negative),
+        ]:
+            for key, count in others.items():
+                store[key] = store.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> tuple[float, float, float]:
+        """
+        The estimated ``q`` quantile, and the bounds of the exact value.
+
+        The exact value is the one of rank ``floor(q * (count - 1))`` among the
+        sorted values, as ``numpy.quantile(values, q, method="lower")``.
+
+        Args:
+            q (float): The quantile, from 0 to 1.
+
+        Returns:
+            tuple[float, float, float]: The estimate, and the lowest and highest
+                values the exact quantile can take.
+
+        Raises:
+            ValueError: If ``q`` is not within [0, 1] or the sketch is empty.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError(f"q must be within [0, 1], got {q}")
+        if not self.count:
+            raise ValueError("Cannot compute the quantile of an empty sketch")
+        rank = math.floor(q * (self.count - 1))
+        # The buckets in increasing order of their values
+        buckets = [
+            *(
+                (key, -1, self.negative[key])
+                for key in sorted(self.negative, reverse=True)
+            ),
+            (0, 0, self.zeros),
+            *((key, 1, self.positive[key]) for key in sorted(self.positive)),
+        ]
+        seen = 0
+        for key, sign, count in buckets:
+            seen += count
+            if seen > rank:
+                break
+        if sign == 0:
+            return 0.0, 0.0, 0.0
+        # The values of the bucket lie within (gamma ** (key - 1), gamma ** key]
+        high = self.gamma**key
+        low = high / self.gamma
+        estimate = 2 * high / (self.gamma + 1)
+        if sign < 0:
+            estimate, low, high = -estimate, -high, -low
+        low, high = max(low, self.min), min(high, self.max)
+        return min(max(estimate, low), high), low, high
+
+
+def duration_summary(
+    tracks: pl.DataFrame | pl.LazyFrame,
+    quantiles: Sequence[float] = DEFAULT_QUANTILES,
+    *,
+    relative_accuracy: float = 0.01,
+) -> pl.DataFrame:
+    """
+    Approximate quantiles of the track durations, e.g. to spot the extremes.
+
+    The durations are streamed through a ``QuantileSketch`` in batches, instead of
+    sorting them.
+
+    Args:
+        tracks (pl.DataFrame | pl.LazyFrame): The cleaned tracks.
+        quantiles (Sequence[float]): The quantiles to report, from 0 to 1.
+        relative_accuracy (float): The accuracy of the sketch.
+
+    Returns:
+        pl.DataFrame: The ``quantile``, the estimated ``duration_seconds`` and the
+            ``low`` and ``high`` bounds of the exact duration.
+    """
+    sketch = QuantileSketch(relative_accuracy)
+    for batch in tracks.lazy().select("duration_seconds").collect_batches():
+        sketch.add(batch["duration_seconds"])
+    rows = [(q, *sketch.quantile(q)) for q in quantiles] if sketch.count else []
+    return pl.DataFrame(
+        rows,
+        schema={
+            "quantile": pl.Float64,
+            "duration_seconds": pl.Float64,
+            "low": pl.Float64,
+            "high": pl.Float64,
+        },
+        orient="row",
+    )
+
+
+class Progressive:
+    """
+    An approximate result, replaced by the exact one once it is computed.
+
+    The exact result is computed on its own thread, started right away.
+
+    Args:
+        approximate (Any): The result to show in the meantime. If None, ``get``
+            waits for the exact result instead.
+        exact (Callable[[], Any]): Computes the exact result.
+        on_exact (Callable[[Any], None] | None): Called with the exact result, on
+            the background thread, once it is ready, e.g. to re-run the cells
+            showing it.
+        thread (Callable[..., threading.Thread]): The thread class, e.g.
+            ``mo.Thread`` in a marimo notebook, so that ``on_exact`` can set state.
+
+    Example:
+        >>> counts = Progressive(sample.duration_counts(), exact_duration_counts)
+        >>> value, exact = counts.get()
+    """
+
+    def __init__(
+        self,
+        approximate: Any,
+        exact: Callable[[], Any],
+        *,
+        on_exact: Callable[[Any], None] | None = None,
+        thread: Callable[..., threading.Thread] = threading.Thread,
+    ) -> None:
+        self.approximate = approximate
+        self.future: Future = Future()
+
+        def run() -> None:
+            try:
+                value = exact()
+            except BaseException as error:  # noqa: BLE001 - raised again by get()
+                self.future.set_exception(error)
+                return
+            self.future.set_result(value)
+            if on_exact is not None:
+                on_exact(value)
+
+        thread(target=run, daemon=True).start()
+
+    @property
+    def done(self) -> bool:
+        """Whether the exact result is ready (or failed)."""
+        return self.future.done()
+
+    def get(self) -> tuple[Any, bool]:
+        """
+        The exact result if ready, else the approximate one.
+
+        Returns:
+            tuple[Any, bool]: The result, and whether it is the exact one.
+
+        Raises:
+            Exception: The error of the exact computation, if it failed.
+        """
+        if self.approximate is None or self.future.done():
+            return self.future.result(), True
+        return self.approximate, False
+
+    def result(self, timeout: float | None = None) -> Any:
+        """The exact result, waiting for it."""
+        return self.future.result(timeout)
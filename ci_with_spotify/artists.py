@@ -0,0 +1,139 @@
+"""
+Normalized model of the artists of the tracks.
+
+The ``artists`` column holds ``;``-separated lists of names, which every
+artist-level query used to split and explode again. The ``ArtistModel`` does it
+once per dataset, into:
+
+- an artist dimension: the distinct names sorted lexically, the position of a name
+  being its integer artist ID (so comparing IDs is the same as comparing names);
+- a track-artist bridge table, with one row per artist of each track: the
+  ``row_id`` of the track and the ``artists`` name, as an Enum over the dimension
+  whose physical value is the artist ID.
+
+Artist-level queries then join the bridge on ``row_id`` and group on integer IDs
+instead of splitting strings. The dimension also has a sorted, lowercased index for
+prefix searches, which is what makes an artist picker feasible on a few hundred
+thousand names.
+"""
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify.pipeline import ROW_ID
+
+
+class ArtistModel:
+    """
+    The artist dimension and track-artist bridge table of a tracks table.
+
+    Args:
+        names (pl.Series): The distinct artist names, sorted, indexed by artist ID.
+        bridge (pl.DataFrame): The ``row_id`` and ``artists`` (an Enum over
+            ``names``) of every artist of every track, in the order of the tracks.
+
+    Example:
+        >>> artists = ArtistModel.build(df)
+        >>> artists.complete("tay")  # ["Taylor Swift", "Tayc", ...]
+        >>> most_popular_artists(df.lazy(), "pop", artists=artists)
+    """
+
+    def __init__(self, names: pl.Series, bridge: pl.DataFrame) -> None:
+        self.names = names.alias("artists")
+        self.bridge = bridge
+        self.dtype = pl.Enum(names)
+        # Sorted lowercased names, with the ID of each, for case-insensitive prefix searches
+        lower = self.names.str.to_lowercase()
+        self._order = lower.arg_sort()
+        self._lower = lower.gather(self._order)
+
+    @classmethod
+    def build(
+        cls, tracks: pl.DataFrame | pl.LazyFrame, *, streaming: bool = False
+    ) -> "ArtistModel":
+        """
+        Split the artists of the cleaned tracks, once.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): Tracks with (at least) the
+                ``row_id`` and ``artists`` columns.
+            streaming (bool): Collect the entries with the streaming engine.
+
+        Returns:
+            ArtistModel: The artists of the tracks.
+        """
+        entries = (
+            tracks.lazy()
+            .select(ROW_ID, pl.col("artists").cast(pl.String).str.split(";"))
+            .explode("artists")
+            # Tracks without artists have no entry at all
+            .drop_nulls("artists")
+            .collect(engine="streaming" if streaming else "auto")
+        )
+        names = entries["artists"].unique().sort()
+        return cls(names, entries.with_columns(pl.col("artists").cast(pl.Enum(names))))
+
+    def __len__(self) -> int:
+        return self.names.len()
+
+    def artist_id(self, name: str) -> int | None:
+        """ID of an artist (binary search over the sorted names), or None if unknown."""
+        position = self.names.search_sorted(name, side="left")
+        if position < self.names.len() and self.names[position] == name:
+            return position
+        return None
+
+    def complete(self, prefix: str, k: int = 50) -> list[str]:
+        """
+        The artists whose name starts with a prefix, ignoring case.
+
+        Args:
+            prefix (str): The start of the name, e.g. what was typed so far.
+            k (int): Maximum number of names to return.
+
+        Returns:
+            list[str]: The matching names, in lexical order of their lowercase form.
+        """
+        prefix = prefix.lower()
+        start = self._lower.search_sorted(prefix, side="left")
+        # No code point sorts after U+10FFFF, so this is past every name starting with the prefix
+        end = self._lower.search_sorted(prefix + "\U0010ffff", side="left")
+        return self.names.gather(self._order[start : min(end, start + k)]).to_list()
+
+    def explode(self, tracks: pl.LazyFrame) -> pl.LazyFrame:
+        """
+        The tracks with one row per artist, as ``str.split`` and ``explode`` would.
+
+        Args:
+            tracks (pl.LazyFrame): Any subset of the tracks the model was built on.
+
+        Returns:
+            pl.LazyFrame: The rows of the tracks, repeated for each of their artists,
+                with the name of that artist in ``artists`` (as an Enum).
+        """
+        columns = [name for name in tracks.collect_schema() if name != "artists"]
+        return tracks.select(columns).join(
+            self.bridge.lazy(), on=ROW_ID, maintain_order="left_right"
+        )
+
+    def entries(self, tracks: pl.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The artist IDs of each track, flattened.
+
+        Args:
+            tracks (pl.DataFrame): Any subset of the tracks the model was built on.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The artist IDs of every track back to back,
+                and the number of artists of each track.
+        """
+        joined = (
+            tracks.select(ROW_ID)
+            .with_row_index("position")
+            .join(self.bridge, on=ROW_ID, maintain_order="left_right")
+        )
+        ids = joined["artists"].to_physical().to_numpy().astype(np.uint32)
+        counts = np.bincount(
+            joined["position"].to_numpy(), minlength=tracks.height
+        ).astype(np.int64)
+        return ids, counts
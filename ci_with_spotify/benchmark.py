@@ -0,0 +1,417 @@
+"""
+Offline benchmarks of every stage of the notebook, on synthetic data.
+
+Each stage is timed on tables of ``synthetic.synthetic_tracks`` at one or more
+sizes, and the best of a few repeats is kept. The results are written as JSON and
+compared against a stored baseline, flagging the stages that got slower than the
+tolerance allows. Run it with::
+
+    python -m ci_with_spotify.benchmark --sizes 100k,1M,10M --output results.json
+    python -m ci_with_spotify.benchmark --save-baseline  # store benchmarks/baseline.json
+    python -m ci_with_spotify.benchmark --baseline benchmarks/baseline.json
+
+The command exits with status 1 if any regression is found, so it can gate CI.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Iterable
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.aggregations import PopularArtists
+from ci_with_spotify.approx import StratifiedSample, approx_n_unique, duration_summary
+from ci_with_spotify.artists import ArtistModel
+from ci_with_spotify.cache import TracksCache
+from ci_with_spotify.classifier import GenreClassifier
+from ci_with_spotify.collaborations import CollaborationIndex
+from ci_with_spotify.crossfilter import Crossfilter
+from ci_with_spotify.density import scatter_frame
+from ci_with_spotify.search import SearchIndex
+from ci_with_spotify.similarity import SimilarityIndex
+from ci_with_spotify.synthetic import synthetic_tracks
+from ci_with_spotify.trendline import lowess
+from ci_with_spotify.utils import get_extremes
+
+DEFAULT_SIZES = [100_000, 1_000_000, 10_000_000]
+DEFAULT_BASELINE = Path("benchmarks") / "baseline.json"
+SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+class BenchmarkData:
+    """
+    The inputs shared by the stages at one size.
+
+    Args:
+        rows (int): Number of synthetic tracks.
+        workdir (Path): Directory for the source parquet file and the cache.
+        seed (int): Seed of the synthetic data.
+    """
+
+    def __init__(self, rows: int, workdir: Path, seed: int = 0) -> None:
+        self.rows = rows
+        self.source = workdir / f"tracks-{rows}.parquet"
+        synthetic_tracks(rows, seed).write_parquet(self.source)
+        self.cache = TracksCache(workdir / "cache")
+        self.tracks = self.cache.load(self.source)
+        self.lazy = self.tracks.lazy()
+        self.genre = self.tracks["track_genre"][0]
+        self._indexes: dict[str, Any] = {}
+
+    def index(self, name: str, build: Callable[[], Any]) -> Any:
+        """An index built once, so the stages querying it do not time the build."""
+        if name not in self._indexes:
+            self._indexes[name] = build()
+        return self._indexes[name]
+
+
+Stage = Callable[[BenchmarkData], Any]
+STAGES: dict[str, Stage] = {}
+
+
+def stage(name: str) -> Callable[[Stage], Stage]:
+    """Register a function as a benchmarked stage."""
+
+    def register(function: Stage) -> Stage:
+        STAGES[name] = function
+        return function
+
+    return register
+
+
+@stage("load_clean")
+def _load_clean(data: BenchmarkData) -> Any:
+    return pipeline.clean_tracks(pipeline.scan_tracks(str(data.source))).collect()
+
+
+@stage("load_cached")
+def _load_cached(data: BenchmarkData) -> Any:
+    return data.cache.load(data.source)
+
+
+@stage("duration_filter")
+def _duration_filter(data: BenchmarkData) -> Any:
+    counts = pipeline.duration_counts(data.lazy).collect()
+    # Stands in for the bars selected in the histogram
+    selection = counts.filter(pl.col("duration_seconds").is_between(120, 360))
+    min_dur, max_dur = get_extremes(selection, "duration_seconds", (120, 360))
+    return pipeline.filter_duration(data.lazy, min_dur, max_dur).collect()
+
+
+@stage("most_popular_artists")
+def _most_popular_artists(data: BenchmarkData) -> Any:
+    return pipeline.most_popular_artists(data.lazy, data.genre).collect()
+
+
+@stage("popular_artists_build")
+def _popular_artists_build(data: BenchmarkData) -> Any:
+    return PopularArtists.build(data.lazy)
+
+
+@stage("popular_artists_lookup")
+def _popular_artists_lookup(data: BenchmarkData) -> Any:
+    popular = data.index("popular", lambda: PopularArtists.build(data.lazy))
+    # A genre that was not looked up yet, as after changing the dropdown
+    popular.cache.clear()
+    return popular.get(data.genre)
+
+
+@stage("genre_scatter")
+def _genre_scatter(data: BenchmarkData) -> Any:
+    return pipeline.genre_means(data.lazy).collect()
+
+
+@stage("approx_sample_build")
+def _approx_sample_build(data: BenchmarkData) -> Any:
+    return StratifiedSample.build(data.lazy)
+
+
+@stage("approx_duration_histogram")
+def _approx_duration_histogram(data: BenchmarkData) -> Any:
+    sample = data.index("sample", lambda: StratifiedSample.build(data.lazy))
+    return sample.duration_counts()
+
+
+@stage("approx_genre_scatter")
+def _approx_genre_scatter(data: BenchmarkData) -> Any:
+    sample = data.index("sample", lambda: StratifiedSample.build(data.lazy))
+    return sample.genre_means()
+
+
+@stage("approx_tracks_count")
+def _approx_tracks_count(data: BenchmarkData) -> Any:
+    return approx_n_unique(
+        pipeline.explode_artists(data.lazy), "track_name", by="artists"
+    )
+
+
+@stage("approx_duration_summary")
+def _approx_duration_summary(data: BenchmarkData) -> Any:
+    return duration_summary(data.lazy)
+
+
+@stage("scatter_density")
+def _scatter_density(data: BenchmarkData) -> Any:
+    return scatter_frame(data.tracks, "energy", "danceability", "loudness")
+
+
+@stage("trendline")
+def _trendline(data: BenchmarkData) -> Any:
+    return lowess(
+        data.tracks["energy"].to_numpy(), data.tracks["danceability"].to_numpy()
+    )
+
+
+@stage("match_tracks")
+def _match_tracks(data: BenchmarkData) -> Any:
+    return pipeline.match_tracks(data.lazy, artist="artist 1", track="love").collect()
+
+
+@stage("search_index_build")
+def _search_index_build(data: BenchmarkData) -> Any:
+    return SearchIndex.build(data.tracks)
+
+
+@stage("search_index_query")
+def _search_index_query(data: BenchmarkData) -> Any:
+    index = data.index("search", lambda: SearchIndex.build(data.tracks))
+    return index.search(artist="artist 1", track="love")
+
+
+@stage("artist_model_build")
+def _artist_model_build(data: BenchmarkData) -> Any:
+    return ArtistModel.build(data.tracks)
+
+
+@stage("artist_combinations")
+def _artist_combinations(data: BenchmarkData) -> Any:
+    return pipeline.artist_combinations(data.lazy).collect()
+
+
+@stage("collaboration_index_build")
+def _collaboration_index_build(data: BenchmarkData) -> Any:
+    return CollaborationIndex.build(data.lazy)
+
+
+@stage("collaboration_index_pairs")
+def _collaboration_index_pairs(data: BenchmarkData) -> Any:
+    index = data.index("collaborations", lambda: CollaborationIndex.build(data.lazy))
+    return index.top_collaborators("Artist 1", data.genre)
+
+
+@stage("similarity_index_build")
+def _similarity_index_build(data: BenchmarkData) -> Any:
+    return SimilarityIndex.build(data.tracks)
+
+
+@stage("similarity_query")
+def _similarity_query(data: BenchmarkData) -> Any:
+    index = data.index("similarity", lambda: SimilarityIndex.build(data.tracks))
+    # A batch of tracks, as when looking up the neighbours of a plot selection
+    return index.similar(data.tracks[pipeline.ROW_ID].head(100), k=10)
+
+
+@stage("genre_classifier_fit")
+def _genre_classifier_fit(data: BenchmarkData) -> Any:
+    return GenreClassifier.fit(data.lazy)
+
+
+@stage("genre_classifier_score")
+def _genre_classifier_score(data: BenchmarkData) -> Any:
+    classifier = data.index("classifier", lambda: GenreClassifier.fit(data.lazy))
+    return classifier.predict(data.tracks)
+
+
+CROSSFILTER_COLUMNS = ["duration_seconds", "popularity", "energy", "tempo", "valence"]
+
+
+@stage("crossfilter_build")
+def _crossfilter_build(data: BenchmarkData) -> Any:
+    return Crossfilter(data.tracks, CROSSFILTER_COLUMNS)
+
+
+@stage("crossfilter_brush")
+def _crossfilter_brush(data: BenchmarkData) -> Any:
+    cf = data.index(
+        "crossfilter", lambda: Crossfilter(data.tracks, CROSSFILTER_COLUMNS)
+    )
+    cf.brush("tempo", (90, 150))
+    # Dragging a brush a few steps, then letting go of both
+    for low in [0.30, 0.32, 0.34, 0.36]:
+        cf.brush("energy", (low, low + 0.4))
+    histograms = cf.histograms()
+    cf.clear()
+    return histograms
+
+
+def time_stage(function: Stage, data: BenchmarkData, repeats: int = 3) -> float:
+    """Best wall time of a few runs of a stage, in seconds."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(
+    sizes: Iterable[int] = DEFAULT_SIZES,
+    stages: Iterable[str] | None = None,
+    repeats: int = 3,
+    seed: int = 0,
+    log: Callable[[str], None] | None = print,
+) -> dict[str, Any]:
+    """
+    Time the stages at each size.
+
+    Args:
+        sizes (Iterable[int]): Numbers of rows of the synthetic tables.
+        stages (Iterable[str] | None): Names of the stages to run, all by default.
+        repeats (int): Number of runs of each stage, the fastest one is kept.
+        seed (int): Seed of the synthetic data.
+        log (Callable[[str], None] | None): Called with a line per timed stage.
+
+    Returns:
+        dict[str, Any]: The ``metadata`` of the run and a list of ``results``, each
+            with the ``stage``, the number of ``rows`` and the ``seconds`` it took.
+    """
+    names = list(STAGES) if stages is None else list(stages)
+    unknown = set(names) - set(STAGES)
+    if unknown:
+        raise ValueError(
+            f"Unknown stages {sorted(unknown)}, choose from {list(STAGES)}"
+        )
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in sizes:
+            data = BenchmarkData(rows, Path(workdir), seed)
+            for name in names:
+                seconds = time_stage(STAGES[name], data, repeats)
+                results.append({"stage": name, "rows": rows, "seconds": seconds})
+                if log is not None:
+                    log(f"{name:>24} {rows:>12,} rows {seconds * 1_000:>12.1f} ms")
+            del data
+    return {"metadata": _metadata(seed, repeats), "results": results}
+
+
+def compare(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    tolerance: float = 0.25,
+    min_delta: float = 0.005,
+) -> list[dict[str, Any]]:
+    """
+    The stages that got slower than a baseline.
+
+    Args:
+        results (dict[str, Any]): The output of ``run``.
+        baseline (dict[str, Any]): A previous output of ``run``.
+        tolerance (float): Allowed relative slowdown, 0.25 allows 25% more time.
+        min_delta (float): Slowdowns of fewer seconds than this are ignored, as
+            they are mostly noise.
+
+    Returns:
+        list[dict[str, Any]]: The ``stage``, ``rows``, ``seconds``, ``baseline``
+            and ``ratio`` of each regression. Stages missing from the baseline are
+            not compared.
+    """
+    previous = {(r["stage"], r["rows"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        before = previous.get((result["stage"], result["rows"]))
+        if before is None:
+            continue
+        seconds = result["seconds"]
+        if seconds > before * (1 + tolerance) and seconds - before > min_delta:
+            regressions.append(
+                {**result, "baseline": before, "ratio": seconds / max(before, 1e-12)}
+            )
+    return regressions
+
+
+def parse_size(size: str) -> int:
+    """Parse a number of rows such as ``"100k"``, ``"1M"`` or ``"250000"``."""
+    size = size.strip().lower().replace("_", "")
+    if size and size[-1] in SUFFIXES:
+        return int(float(size[:-1]) * SUFFIXES[size[-1]])
+    return int(size)
+
+
+def _metadata(seed: int, repeats: int) -> dict[str, Any]:
+    return {
+        "created": datetime.now(UTC).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "repeats": repeats,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--sizes",
+        default="100k,1M,10M",
+        help="Comma separated numbers of rows (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stages", help=f"Comma separated stages (default: all of {', '.join(STAGES)})"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="Compare the results against this file, exit with 1 on regressions",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help=f"Store the results as the baseline (default: {DEFAULT_BASELINE})",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run(
+        [parse_size(size) for size in args.sizes.split(",")],
+        args.stages.split(",") if args.stages else None,
+        repeats=args.repeats,
+        seed=args.seed,
+    )
+    outputs = [args.output] if args.output else []
+    if args.save_baseline:
+        outputs.append(args.baseline or DEFAULT_BASELINE)
+    for output in outputs:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+
+    if args.baseline and not args.save_baseline:
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for r in regressions:
+            print(
+                f"REGRESSION {r['stage']} at {r['rows']:,} rows: {r['seconds']:.3f}s "
+                f"vs {r['baseline']:.3f}s ({r['ratio']:.2f}x)"
+            )
+        if regressions:
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Caches for the cleaned tracks table and for derived results.
+
+``TracksCache`` is a persistent on-disk cache of the cleaned tracks table, read
+from a parquet file or from a glob or directory of shards.
+
+The cleaned table is stored as an uncompressed Arrow IPC file, which Polars can
+memory-map without copying or decoding anything, so a warm start only costs a
+few milliseconds instead of a full parquet decode plus the cleaning steps.
+
+Each entry is keyed by a hash of the contents of the source files and of the
+transform definition (its optimized query plan), so editing either invalidates it.
+Entries for the same source with an outdated key are evicted as soon as a new one
+is written, and the least recently used entries are evicted once the cache holds
+more than ``max_entries`` files.
+
+``LRUCache`` is a small in-memory, thread-safe cache for derived results, such as
+the per-genre aggregations shown in the notebook.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from pathlib import Path
+from typing import Any
+
+import polars as pl
+
+from ci_with_spotify.ingest import shard_paths
+from ci_with_spotify.pipeline import clean_tracks, scan_tracks, source_fingerprint
+
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get("SPOTIFY_EDA_CACHE_DIR", Path.home() / ".cache" / "ci-with-spotify")
+)
+
+Transform = Callable[[pl.LazyFrame], pl.LazyFrame]
+
+
+def file_digest(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of the contents of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def transform_digest(transform: Transform, schema: pl.Schema) -> str:
+    """
+    Hash of the query plan a transform produces for an input schema.
+
+    The plan is built on an empty frame, so this does not read any data. It
+    changes whenever the transform's filters, column selections or expressions
+    change, and also when Polars is upgraded (which may change the IPC layout).
+    """
+    plan = transform(pl.LazyFrame(schema=schema)).serialize()
+    return hashlib.sha256(plan + pl.__version__.encode()).hexdigest()
+
+
+def source_version(source: str | Path, transform: Transform = clean_tracks) -> str:
+    """
+    Identifies a transformed source without reading its data, unlike ``TracksCache.key``.
+
+    It changes with the paths, sizes and modification times of the files, and with
+    the transform's query plan, e.g. to key results derived from the tracks when
+    they are never loaded into the cache (with the streaming engine).
+
+    Args:
+        source (str | Path): Parquet file, glob or directory holding the raw tracks.
+        transform (Transform): The cleaning steps.
+
+    Returns:
+        str: A hex digest.
+    """
+    fingerprint = json.dumps(source_fingerprint(source))
+    schema = pl.scan_parquet(source).collect_schema()
+    transform_key = transform_digest(transform, pl.Schema(schema))
+    combined = f"{fingerprint}:{transform_key}".encode()
+    return hashlib.sha256(combined).hexdigest()[:32]
+
+
+class TracksCache:
+    """
+    Memory-mapped Arrow IPC cache of transformed source files.
+
+    Args:
+        cache_dir (str | Path): Directory holding the cached files, created on demand.
+            Defaults to ``$SPOTIFY_EDA_CACHE_DIR`` or ``~/.cache/ci-with-spotify``.
+        max_entries (int): Maximum number of cached tables to keep around.
+
+    Example:
+        >>> cache = TracksCache()
+        >>> df = cache.load("input/tracks.parquet")  # decodes and cleans once
+        >>> df = cache.load("input/tracks.parquet")  # memory-mapped from now on
+    """
+
+    def __init__(
+        self, cache_dir: str | Path = DEFAULT_CACHE_DIR, max_entries: int = 8
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+
+    def key(self, source: str | Path, transform: Transform = clean_tracks) -> str:
+        """Cache key for a source file and a transform."""
+        source_digest = self._source_digest(Path(source))
+        # Also holds the partition columns of a hive-partitioned directory
+        schema = pl.scan_parquet(source).collect_schema()
+        transform_key = transform_digest(transform, pl.Schema(schema))
+        combined = f"{source_digest}:{transform_key}".encode()
+        return hashlib.sha256(combined).hexdigest()[:32]
+
+    def path(self, source: str | Path, transform: Transform = clean_tracks) -> Path:
+        """Location of the cached table for a source file and a transform."""
+        return (
+            self.cache_dir
+            / f"{self._source_id(source)}-{self.key(source, transform)}.arrow"
+        )
+
+    def load(
+        self,
+        source: str | Path,
+        transform: Transform = clean_tracks,
+        *,
+        streaming: bool = False,
+    ) -> pl.DataFrame:
+        """
+        Load the transformed source, computing and caching it on a miss.
+
+        Args:
+            source (str | Path): Path to the source parquet file, or a glob or
+                directory of parquet shards.
+            transform (Transform): The transform to apply to the scanned source.
+            streaming (bool): Compute a missing entry with the streaming engine.
+
+        Returns:
+            pl.DataFrame: The transformed table, backed by a memory-mapped file.
+        """
+        path = self.path(source, transform)
+        if path.exists():
+            path.touch()
+        else:
+            df = transform(scan_tracks(source)).collect(
+                engine="streaming" if streaming else "auto"
+            )
+            self._write(df, path)
+            self._evict(keep=path)
+        return pl.read_ipc(path, memory_map=True, rechunk=False)
+
+    def clear(self) -> None:
+        """Remove every cached table and remembered source digest."""
+        for entry in [*self._entries(), *self.cache_dir.glob("*.digest.json")]:
+            entry.unlink(missing_ok=True)
+
+    def _write(self, df: pl.DataFrame, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so a crash never leaves a half-written entry behind.
+        # Its name is unique, as several threads (the warm-up pool, the notebook, the query
+        # service) may write the same entry at once.
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=f".{path.stem}-", suffix=".tmp", delete=False
+        ) as f:
+            tmp = Path(f.name)
+        try:
+            # A single uncompressed record batch can be memory-mapped as one chunk
+            df.rechunk().write_ipc(tmp, compression="uncompressed")
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def _evict(self, keep: Path) -> None:
+        source_id = keep.name.split("-", 1)[0]
+        entries = []
+        for entry in self._entries():
+            if entry == keep:
+                continue
+            if entry.name.startswith(f"{source_id}-"):
+                # A stale entry for the same source
+                entry.unlink(missing_ok=True)
+            else:
+                entries.append(entry)
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[self.max_entries - 1 :]:
+            entry.unlink(missing_ok=True)
+
+    def _entries(self) -> list[Path]:
+        if not self.cache_dir.exists():
+            return []
+        return list(self.cache_dir.glob("*.arrow"))
+
+    @staticmethod
+    def _source_id(source: str | Path) -> str:
+        resolved = str(Path(source).resolve())
+        return hashlib.sha256(resolved.encode()).hexdigest()[:16]
+
+    def _source_digest(self, source: Path) -> str:
+        # Hashing a large source on every start would defeat the purpose, so remember the
+        # digest for as long as its files, their sizes and modification times are unchanged.
+        files = shard_paths(source)
+        fingerprint = [
+            [str(path), stat.st_size, stat.st_mtime_ns]
+            for path, stat in zip(files, map(os.stat, files))
+        ]
+        index = self.cache_dir / f"{self._source_id(source)}.digest.json"
+        try:
+            cached = json.loads(index.read_text())
+            if cached["fingerprint"] == fingerprint:
+                return cached["digest"]
+        except (OSError, ValueError, KeyError):
+            pass
+        if len(files) == 1:
+            digest = file_digest(files[0])
+        else:
+            # The paths are part of the data too, e.g. the genre of a hive partition
+            root = os.path.commonpath(files)
+            combined = hashlib.sha256()
+            for path in files:
+                combined.update(os.path.relpath(path, root).encode())
+                combined.update(file_digest(path).encode())
+            digest = combined.hexdigest()
+        index.parent.mkdir(parents=True, exist_ok=True)
+        index.write_text(json.dumps({"fingerprint": fingerprint, "digest": digest}))
+        return digest
+
+
+class LRUCache:
+    """
+    In-memory mapping that evicts the least recently used entries.
+
+    Args:
+        max_entries (int): Maximum number of entries to keep.
+
+    Example:
+        >>> cache = LRUCache(max_entries=2)
+        >>> cache.get_or_compute("pop", lambda: expensive_aggregation("pop"))
+    """
+
+    def __init__(self, max_entries: int = 32) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """The value of a key (marking it as recently used), or ``default``."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry if the cache is full."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """The value of a key, computing and storing it on a miss."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            # Computed outside of the lock, so slow computations do not block other keys
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def discard(self, key: Hashable) -> None:
+        """Remove the entry of a key, if there is one, e.g. after its inputs changed."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,398 @@
+"""
+Nearest-centroid genre classifier over the audio features.
+
+A baseline answer to the notebook's "Can you classify a song's genre based on its
+attributes?", built to score unlabelled dumps of millions of tracks:
+
+- training is a single grouped aggregation: the mean and standard deviation of
+  each feature (to standardize them, so ``tempo`` does not outweigh the 0 ~ 1
+  features) and the mean of each genre, its centroid. It runs on a LazyFrame, so
+  with the streaming engine the training tracks do not need to fit in memory;
+- scoring standardizes a batch of tracks into a contiguous ``Float32`` matrix, and
+  its squared distances to every centroid, ``|x|² - 2 x·c + |c|²``, take a single
+  matrix product per block of rows;
+- ``score_shards`` reads each parquet shard of a dump in batches with the streaming
+  engine and writes the predictions of each batch to its own file, so the memory
+  used depends on the batch size, not on the size of the dump;
+- the rows and seconds of the training and of every scoring call are added up in
+  ``stats``, and ``throughput`` reports them as rows per second, to size batch
+  jobs::
+
+    classifier = GenreClassifier.fit(filtered_duration)
+    classifier.evaluate(held_out)  # {"accuracy": ..., "top_k_accuracy": ...}
+    classifier.score_shards("dumps/*.parquet", "predictions/")
+    classifier.throughput()
+"""
+
+import os
+import time
+from collections.abc import Iterator, Sequence
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify.cache import Transform
+from ci_with_spotify.ingest import shard_paths
+from ci_with_spotify.pipeline import (
+    GENRES,
+    ROW_ID,
+    SOURCE_INDEX,
+    clean_tracks,
+    genre_listings,
+    is_unique_view,
+    row_id_offsets,
+)
+from ci_with_spotify.schema import FEATURES
+
+# The numeric columns of the notebook's scatter plot
+CLASSIFIER_FEATURES = ["duration_seconds", "popularity", "key", "mode", *FEATURES]
+# Rows per block of the distance computation, bounding its temporary matrix
+CHUNK = 8_192
+DEFAULT_BATCH_SIZE = 100_000
+
+
+class GenreClassifier:
+    """
+    Assigns each track to the genre whose average (standardized) features are closest.
+
+    Args:
+        features (Sequence[str]): The names of the feature columns.
+        genres (Sequence[str]): The genre of each centroid.
+        mean (np.ndarray): The mean of each feature, used to standardize the tracks.
+        scale (np.ndarray): The standard deviation of each feature.
+        centroids (np.ndarray): The ``(n_genres, d)`` standardized genre means.
+
+    Attributes:
+        stats (dict[str, dict[str, float]]): The ``rows`` and ``seconds`` spent in
+            ``fit`` and in scoring, summed over the calls.
+
+    Example:
+        >>> classifier = GenreClassifier.fit(tracks)
+        >>> classifier.predict(unlabelled, k=3)  # the 3 closest genres of each track
+    """
+
+    def __init__(
+        self,
+        features: Sequence[str],
+        genres: Sequence[str],
+        mean: np.ndarray,
+        scale: np.ndarray,
+        centroids: np.ndarray,
+    ) -> None:
+        self.features = list(features)
+        self.genres = pl.Series("genre", list(genres), dtype=pl.String)
+        self.mean = mean
+        self.scale = scale
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        self.stats: dict[str, dict[str, float]] = {}
+
+    @classmethod
+    def fit(
+        cls,
+        tracks: pl.DataFrame | pl.LazyFrame,
+        features: Sequence[str] = CLASSIFIER_FEATURES,
+        *,
+        streaming: bool = False,
+    ) -> "GenreClassifier":
+        """
+        Compute the genre centroids of labelled tracks.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): Cleaned tracks with a
+                ``track_genre`` and the feature columns, per listing or per unique
+                track (where a track counts towards each of its genres).
+            features (Sequence[str]): The columns to classify the tracks on.
+            streaming (bool): Run the aggregation with the streaming engine.
+
+        Returns:
+            GenreClassifier: The fitted classifier.
+
+        Raises:
+            ValueError: If there are no tracks.
+        """
+        start = time.perf_counter()
+        features = list(features)
+        listings = genre_listings(tracks.lazy()).select(
+            pl.col("track_genre").cast(pl.String), *features
+        )
+        moments, centroids = pl.collect_all(
+            [
+                listings.select(
+                    pl.len(),
+                    *[pl.col(f).mean().alias(f"mean_{f}") for f in features],
+                    *[pl.col(f).std(ddof=0).alias(f"std_{f}") for f in features],
+                ),
+                listings.group_by("track_genre")
+                .agg(pl.col(features).mean())
+                .sort("track_genre"),
+            ],
+            engine="streaming" if streaming else "auto",
+        )
+        rows = moments["len"][0]
+        if not rows:
+            raise ValueError("Cannot fit a genre classifier without tracks")
+        mean = np.nan_to_num(
+            moments.select(f"mean_{f}" for f in features).to_numpy()[0].astype(float)
+        )
+        scale = np.nan_to_num(
+            moments.select(f"std_{f}" for f in features).to_numpy()[0].astype(float)
+        )
+        # A constant feature does not tell the genres apart anyway (its computed
+        # deviation may be a rounding error away from zero)
+        scale[np.isclose(scale, 0)] = 1.0
+        centroids = centroids.drop_nulls("track_genre")
+        classifier = cls(
+            features,
+            centroids["track_genre"],
+            mean,
+            scale,
+            np.nan_to_num(
+                (centroids.select(features).to_numpy().astype(float) - mean) / scale
+            ),
+        )
+        classifier._record("fit", rows, time.perf_counter() - start)
+        return classifier
+
+    def __len__(self) -> int:
+        return len(self.genres)
+
+    def standardize(self, features: np.ndarray) -> np.ndarray:
+        """Standardize raw feature values, one row per track, missing values as the mean."""
+        features = np.atleast_2d(np.asarray(features, dtype=np.float32))
+        mean = self.mean.astype(np.float32)
+        scale = self.scale.astype(np.float32)
+        return np.nan_to_num((features - mean) / scale)
+
+    def nearest(
+        self, features: np.ndarray, k: int = 1
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The ``k`` closest genres of each of a batch of tracks.
+
+        Args:
+            features (np.ndarray): The ``(n, d)`` raw feature values, in the order of
+                ``features``.
+            k (int): Number of genres per track.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The ``(n, k)`` indices into ``genres``,
+                closest first, and the Euclidean distances in standardized units.
+        """
+        x = self.standardize(features)
+        k = max(1, min(k, len(self)))
+        indices = np.empty((len(x), k), dtype=np.int64)
+        distances = np.empty((len(x), k), dtype=np.float32)
+        for start in range(0, len(x), CHUNK):
+            block = x[start : start + CHUNK]
+            # The squared distances, minus the squared norm of the track, which is
+            # the same for every centroid and only added back to the k closest
+            squared = block @ self.centroids.T
+            squared *= -2
+            squared += self._norms
+            if k == 1:
+                top = squared.argmin(axis=1)[:, None]
+            elif k < len(self):
+                top = np.argpartition(squared, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(len(self)), squared.shape)
+            top_squared = np.take_along_axis(squared, top, axis=1)
+            top_squared += np.einsum("ij,ij->i", block, block)[:, None]
+            order = np.argsort(top_squared, axis=1, kind="stable")
+            indices[start : start + CHUNK] = np.take_along_axis(top, order, axis=1)
+            # Rounding can leave tiny negative squares for a track on a centroid
+            distances[start : start + CHUNK] = np.sqrt(
+                np.maximum(np.take_along_axis(top_squared, order, axis=1), 0)
+            )
+        return indices, distances
+
+    def predict(self, tracks: pl.DataFrame, k: int = 1) -> pl.DataFrame:
+        """
+        The predicted genre of each track.
+
+        Args:
+            tracks (pl.DataFrame): Tracks with the feature columns, and optionally
+                a ``row_id``, which is kept.
+            k (int): Number of genres per track.
+
+        Returns:
+            pl.DataFrame: One row per track, in the same order, with the closest
+                ``predicted_genre`` and its ``distance``, and with ``k > 1`` the
+                ``top_genres`` list, closest first.
+        """
+        start = time.perf_counter()
+        # Cast by Polars, so the matrix is built as Float32 directly
+        matrix = tracks.select(pl.col(self.features).cast(pl.Float32)).to_numpy()
+        indices, distances = self.nearest(matrix, k)
+        predictions = pl.DataFrame(
+            {
+                "predicted_genre": self.genres.gather(indices[:, 0]),
+                "distance": distances[:, 0],
+            }
+        )
+        if k > 1:
+            top = self.genres.gather(indices.ravel()).reshape(indices.shape)
+            predictions = predictions.with_columns(
+                top.arr.to_list().alias("top_genres")
+            )
+        if ROW_ID in tracks.columns:
+            predictions = predictions.insert_column(0, tracks[ROW_ID])
+        self._record("score", tracks.height, time.perf_counter() - start)
+        return predictions
+
+    def evaluate(
+        self, tracks: pl.DataFrame | pl.LazyFrame, k: int = 5
+    ) -> dict[str, Any]:
+        """
+        How often the predicted genre is right, on labelled tracks.
+
+        A track listed under several genres is right if the prediction is any of them.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): Labelled cleaned tracks, ideally
+                not the ones the classifier was fitted on.
+            k (int): Also report how often one of the ``k`` closest genres is right.
+
+        Returns:
+            dict[str, Any]: The number of ``rows``, the ``accuracy``, the
+                ``top_k_accuracy``, ``k`` and the accuracy of always predicting the
+                most frequent genre, as ``baseline_accuracy``.
+        """
+        df = tracks.lazy().collect()
+        if is_unique_view(df):
+            truth = pl.col(GENRES).cast(pl.List(pl.String))
+        else:
+            truth = pl.concat_list(pl.col("track_genre").cast(pl.String))
+        truth = df.select(truth).to_series()
+        predictions = self.predict(df, k=max(k, 2))
+        scored = pl.DataFrame(
+            {"truth": truth, "predicted": predictions["predicted_genre"]}
+        ).with_columns(predictions["top_genres"].list.head(k))
+        most_frequent = truth.explode().mode().sort().first() if df.height else None
+        rates = scored.select(
+            pl.col("truth").list.contains(pl.col("predicted")).mean().alias("accuracy"),
+            (pl.col("truth").list.set_intersection("top_genres").list.len() > 0)
+            .mean()
+            .alias("top_k_accuracy"),
+            pl.col("truth")
+            .list.contains(pl.lit(most_frequent, dtype=pl.String))
+            .mean()
+            .alias("baseline_accuracy"),
+        ).row(0, named=True)
+        return {"rows": df.height, "k": k, **rates}
+
+    def score_batches(
+        self,
+        source: str | Path,
+        transform: Transform = clean_tracks,
+        *,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        k: int = 1,
+    ) -> Iterator[tuple[Path, pl.DataFrame]]:
+        """
+        Predict the genres of the tracks of every shard, a batch at a time.
+
+        Args:
+            source (str | Path): Parquet file, glob or directory of raw tracks.
+            transform (Transform): The cleaning steps, applied to each shard. They
+                must only filter or derive columns row by row, as ``clean_tracks``.
+            batch_size (int): About the number of tracks scored at once.
+            k (int): Number of genres per track.
+
+        Yields:
+            tuple[Path, pl.DataFrame]: The shard and the ``predict`` output of one
+                of its batches, with the ``row_id`` of the tracks, unique across the
+                shards as in ``pipeline.scan_tracks``.
+        """
+        offsets = {
+            Path(path).resolve(): offset
+            for path, offset in row_id_offsets(source).items()
+        }
+        for path in shard_paths(source):
+            lf = pl.scan_parquet(path)
+            if offsets:
+                lf = lf.with_columns(pl.col(SOURCE_INDEX) + offsets[path.resolve()])
+            query = transform(lf).select(ROW_ID, *self.features)
+            for batch in query.collect_batches(chunk_size=batch_size):
+                if batch.height:
+                    yield path, self.predict(batch, k)
+
+    def score_shards(
+        self,
+        source: str | Path,
+        output: str | Path,
+        transform: Transform = clean_tracks,
+        *,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        k: int = 1,
+    ) -> dict[str, Any]:
+        """
+        Write the predicted genres of a dump as parquet, with bounded memory.
+
+        Each batch is written to ``<output>/<shard>-<batch>.parquet``, so only one
+        batch of tracks and predictions is held in memory at a time. The shard is
+        its path relative to the source, so the shards of a hive-partitioned
+        directory (``track_genre=<genre>/0.parquet``) are written to the same
+        partitions of the output.
+
+        Args:
+            source (str | Path): Parquet file, glob or directory of raw tracks.
+            output (str | Path): The directory to write, created if needed.
+            transform (Transform): The cleaning steps, applied to each shard.
+            batch_size (int): About the number of tracks scored at once.
+            k (int): Number of genres per track.
+
+        Returns:
+            dict[str, Any]: The written ``files``, the number of ``rows``, the
+                ``seconds`` it took end to end (reading and writing included) and
+                the resulting ``rows_per_second``.
+        """
+        start = time.perf_counter()
+        output = Path(output)
+        output.mkdir(parents=True, exist_ok=True)
+        paths = shard_paths(source)
+        root = Path(os.path.commonpath(paths)) if len(paths) > 1 else paths[0].parent
+        files, rows, batches = [], 0, {}
+        for path, predictions in self.score_batches(
+            source, transform, batch_size=batch_size, k=k
+        ):
+            batch = batches[path] = batches.get(path, -1) + 1
+            shard = path.relative_to(root)
+            target = output / shard.parent / f"{shard.stem}-{batch:05d}.parquet"
+            target.parent.mkdir(parents=True, exist_ok=True)
+            predictions.write_parquet(target)
+            files.append(str(target))
+            rows += predictions.height
+        seconds = time.perf_counter() - start
+        return {
+            "files": files,
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_second": rows / seconds if seconds else 0.0,
+        }
+
+    def throughput(self) -> pl.DataFrame:
+        """The rows, seconds and rows per second of the training and of the scoring."""
+        return pl.DataFrame(
+            [
+                {"stage": stage, **stats, "rows_per_second": _rate(stats)}
+                for stage, stats in self.stats.items()
+            ],
+            schema={
+                "stage": pl.String,
+                "rows": pl.Int64,
+                "seconds": pl.Float64,
+                "rows_per_second": pl.Float64,
+            },
+        )
+
+    def _record(self, stage: str, rows: int, seconds: float) -> None:
+        stats = self.stats.setdefault(stage, {"rows": 0, "seconds": 0.0})
+        stats["rows"] += rows
+        stats["seconds"] += seconds
+
+
+def _rate(stats: dict[str, float]) -> float:
+    return stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
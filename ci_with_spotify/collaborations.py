@@ -0,0 +1,279 @@
+"""
+Sparse artist co-occurrence counts.
+
+``pipeline.artist_combinations`` pairs every artist of a track with every other
+artist by exploding the artists list twice, which builds a cartesian product per
+track and has to be redone whenever the genre filter changes. The
+``CollaborationIndex`` instead reuses the integer artist IDs of the ``ArtistModel``,
+generates only the ``k * (k - 1) / 2`` pairs of each track with NumPy, and stores
+the pair counts of each genre as a sparse edge table (one row per non-zero
+entry of the co-occurrence matrix). Changing genre is then a dictionary lookup.
+
+Pair counts add up, so ``CollaborationIndex.update`` counts the pairs of a batch of
+new tracks on their own and adds them to the edge tables of the batch's genres.
+"""
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify.artists import ArtistModel
+from ci_with_spotify.pipeline import GENRES, ROW_ID, genre_listings, is_unique_view
+
+PAIR_SCHEMA = {"artists": pl.String, "other_artist": pl.String, "count": pl.UInt32}
+
+
+class CollaborationIndex:
+    """
+    Artist collaboration counts for every genre, built once.
+
+    Artist IDs are assigned in lexical order of the artist names, so the pairs are
+    stored as ``(artist_id, other_id)`` with ``artist_id > other_id``, mirroring the
+    ``artists > other_artist`` convention of ``pipeline.artist_combinations``.
+
+    Args:
+        artists (pl.Series): The artist names, sorted, indexed by artist ID.
+        edges (dict[str | None, pl.DataFrame]): The pair counts of each genre, with
+            the ``None`` key holding the counts over all genres. Each table has the
+            columns ``artist_id``, ``other_id`` and ``count``.
+
+    Example:
+        >>> index = CollaborationIndex.build(filtered_duration)
+        >>> index.pairs("pop")
+        >>> index.top_collaborators("Taylor Swift", k=5)
+    """
+
+    def __init__(
+        self, artists: pl.Series, edges: dict[str | None, pl.DataFrame]
+    ) -> None:
+        self.artists = artists
+        self.edges = edges
+        self._pairs: dict[str | None, pl.DataFrame] = {}
+
+    @classmethod
+    def build(
+        cls,
+        tracks: pl.DataFrame | pl.LazyFrame,
+        artists: ArtistModel | None = None,
+    ) -> "CollaborationIndex":
+        """
+        Build the index from the cleaned tracks.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): Tracks with (at least) the
+                ``row_id``, ``track_genre`` and ``;``-separated ``artists`` columns,
+                per listing or per unique track.
+            artists (ArtistModel | None): The artists of the tracks, whose IDs are
+                reused. Built from the tracks if omitted.
+
+        Returns:
+            CollaborationIndex: The collaboration counts of every genre.
+        """
+        unique = is_unique_view(tracks)
+        columns = [ROW_ID, "track_genre", "artists", *([GENRES] if unique else [])]
+        tracks = tracks.lazy().select(columns).collect()
+        if artists is None:
+            artists = ArtistModel.build(tracks)
+        names = artists.names
+        n = np.uint64(max(names.len(), 1))
+        listings = genre_listings(tracks.lazy()).collect() if unique else tracks
+        genre_codes, genre_names = _encode(listings["track_genre"].cast(pl.String))
+        pair_keys, counts = _count_pairs(artists, listings, genre_codes, n)
+        bounds = np.searchsorted(pair_keys // (n * n), np.arange(len(genre_names) + 1))
+        pair_keys %= n * n
+
+        edges: dict[str | None, pl.DataFrame] = {
+            genre: _edge_table(pair_keys[start:end], counts[start:end], n)
+            for genre, start, end in zip(genre_names, bounds[:-1], bounds[1:])
+            if end > start
+        }
+        if unique:
+            # Summing the genres would count a track once per genre it is listed under
+            no_genre = np.zeros(tracks.height, dtype=np.uint32)
+            all_keys, all_counts = _count_pairs(artists, tracks, no_genre, n)
+        else:
+            all_keys, inverse = np.unique(pair_keys, return_inverse=True)
+            all_counts = np.bincount(inverse, weights=counts)
+        edges[None] = _edge_table(all_keys, all_counts, n)
+        return cls(names, edges)
+
+    def update(
+        self,
+        tracks: pl.DataFrame | pl.LazyFrame,
+        artists: ArtistModel | None = None,
+    ) -> list[str]:
+        """
+        Add the pairs of a batch of new tracks to the counts.
+
+        The artists of the batch that are new to the index get IDs among the
+        existing ones, in lexical order, so the edges of the genres the batch does
+        not touch are relabelled (a single gather), but never counted again.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): The new cleaned tracks, in the same
+                view as the tracks the index was built from.
+            artists (ArtistModel | None): The artists of the new tracks.
+
+        Returns:
+            list[str]: The genres of the batch, whose counts may have changed.
+        """
+        batch = CollaborationIndex.build(tracks, artists)
+        names = pl.concat([self.artists, batch.artists]).unique().sort()
+        if names.len() > self.artists.len():
+            # Both name lists are sorted, so the new IDs keep artist_id > other_id
+            relabel = names.search_sorted(self.artists).to_numpy()
+            self.edges = {
+                genre: _relabel(edges, relabel) for genre, edges in self.edges.items()
+            }
+            self.artists = names
+        relabel = names.search_sorted(batch.artists).to_numpy()
+        for genre, edges in batch.edges.items():
+            edges = _relabel(edges, relabel)
+            if genre in self.edges:
+                edges = (
+                    pl.concat([self.edges[genre], edges])
+                    .group_by("artist_id", "other_id")
+                    .agg(pl.col("count").sum())
+                )
+            self.edges[genre] = edges
+            self._pairs.pop(genre, None)
+        return sorted(genre for genre in batch.edges if genre is not None)
+
+    def pairs(self, genre: str | None = None) -> pl.DataFrame:
+        """
+        Collaboration counts of a genre, most frequent pairs first.
+
+        Args:
+            genre (str | None): The genre to look up, or None for all genres.
+
+        Returns:
+            pl.DataFrame: Columns ``artists``, ``other_artist`` and ``count``, in the
+                same format as ``pipeline.artist_combinations``.
+        """
+        if genre not in self._pairs:
+            edges = self.edges.get(genre)
+            if edges is None:
+                self._pairs[genre] = pl.DataFrame(schema=PAIR_SCHEMA)
+            else:
+                edges = edges.sort("count", "artist_id", descending=[True, False])
+                self._pairs[genre] = pl.DataFrame(
+                    {
+                        "artists": self._decode(edges["artist_id"]),
+                        "other_artist": self._decode(edges["other_id"]),
+                        "count": edges["count"],
+                    }
+                )
+        return self._pairs[genre]
+
+    def top_collaborators(
+        self, artist: str, genre: str | None = None, k: int = 10
+    ) -> pl.DataFrame:
+        """
+        The artists who most often appear on the same tracks as an artist.
+
+        Args:
+            artist (str): The artist name, matched exactly.
+            genre (str | None): Only count the tracks of this genre, if given.
+            k (int): Number of collaborators to return.
+
+        Returns:
+            pl.DataFrame: Columns ``collaborator`` and ``count``, most frequent first.
+        """
+        artist_id = self.artist_id(artist)
+        edges = self.edges.get(genre)
+        if artist_id is None or edges is None:
+            return pl.DataFrame(schema={"collaborator": pl.String, "count": pl.UInt32})
+        top = (
+            edges.filter(
+                (pl.col("artist_id") == artist_id) | (pl.col("other_id") == artist_id)
+            )
+            .select(
+                pl.when(pl.col("artist_id") == artist_id)
+                .then(pl.col("other_id"))
+                .otherwise(pl.col("artist_id"))
+                .alias("collaborator"),
+                "count",
+            )
+            .top_k(k, by="count")
+            .sort("count", "collaborator", descending=[True, False])
+        )
+        return top.with_columns(self._decode(top["collaborator"]))
+
+    def artist_id(self, artist: str) -> int | None:
+        """ID of an artist (binary search over the sorted names), or None if unknown."""
+        position = self.artists.search_sorted(artist, side="left")
+        if position < self.artists.len() and self.artists[position] == artist:
+            return position
+        return None
+
+    def _decode(self, ids: pl.Series) -> pl.Series:
+        return self.artists.gather(ids).alias(ids.name)
+
+
+def _count_pairs(
+    artists: ArtistModel, tracks: pl.DataFrame, genre_codes: np.ndarray, n: np.uint64
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The sorted, distinct ``(genre, artist, other artist)`` keys of the tracks'
+    artist pairs, packed into single integers, and the number of tracks of each.
+    """
+    codes, lengths = artists.entries(tracks)
+    artist_id, other_id, pair_genre = _pairs(codes, lengths, genre_codes)
+    keep = artist_id != other_id
+    # Pack (genre, artist, other artist) into a single integer key, so counting the
+    # pairs is a single sort and every genre ends up in a contiguous, sorted block
+    packed = (
+        pair_genre[keep].astype(np.uint64) * n + np.maximum(artist_id, other_id)[keep]
+    ) * n + np.minimum(artist_id, other_id)[keep]
+    return np.unique(packed, return_counts=True)
+
+
+def _relabel(edges: pl.DataFrame, ids: np.ndarray) -> pl.DataFrame:
+    """The edges with each artist ID replaced by ``ids[artist_id]``."""
+    return edges.with_columns(
+        pl.Series("artist_id", ids[edges["artist_id"].to_numpy()], dtype=pl.UInt32),
+        pl.Series("other_id", ids[edges["other_id"].to_numpy()], dtype=pl.UInt32),
+    )
+
+
+def _edge_table(
+    pair_keys: np.ndarray, counts: np.ndarray, n: np.uint64
+) -> pl.DataFrame:
+    return pl.DataFrame(
+        {
+            "artist_id": (pair_keys // n).astype(np.uint32),
+            "other_id": (pair_keys % n).astype(np.uint32),
+            "count": counts.astype(np.uint32),
+        }
+    )
+
+
+def _encode(values: pl.Series) -> tuple[np.ndarray, list[str]]:
+    categories = values.unique().sort()
+    codes = values.cast(pl.Enum(categories)).to_physical().to_numpy()
+    return codes.astype(np.uint32), categories.to_list()
+
+
+def _pairs(
+    codes: np.ndarray, lengths: np.ndarray, group: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every unordered pair of positions within each list of a flattened list column.
+
+    Lists of the same length share the same upper triangular pair pattern, so each
+    distinct length is handled with a single vectorized gather.
+    """
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    left, right, groups = [], [], []
+    for length in np.unique(lengths):
+        if length < 2:
+            continue
+        rows = np.flatnonzero(lengths == length)
+        i, j = np.triu_indices(length, k=1)
+        starts = offsets[rows][:, None]
+        left.append(codes[starts + i].ravel())
+        right.append(codes[starts + j].ravel())
+        groups.append(np.repeat(group[rows], len(i)))
+    if not left:
+        empty = np.empty(0, dtype=np.uint32)
+        return empty, empty, empty
+    return np.concatenate(left), np.concatenate(right), np.concatenate(groups)
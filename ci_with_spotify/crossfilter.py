@@ -0,0 +1,277 @@
+"""
+Linked range filters (brushes) over many columns, with histograms kept up to date.
+
+Filtering the table again whenever a range changes costs a full pass per brush
+move, and so does recomputing the histogram of every column. The ``Crossfilter``
+precomputes, once per table:
+
+- for every column, its values sorted and the rows in that order, so the rows
+  within a range are a contiguous slice found by two binary searches;
+- the histogram bin of each row in every column, stored row by row;
+- a bitmask per row, with the bit of a column set while the row is outside that
+  column's brush. A row is selected when its mask is 0.
+
+Moving a brush only visits the rows between its old and new bounds: their bit is
+flipped, and each of them is added to or removed from the histograms of the other
+columns. As in crossfilter.js, the histogram of a column counts the rows that pass
+every brush except its own, so it keeps showing the distribution to brush on.
+A brush move therefore costs time proportional to the rows it crosses, rather than
+to the size of the table::
+
+    cf = Crossfilter(filtered_duration, ["energy", "tempo", "valence"])
+    cf.brush("energy", (0.5, 0.8))
+    cf.histogram("tempo")  # the tempo of the tracks with an energy in 0.5 ~ 0.8
+    cf.rows()  # the selected tracks
+"""
+
+from collections.abc import Sequence
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify.density import DEFAULT_BINS, Range
+
+# One bit of the row masks per column
+MAX_COLUMNS = 32
+
+
+class _Dimension:
+    """The sorted values, row order and histogram bins of one column."""
+
+    def __init__(self, values: np.ndarray, bins: int, integer: bool) -> None:
+        self.order = np.argsort(values, kind="stable").astype(np.uint32)
+        # NaNs (the missing values) are sorted last, outside any brush
+        self.sorted = values[self.order]
+        finite = self.sorted[~np.isnan(self.sorted)]
+        low, high = (finite[0], finite[-1]) if len(finite) else (0.0, 0.0)
+        if integer and high - low + 1 <= bins:
+            # One bin per integer value, e.g. for the key or the mode
+            self.edges = np.arange(low, high + 2, dtype=np.float64)
+        else:
+            self.edges = np.linspace(low, high if high > low else low + 1, bins + 1)
+        self.n_bins = len(self.edges) - 1
+        bin_of = np.searchsorted(self.edges, values, side="right") - 1
+        bin_of = bin_of.clip(0, self.n_bins - 1)
+        # The missing values go to an extra bin, which is never reported
+        bin_of[np.isnan(values)] = self.n_bins
+        # Only kept until the Crossfilter copies them into its table of cells
+        self.bins: np.ndarray | None = bin_of
+        # The rows within the brush are order[start:end]
+        self.start, self.end = 0, len(values)
+        self.bounds: tuple[float, float] | None = None
+
+    def slice(self, bounds: Range | None) -> tuple[int, int]:
+        if bounds is None:
+            return 0, len(self.sorted)
+        low, high = sorted(bounds)
+        return (
+            int(np.searchsorted(self.sorted, low, side="left")),
+            int(np.searchsorted(self.sorted, high, side="right")),
+        )
+
+
+class Crossfilter:
+    """
+    Brushable ranges over the numeric columns of a table.
+
+    Args:
+        df (pl.DataFrame): The table to filter.
+        columns (Sequence[str]): The numeric columns that can be brushed, at most 32.
+        bins (int): Number of histogram bins per column. Integer columns with fewer
+            distinct values get one bin per value.
+
+    Raises:
+        ValueError: If there are more than 32 columns.
+
+    Example:
+        >>> cf = Crossfilter(df, ["energy", "danceability", "tempo"])
+        >>> cf.brush("tempo", (100, 140))
+        >>> cf.histograms()  # every histogram, linked to the tempo brush
+        >>> cf.brush("tempo", None)  # clear it
+    """
+
+    def __init__(
+        self, df: pl.DataFrame, columns: Sequence[str], bins: int = DEFAULT_BINS
+    ) -> None:
+        if len(columns) > MAX_COLUMNS:
+            raise ValueError(f"A crossfilter supports at most {MAX_COLUMNS} columns")
+        self.df = df
+        self.columns = list(columns)
+        self._dimensions = {
+            column: _Dimension(
+                df[column].cast(pl.Float64).fill_null(np.nan).to_numpy(),
+                bins,
+                df.schema[column].is_integer(),
+            )
+            for column in self.columns
+        }
+        self._bits = {column: np.uint32(1 << i) for i, column in enumerate(columns)}
+        self._masks = np.zeros(df.height, dtype=np.uint32)
+        # The bins of all the columns are numbered together, each column's after the
+        # previous one's, and stored row by row. A row's bins are then a single
+        # contiguous read, and a single bincount updates every histogram at once.
+        # They are stored in the smallest integer type holding the last one.
+        self._offsets: dict[str, int] = {}
+        n_cells = sum(dimension.n_bins + 1 for dimension in self._dimensions.values())
+        self._cells = np.empty(
+            (df.height, len(self.columns)), dtype=np.min_scalar_type(n_cells - 1)
+        )
+        offset = 0
+        for i, (column, dimension) in enumerate(self._dimensions.items()):
+            self._offsets[column] = offset
+            self._cells[:, i] = dimension.bins + offset
+            dimension.bins = None
+            offset += dimension.n_bins + 1
+        self._counts = np.bincount(self._cells.ravel(), minlength=offset)
+        self._selected = df.height
+
+    @property
+    def brushes(self) -> dict[str, tuple[float, float]]:
+        """The ``(min, max)`` brush of each brushed column."""
+        return {
+            column: dimension.bounds
+            for column, dimension in self._dimensions.items()
+            if dimension.bounds is not None
+        }
+
+    @property
+    def count(self) -> int:
+        """Number of rows within every brush."""
+        return self._selected
+
+    def edges(self, column: str) -> list[float]:
+        """The edges of a column's bins, e.g. as the steps of a range slider."""
+        return self._dimensions[column].edges.tolist()
+
+    def extent(self, column: str) -> tuple[float, float]:
+        """The first and last edge of a column's bins, around all of its values."""
+        edges = self._dimensions[column].edges
+        return float(edges[0]), float(edges[-1])
+
+    def brush(self, column: str, bounds: Range | None) -> None:
+        """
+        Set the range of a column, only updating the rows that cross its bounds.
+
+        Args:
+            column (str): The brushed column.
+            bounds (Range | None): The ``[min, max]`` (inclusive) to keep, or None
+                to clear the brush.
+        """
+        dimension = self._dimensions[column]
+        start, end = dimension.slice(bounds)
+        # Rows leaving the brush, then rows entering it
+        leaving = _outside(dimension.start, dimension.end, start, end)
+        entering = _outside(start, end, dimension.start, dimension.end)
+        dimension.start, dimension.end = start, end
+        dimension.bounds = None if bounds is None else tuple(sorted(bounds))
+        bit = self._bits[column]
+        moved = {
+            sign: np.concatenate([dimension.order[a:b] for a, b in segments])
+            for segments, sign in [(leaving, -1), (entering, 1)]
+            if segments
+        }
+        if sum(len(rows) for rows in moved.values()) <= end - start:
+            for sign, rows in moved.items():
+                counts, selected = self._histograms(column, rows)
+                self._counts += sign * counts
+                self._selected += sign * selected
+        for sign, rows in moved.items():
+            if sign < 0:
+                self._masks[rows] |= bit
+            else:
+                self._masks[rows] &= ~bit
+        if sum(len(rows) for rows in moved.values()) > end - start:
+            # Fewer rows within the new brush than rows that moved, e.g. after a jump
+            # to a narrow range: counting them again from scratch is cheaper
+            counts, self._selected = self._histograms(
+                column, dimension.order[start:end]
+            )
+            own = self._own(column)
+            counts[own] = self._counts[own]
+            self._counts = counts
+
+    def clear(self) -> None:
+        """Clear every brush."""
+        for column in self.columns:
+            self.brush(column, None)
+
+    def histogram(self, column: str) -> pl.DataFrame:
+        """
+        The histogram of a column, over the rows within the brushes of the others.
+
+        Args:
+            column (str): One of the crossfilter's columns.
+
+        Returns:
+            pl.DataFrame: One row per bin, with the ``bin_start`` and ``bin_end`` of
+                the bin, its ``count`` and whether it overlaps the column's own
+                brush (``in_brush``).
+        """
+        dimension = self._dimensions[column]
+        offset = self._offsets[column]
+        starts, ends = dimension.edges[:-1], dimension.edges[1:]
+        in_brush = np.ones(dimension.n_bins, dtype=bool)
+        if dimension.bounds is not None:
+            low, high = dimension.bounds
+            in_brush = (ends > low) & (starts <= high)
+        return pl.DataFrame(
+            {
+                "bin_start": starts,
+                "bin_end": ends,
+                "count": self._counts[offset : offset + dimension.n_bins],
+                "in_brush": in_brush,
+            }
+        )
+
+    def histograms(self) -> dict[str, pl.DataFrame]:
+        """The histogram of every column."""
+        return {column: self.histogram(column) for column in self.columns}
+
+    def selected(self) -> np.ndarray:
+        """Boolean mask of the rows within every brush."""
+        return self._masks == 0
+
+    def rows(self) -> pl.DataFrame:
+        """The rows within every brush."""
+        if not self.brushes:
+            return self.df
+        return self.df.filter(pl.Series(self.selected()))
+
+    def _own(self, column: str) -> slice:
+        """The bins of a column among the bins of every column."""
+        offset = self._offsets[column]
+        return slice(offset, offset + self._dimensions[column].n_bins + 1)
+
+    def _histograms(self, column: str, rows: np.ndarray) -> tuple[np.ndarray, int]:
+        """
+        The contribution of some rows within a column's brush to the histograms of
+        the other columns, and how many of them are within every brush.
+        """
+        # Gathering in row order reads the table of cells (mostly) sequentially
+        rows = np.sort(rows)
+        # The brushes, other than this column's, that each row is outside of
+        others = self._masks[rows] & ~self._bits[column]
+        passing = others == 0
+        # A row within every other brush counts in the histograms of every column.
+        # Its own is counted too, as it is cheaper than leaving it out, then reset.
+        counts = np.bincount(
+            self._cells[rows[passing]].ravel(), minlength=len(self._counts)
+        )
+        # A row outside of a single other brush only counts in that column's histogram
+        for i, other in enumerate(self.columns):
+            if other == column or self._dimensions[other].bounds is None:
+                continue
+            cells = self._cells[rows[others == self._bits[other]], i]
+            counts += np.bincount(cells, minlength=len(self._counts))
+        counts[self._own(column)] = 0
+        return counts, int(np.count_nonzero(passing))
+
+
+def _outside(
+    start: int, end: int, other_start: int, other_end: int
+) -> list[tuple[int, int]]:
+    """The (at most two) slices of ``[start, end)`` that are not in the other one."""
+    if other_end <= other_start:
+        return [(start, end)] if end > start else []
+    segments = [(start, min(end, other_start)), (max(start, other_end), end)]
+    return [(a, b) for a, b in segments if b > a]
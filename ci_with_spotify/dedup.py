@@ -0,0 +1,110 @@
+"""
+Deduplication of the tracks listed under several genres.
+
+The source lists a track once per genre it belongs to, with the same ID, name,
+artists and audio features. Counting rows therefore counts some tracks several
+times: in the duration histogram, in an artist's ``tracks_count``, and in the top 10
+popularities that rank the artists. Two views of the tracks are available:
+
+- per listing: the cleaned tracks, one row per (track, genre), as before, with a
+  ``track_key`` column added by ``with_track_key``;
+- per unique track: ``unique_tracks`` collapses the listings sharing a key into
+  the first of them. Its ``track_genre`` is the genre of that first listing, and a
+  ``genres`` column holds every genre of the track.
+
+The key is a 64-bit hash of the ``track_id``, or of the name, artists and duration
+when the ID is missing. Polars' hashes are only stable within a Polars version,
+which the ``TracksCache`` keys already account for.
+
+In the per-track view ``pipeline.filter_genre`` keeps the tracks listed under a
+genre, and ``pipeline.genre_listings`` expands the tracks back to one row per genre
+for the per-genre aggregations::
+
+    tracks = TracksCache().load("input/tracks.parquet", clean_unique_tracks)
+"""
+
+import polars as pl
+
+from ci_with_spotify.pipeline import GENRES, clean_tracks
+
+TRACK_KEY = "track_key"
+# Identify a track missing its ID
+FALLBACK_KEY = ["track_name", "artists", "duration_ms"]
+
+
+def with_track_key(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Add the ``track_key`` hash identifying each track to the raw tracks.
+
+    Args:
+        lf (pl.LazyFrame): The raw tracks, before ``clean_tracks`` drops the ID.
+
+    Returns:
+        pl.LazyFrame: The tracks with a ``track_key`` (UInt64) column.
+    """
+    fallback = pl.struct(FALLBACK_KEY).hash(seed=0)
+    if "track_id" not in lf.collect_schema():
+        return lf.with_columns(fallback.alias(TRACK_KEY))
+    return lf.with_columns(
+        pl.when(pl.col("track_id").is_not_null())
+        .then(pl.col("track_id").hash(seed=0))
+        .otherwise(fallback)
+        .alias(TRACK_KEY)
+    )
+
+
+def unique_tracks(listings: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Collapse the listings of each track into a single row.
+
+    Args:
+        listings (pl.LazyFrame): Cleaned tracks with a ``track_key`` column.
+
+    Returns:
+        pl.LazyFrame: One row per track, in the order of the first listing of each,
+            with the columns of that listing, the distinct ``genres`` of all of them
+            (a list of Categoricals) and their number of ``listings``.
+    """
+    return listings.group_by(TRACK_KEY, maintain_order=True).agg(
+        pl.all().exclude(TRACK_KEY).first(),
+        pl.col("track_genre")
+        .cast(pl.String)
+        .cast(pl.Categorical)
+        .unique(maintain_order=True)
+        .alias(GENRES),
+        pl.len().alias("listings"),
+    )
+
+
+def clean_unique_tracks(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    The cleaned tracks with a single row per track, as a ``TracksCache`` transform.
+
+    Example:
+        >>> df = TracksCache().load("input/tracks.parquet", clean_unique_tracks)
+    """
+    return unique_tracks(clean_tracks(with_track_key(lf)))
+
+
+def duplicate_summary(listings: pl.DataFrame | pl.LazyFrame) -> dict[str, float]:
+    """
+    How much smaller the per-track view is than the per-listing one.
+
+    Args:
+        listings (pl.DataFrame | pl.LazyFrame): Cleaned tracks with a
+            ``track_key`` column.
+
+    Returns:
+        dict[str, float]: The number of ``listings``, of ``unique_tracks``, of
+            ``duplicated_tracks`` (listed more than once) and the ``ratio`` of
+            listings per unique track.
+    """
+    counts = listings.lazy().group_by(TRACK_KEY).len().collect()["len"]
+    unique = counts.len()
+    total = int(counts.sum())
+    return {
+        "listings": total,
+        "unique_tracks": unique,
+        "duplicated_tracks": int((counts > 1).sum()),
+        "ratio": total / unique if unique else 1.0,
+    }
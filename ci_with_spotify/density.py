@@ -0,0 +1,161 @@
+"""
+Server-side binning for the interactive scatter plot.
+
+Sending every row to plotly makes both the payload and the browser render time
+grow with the dataset. Above ``DENSITY_THRESHOLD`` rows, ``scatter_frame`` bins the
+two plotted columns into a fixed ``bins x bins`` grid instead and returns one
+point per non-empty cell, with the number of tracks in it and the mean of the
+colour column (as ``<color>_mean``). Once the view is narrowed down to a selected region, the tracks
+inside of it are plotted as raw points again, downsampled to at most
+``DENSITY_THRESHOLD`` rows, so the payload is bounded either way.
+"""
+
+import numpy as np
+import polars as pl
+
+DENSITY_THRESHOLD = 20_000
+DEFAULT_BINS = 100
+
+Range = tuple[float, float] | list[float]
+
+
+def filter_ranges(lf: pl.LazyFrame, ranges: dict[str, Range] | None) -> pl.LazyFrame:
+    """
+    Keep the rows within a range of values for each of some columns.
+
+    Args:
+        lf (pl.LazyFrame): The tracks to filter.
+        ranges (dict[str, Range] | None): ``[min, max]`` (inclusive) of each column,
+            such as the ``ranges`` of a box selection in ``mo.ui.plotly``.
+
+    Returns:
+        pl.LazyFrame: The rows within every range.
+    """
+    if not ranges:
+        return lf
+    return lf.filter(
+        *(
+            pl.col(column).is_between(*sorted(bounds))
+            for column, bounds in ranges.items()
+        )
+    )
+
+
+def density_grid(
+    df: pl.DataFrame,
+    x: str,
+    y: str,
+    color: str | None = None,
+    bins: int = DEFAULT_BINS,
+) -> pl.DataFrame:
+    """
+    Bin two columns into a 2D grid of counts, vectorized with NumPy.
+
+    Args:
+        df (pl.DataFrame): The rows to bin.
+        x (str): Column binned along the horizontal axis.
+        y (str): Column binned along the vertical axis.
+        color (str | None): Column averaged within each cell, if any.
+        bins (int): Number of cells along each axis.
+
+    Returns:
+        pl.DataFrame: One row per non-empty cell, with the cell centres in the ``x``
+            and ``y`` columns, the number of rows as ``count`` and the mean of the
+            ``color`` column as ``<color>_mean``, so that it does not replace a cell
+            centre when ``color`` is also an axis. Rows with a missing ``x`` or ``y``
+            are left out.
+
+    Example:
+        >>> density_grid(filtered_duration, "energy", "danceability", "loudness")
+    """
+    columns = [x, y] if color in (None, x, y) else [x, y, color]
+    values = df.select(columns).drop_nulls([x, y])
+    xs = values[x].cast(pl.Float64).to_numpy()
+    ys = values[y].cast(pl.Float64).to_numpy()
+    x_edges = _edges(xs, bins)
+    y_edges = _edges(ys, bins)
+    # Flat cell index of each row, the last edge is included in the last cell
+    cells = _bin(xs, x_edges, bins) * bins + _bin(ys, y_edges, bins)
+    counts = np.bincount(cells, minlength=bins * bins)
+    occupied = np.flatnonzero(counts)
+
+    x_centres = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centres = (y_edges[:-1] + y_edges[1:]) / 2
+    grid = {
+        x: x_centres[occupied // bins],
+        y: y_centres[occupied % bins],
+        "count": counts[occupied],
+    }
+    if color is not None:
+        colors = values[color].cast(pl.Float64)
+        present = colors.is_not_null().to_numpy()
+        sums = np.bincount(
+            cells[present],
+            weights=colors.to_numpy()[present],
+            minlength=bins * bins,
+        )
+        colored = np.bincount(cells[present], minlength=bins * bins)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums[occupied] / colored[occupied]
+        # The colour of a cell is unknown if none of its rows had one
+        grid[f"{color}_mean"] = pl.Series(means).fill_nan(None)
+    return pl.DataFrame(grid)
+
+
+def scatter_frame(
+    df: pl.DataFrame | pl.LazyFrame,
+    x: str,
+    y: str,
+    color: str | None = None,
+    *,
+    ranges: dict[str, Range] | None = None,
+    threshold: int = DENSITY_THRESHOLD,
+    bins: int = DEFAULT_BINS,
+    seed: int = 0,
+) -> tuple[pl.DataFrame, bool]:
+    """
+    The data to send to the scatter plot, binned when there are too many rows.
+
+    The full view is binned with ``density_grid`` when it holds more than
+    ``threshold`` rows. A narrowed down view (``ranges`` is given) is always drawn
+    as raw points, sampled down to ``threshold`` rows if needed.
+
+    Args:
+        df (pl.DataFrame | pl.LazyFrame): The tracks to plot.
+        x (str): Column for the horizontal axis.
+        y (str): Column for the vertical axis.
+        color (str | None): Column for the colour of the points, if any.
+        ranges (dict[str, Range] | None): The selected region, as ``[min, max]`` for
+            some of the columns.
+        threshold (int): Maximum number of raw points to plot.
+        bins (int): Number of cells along each axis of the density grid.
+        seed (int): Seed of the downsampling, so a view is stable across reruns.
+
+    Returns:
+        tuple[pl.DataFrame, bool]: The rows or cells to plot, and whether they
+            are binned.
+
+    Example:
+        >>> data, binned = scatter_frame(filtered_duration, "energy", "danceability")
+    """
+    view = filter_ranges(df.lazy(), ranges).collect()
+    if view.height <= threshold:
+        return view, False
+    if ranges:
+        return view.sample(threshold, seed=seed), False
+    return density_grid(view, x, y, color, bins), True
+
+
+def _edges(values: np.ndarray, bins: int) -> np.ndarray:
+    if values.size == 0:
+        return np.linspace(0.0, 1.0, bins + 1)
+    low, high = values.min(), values.max()
+    if low == high:
+        # A single distinct value still needs a cell of non-zero width
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, bins + 1)
+
+
+def _bin(values: np.ndarray, edges: np.ndarray, bins: int) -> np.ndarray:
+    scaled = (values - edges[0]) / (edges[-1] - edges[0]) * bins
+    return np.clip(scaled.astype(np.int64), 0, bins - 1)
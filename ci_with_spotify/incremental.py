@@ -0,0 +1,212 @@
+"""
+Incremental refresh of the cleaned tracks and their aggregates.
+
+New batches of tracks arrive as extra parquet files next to the existing ones
+(e.g. ``input/shards/*.parquet``). Rerunning the notebook reads, cleans and
+aggregates the whole corpus again, although only the new files changed.
+``IncrementalTracks`` keeps a manifest of the files it has ingested (their size
+and modification time), and on ``refresh`` only scans the new ones. Their rows
+are cleaned, appended to the table, and merged into mergeable aggregate state:
+
+- the duration histogram and the per-genre row counts and sums, which add up;
+- the ``PopularArtists`` state, whose top 10 popularities merge as a top 10 of
+  the union, and where only the groups of the batch's genres and the rollup rows
+  of its artists are merged again;
+- the ``CollaborationIndex`` pair counts, which add up per genre.
+
+Only the cached tables of the genres of the batch are evicted, so the cost of a
+refresh scales with the size of the batch rather than of the corpus::
+
+    tracks = IncrementalTracks("input/shards")
+    tracks.refresh()  # ingests every file the first time
+    # ... new shards are written ...
+    tracks.refresh()  # {"files": [...], "rows": 1200, "genres": ["pop", ...], ...}
+    tracks.popular_artists.get("pop")
+
+If a file that was already ingested changes or disappears, the aggregates cannot
+take the old rows back out, so everything is rebuilt from scratch instead.
+
+The new files usually number their rows from 0 again, so the ``row_id`` of a
+batch is shifted after the largest one ingested so far whenever they overlap.
+The transform must work row by row: a ``group_by``, ``unique`` or sort would only
+see the rows of each batch, e.g. ``dedup.unique_tracks`` would not collapse the
+listings of a track spread over two batches, so such transforms are rejected.
+"""
+
+import os
+import re
+from pathlib import Path
+from typing import Any
+
+import polars as pl
+
+from ci_with_spotify.aggregations import PopularArtists
+from ci_with_spotify.cache import Transform
+from ci_with_spotify.collaborations import CollaborationIndex
+from ci_with_spotify.ingest import shard_paths
+from ci_with_spotify.pipeline import ROW_ID, clean_tracks, genre_listings, scan_tracks
+
+MEANS = ["duration_seconds", "popularity"]
+# The nodes of a query plan that depend on more than one row at a time
+_NOT_ROW_BY_ROW = re.compile(r"^\s*(AGGREGATE|UNIQUE|SORT|SLICE)\b", re.MULTILINE)
+
+
+class IncrementalTracks:
+    """
+    The cleaned tracks of a growing set of shards, with incrementally updated
+    aggregates.
+
+    Args:
+        source (str | Path): A glob or directory of parquet shards (or a single file).
+        transform (Transform): The cleaning steps, applied to each batch on its own.
+            They must work row by row, like ``clean_tracks``, ``clean_compact_tracks``
+            or a filter on them.
+        streaming (bool): Collect the batches with the streaming engine.
+
+    Attributes:
+        tracks (pl.DataFrame): Every cleaned track ingested so far.
+        manifest (dict[str, tuple[int, int]]): The size and modification time (in
+            nanoseconds) of every ingested file.
+        popular_artists (PopularArtists | None): The artist rankings.
+        collaborations (CollaborationIndex | None): The collaboration counts.
+    """
+
+    def __init__(
+        self,
+        source: str | Path,
+        transform: Transform = clean_tracks,
+        *,
+        streaming: bool = False,
+    ) -> None:
+        self.source = source
+        self.transform = transform
+        self.streaming = streaming
+        self._reset()
+
+    def refresh(self) -> dict[str, Any]:
+        """
+        Ingest the files that appeared since the last refresh.
+
+        Returns:
+            dict[str, Any]: The new ``files``, their number of cleaned ``rows``, the
+                ``genres`` whose aggregates changed and whether everything had to be
+                ``rebuilt`` because an ingested file changed.
+
+        Raises:
+            ValueError: If the transform does not work row by row.
+        """
+        fingerprints = {
+            str(path): (stat.st_size, stat.st_mtime_ns)
+            for path, stat in (
+                (path, os.stat(path)) for path in shard_paths(self.source)
+            )
+        }
+        rebuilt = any(
+            fingerprints.get(path) != fingerprint
+            for path, fingerprint in self.manifest.items()
+        )
+        if rebuilt:
+            self._reset()
+        new = [path for path in fingerprints if path not in self.manifest]
+        result = {"files": new, "rows": 0, "genres": [], "rebuilt": rebuilt}
+        if not new:
+            return result
+        query = self.transform(scan_tracks(new))
+        if _NOT_ROW_BY_ROW.search(query.explain(optimized=False)):
+            raise ValueError(
+                "The transform must work row by row, without group_by, unique, sort "
+                "or slice, as it only sees the rows of one batch at a time"
+            )
+        batch = self._with_new_row_ids(
+            query.collect(engine="streaming" if self.streaming else "auto")
+        )
+        self._ingest(batch)
+        self.manifest.update({path: fingerprints[path] for path in new})
+        result["rows"] = batch.height
+        result["genres"] = sorted(
+            genre_listings(batch.lazy())
+            .select(pl.col("track_genre").cast(pl.String).unique())
+            .collect()
+            .to_series()
+            .drop_nulls()
+            .to_list()
+        )
+        return result
+
+    def duration_counts(self) -> pl.DataFrame:
+        """Number of tracks for each duration in seconds, as ``pipeline.duration_counts``."""
+        return self._durations.sort("duration_seconds")
+
+    def genre_means(self) -> pl.DataFrame:
+        """Average duration and popularity of each genre, as ``pipeline.genre_means``."""
+        return self._genres.select(
+            "track_genre",
+            *(
+                (pl.col(f"{column}_sum") / pl.col(f"{column}_count"))
+                .round(2)
+                .alias(column)
+                for column in MEANS
+            ),
+        ).sort("track_genre", descending=True)
+
+    def _with_new_row_ids(self, batch: pl.DataFrame) -> pl.DataFrame:
+        """Shift the ``row_id`` of a batch after the ingested ones, if they overlap."""
+        if batch.is_empty():
+            return batch
+        low, high = batch.select(
+            pl.col(ROW_ID).min().alias("low"), pl.col(ROW_ID).max().alias("high")
+        ).row(0)
+        if self._max_row_id is not None and low <= self._max_row_id:
+            shift = self._max_row_id + 1 - low
+            batch = batch.with_columns(pl.col(ROW_ID) + shift)
+            high += shift
+        self._max_row_id = (
+            high if self._max_row_id is None else max(self._max_row_id, high)
+        )
+        return batch
+
+    def _reset(self) -> None:
+        self.tracks = pl.DataFrame()
+        self._max_row_id: int | None = None
+        self.manifest: dict[str, tuple[int, int]] = {}
+        self.popular_artists: PopularArtists | None = None
+        self.collaborations: CollaborationIndex | None = None
+        self._durations = pl.DataFrame(
+            schema={"duration_seconds": pl.Int64, "count": pl.UInt32}
+        )
+        self._genres = pl.DataFrame()
+
+    def _ingest(self, batch: pl.DataFrame) -> None:
+        lf = batch.lazy()
+        durations = lf.group_by("duration_seconds").len("count")
+        genres = (
+            genre_listings(lf)
+            .group_by(pl.col("track_genre").cast(pl.String))
+            .agg(
+                *(pl.col(column).sum().alias(f"{column}_sum") for column in MEANS),
+                *(pl.col(column).count().alias(f"{column}_count") for column in MEANS),
+            )
+        )
+        durations, genres = pl.collect_all([durations, genres])
+        if self.tracks.is_empty():
+            self.tracks = batch
+            self._durations = durations
+            self._genres = genres
+            self.popular_artists = PopularArtists.build(batch, streaming=self.streaming)
+            self.collaborations = CollaborationIndex.build(batch)
+            return
+        # Appended as new chunks, without copying the rows already ingested
+        self.tracks = pl.concat([self.tracks, batch], rechunk=False)
+        self._durations = _add(self._durations, durations, "duration_seconds")
+        self._genres = _add(self._genres, genres, "track_genre")
+        self.popular_artists.update(batch, streaming=self.streaming)
+        self.collaborations.update(batch)
+
+
+def _add(state: pl.DataFrame, new: pl.DataFrame, key: str) -> pl.DataFrame:
+    """Add up the columns of two tables of counts or sums, by key."""
+    return (
+        pl.concat([state, new.cast(state.schema)])
+        .group_by(key, maintain_order=True)
+        .agg(pl.exclude(key).sum())
+    )
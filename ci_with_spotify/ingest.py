@@ -0,0 +1,128 @@
+"""
+Ingestion of tracks spread over many parquet shards.
+
+A source can be a single parquet file, a glob such as ``input/shards/*.parquet``
+or a directory of shards, scanned together as a single table by
+``pipeline.scan_tracks``. Polars reads the files in parallel and pushes the filters
+of the query down to each of them, skipping the row groups whose statistics rule
+them out.
+
+``write_partitioned`` rewrites a source as a hive-partitioned directory, with one
+``track_genre=<genre>/`` subdirectory per genre::
+
+    write_partitioned("input/tracks.parquet", "input/tracks")
+
+Scanning that directory brings ``track_genre`` back as a column, and a filter on it
+(``filter_genre`` or an ``is_in``) only opens the files of the matching partitions,
+so picking a genre no longer reads the whole corpus.
+"""
+
+import glob
+import shutil
+from pathlib import Path
+from urllib.parse import unquote
+
+import polars as pl
+
+from ci_with_spotify.pipeline import scan_tracks
+
+PARTITION_KEY = "track_genre"
+
+
+def is_glob(source: str | Path) -> bool:
+    """Whether a source is a glob pattern rather than a path."""
+    return glob.has_magic(str(source))
+
+
+def shard_paths(source: str | Path) -> list[Path]:
+    """
+    The parquet files of a source, in a stable order.
+
+    Args:
+        source (str | Path): A parquet file, a glob or a directory, whose parquet
+            files are searched recursively (e.g. in hive partitions).
+
+    Returns:
+        list[Path]: The sorted paths of the files.
+
+    Raises:
+        FileNotFoundError: If the source does not match any parquet file.
+    """
+    if is_glob(source):
+        paths = [Path(path) for path in glob.glob(str(source), recursive=True)]
+    elif Path(source).is_dir():
+        paths = list(Path(source).rglob("*.parquet"))
+    else:
+        paths = [Path(source)] if Path(source).exists() else []
+    paths = sorted(path for path in paths if path.is_file())
+    if not paths:
+        raise FileNotFoundError(f"No parquet files found in {source}")
+    return paths
+
+
+def partition_values(source: str | Path, key: str = PARTITION_KEY) -> list[str]:
+    """
+    The sorted values of a hive partition key, read from the directory names only.
+
+    Args:
+        source (str | Path): A hive-partitioned directory.
+        key (str): The partition key.
+
+    Returns:
+        list[str]: The distinct values, e.g. the genres of the corpus. Empty if the
+            source is not partitioned by ``key``.
+    """
+    root = Path(source)
+    if is_glob(source) or not root.is_dir():
+        return []
+    prefix = f"{key}="
+    return sorted(
+        unquote(entry.name.removeprefix(prefix))
+        for entry in root.iterdir()
+        if entry.is_dir() and entry.name.startswith(prefix)
+    )
+
+
+def write_partitioned(
+    source: str | Path,
+    target: str | Path,
+    *,
+    key: str = PARTITION_KEY,
+    overwrite: bool = False,
+) -> list[str]:
+    """
+    Rewrite the tracks of a source as a hive-partitioned directory.
+
+    The source is streamed, so it does not need to fit in memory.
+
+    Args:
+        source (str | Path): A parquet file, glob or directory of raw tracks.
+        target (str | Path): The directory to write, one subdirectory per value.
+        key (str): The column to partition by.
+        overwrite (bool): Replace the target if it already exists.
+
+    Returns:
+        list[str]: The values of the written partitions.
+
+    Raises:
+        FileExistsError: If the target exists and ``overwrite`` is False.
+
+    Example:
+        >>> write_partitioned("input/tracks.parquet", "input/tracks")
+        >>> filter_genre(clean_tracks(scan_tracks("input/tracks")), "pop")
+    """
+    target = Path(target)
+    if target.exists() and not overwrite:
+        raise FileExistsError(f"{target} already exists")
+    # Written next to the target first, so a failure never leaves a partial layout
+    # behind and the source may be the target itself
+    tmp = target.with_name(f".{target.name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    scan_tracks(source).sink_parquet(pl.PartitionByKey(tmp, by=key), mkdir=True)
+    if target.is_dir():
+        shutil.rmtree(target)
+    else:
+        target.unlink(missing_ok=True)
+    tmp.rename(target)
+    return partition_values(target, key)
@@ -0,0 +1,490 @@
+"""
+Composable, lazy building blocks for the Spotify EDA notebook.
+
+Every stage takes and returns a ``pl.LazyFrame``, so the stages can be chained
+into a single query plan and only the (small) final results need to be
+collected. Pass ``streaming=True`` to ``collect`` to run the plan with the
+Polars streaming engine, which processes the data in batches and therefore
+works on datasets that are larger than the available memory.
+"""
+
+import functools
+import math
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import polars as pl
+
+if TYPE_CHECKING:
+    from ci_with_spotify.artists import ArtistModel
+
+DEFAULT_SOURCE = "input/tracks.parquet"
+ROW_ID = "row_id"
+# The row index of the source, kept as the ``row_id``
+SOURCE_INDEX = "Unnamed: 0"
+_FILE_PATH = "__file_path"
+# Every genre of a track, in the per-track view of ``dedup.unique_tracks``
+GENRES = "genres"
+
+
+def scan_tracks(source: str | Path | list[str] = DEFAULT_SOURCE) -> pl.LazyFrame:
+    """
+    Lazily scan the raw tracks table.
+
+    The tracks can be spread over many shards: pass a glob or a directory to scan
+    all of them. The partition columns of a hive-partitioned directory (such as the
+    one written by ``ingest.write_partitioned``) are read back from the paths, and
+    filtering on them only reads the matching partitions.
+
+    The ``Unnamed: 0`` index of the shards is made unique across them with
+    ``row_id_offsets``, as ``clean_tracks`` keeps it as the ``row_id``. That reads
+    the index column of every shard the first time a source is scanned (and again
+    once its files change), everything else is only read when the plan is collected.
+
+    Args:
+        source (str | Path | list[str]): Parquet file, glob or directory holding the
+            raw tracks, or a list of parquet files.
+
+    Returns:
+        pl.LazyFrame: The raw tracks.
+
+    Raises:
+        ValueError: If a shard repeats a value of its index.
+    """
+    if _is_single_file(source):
+        return pl.scan_parquet(source)
+    offsets = row_id_offsets(source)
+    if not offsets:
+        return pl.scan_parquet(source)
+    return (
+        pl.scan_parquet(source, include_file_paths=_FILE_PATH)
+        .with_columns(
+            pl.col(SOURCE_INDEX)
+            + pl.col(_FILE_PATH).replace_strict(offsets, return_dtype=pl.Int64)
+        )
+        .drop(_FILE_PATH)
+    )
+
+
+def row_id_offsets(source: str | Path | list[str]) -> dict[str, int]:
+    """
+    The offset to add to the ``Unnamed: 0`` index of each file of a source, so that
+    it is unique across the files.
+
+    Shards split from a single table (e.g. by ``ingest.write_partitioned``) keep the
+    index of that table, which is already unique, and are left as they are. Batches
+    exported separately usually count from 0 each, in which case every file is
+    renumbered to follow the ones before it, in path order. Only the index column of
+    the files is read, and only once for as long as the files, their sizes and
+    modification times are unchanged.
+
+    Args:
+        source (str | Path | list[str]): Parquet file, glob or directory holding the
+            raw tracks, or a list of parquet files.
+
+    Returns:
+        dict[str, int]: The offset of each file, as scanned by Polars, or an empty
+            dict if the index is already unique across them.
+
+    Raises:
+        ValueError: If a file repeats a value of its index.
+    """
+    key = tuple(source) if isinstance(source, list) else str(source)
+    # A copy, so the memoised offsets cannot be changed by the caller
+    return dict(_row_id_offsets(key, source_fingerprint(source)))
+
+
+@functools.lru_cache(maxsize=32)
+def _row_id_offsets(
+    source: str | tuple[str, ...], fingerprint: tuple[tuple[str, int, int], ...]
+) -> dict[str, int]:
+    # The fingerprint is only part of the key, so the offsets are computed again once the files change
+    if isinstance(source, tuple):
+        source = list(source)
+    lf = pl.scan_parquet(source, include_file_paths=_FILE_PATH)
+    if SOURCE_INDEX not in lf.collect_schema():
+        return {}
+    index = pl.col(SOURCE_INDEX)
+    ranges, total = pl.collect_all(
+        [
+            lf.group_by(_FILE_PATH)
+            .agg(
+                index.min().alias("low"),
+                index.max().alias("high"),
+                index.count().alias("rows"),
+                index.n_unique().alias("unique"),
+            )
+            .filter(pl.col("rows") > 0)
+            .sort(_FILE_PATH),
+            lf.select((index.n_unique() == index.count()).alias("unique")),
+        ]
+    )
+    if total.item():
+        return {}
+    repeated = ranges.filter(pl.col("unique") < pl.col("rows"))[_FILE_PATH]
+    if len(repeated):
+        raise ValueError(f"The {SOURCE_INDEX} column of {repeated[0]} is not unique")
+    offsets, start = {}, ranges["low"].min()
+    for path, low, high in ranges.select(_FILE_PATH, "low", "high").iter_rows():
+        offsets[path] = start - low
+        start += high - low + 1
+    return offsets
+
+
+def source_fingerprint(
+    source: str | Path | list[str],
+) -> tuple[tuple[str, int, int], ...]:
+    """The path, size and modification time of every file of a source."""
+    from ci_with_spotify.ingest import shard_paths
+
+    files = (
+        [Path(path) for path in source]
+        if isinstance(source, list)
+        else shard_paths(source)
+    )
+    return tuple(
+        (str(path), stat.st_size, stat.st_mtime_ns)
+        for path, stat in zip(files, map(os.stat, files))
+    )
+
+
+def _is_single_file(source: str | Path | list[str]) -> bool:
+    if isinstance(source, list):
+        return len(source) == 1
+    return Path(source).is_file()
+
+
+def clean_tracks(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Apply the notebook's cleaning steps to the raw tracks.
+
+    Only non-explicit tracks are kept, the ID and explicit columns are dropped,
+    ``duration_seconds`` is derived from ``duration_ms`` and the ``popularity`` is
+    converted from an integer 0 ~ 100 to a fraction 0 ~ 1.0.
+
+    The source's row index is kept as ``row_id``, unique across the shards of a
+    source scanned with ``scan_tracks``. It is stable and ascending through every
+    later filter, so a selected subset can be resolved back to its rows with
+    ``selection.take_rows``, and unlike ``with_row_index`` it does not prevent
+    filters from being pushed down into the parquet scan.
+
+    Args:
+        lf (pl.LazyFrame): The raw tracks, as returned by ``scan_tracks``.
+
+    Returns:
+        pl.LazyFrame: The cleaned tracks.
+    """
+    return (
+        lf.filter(~pl.col("explicit"))
+        .drop("track_id", "explicit")
+        .rename({SOURCE_INDEX: ROW_ID})
+        .with_columns(
+            pl.col("duration_ms").floordiv(1_000).alias("duration_seconds"),
+            pl.col("popularity").truediv(100),
+        )
+    )
+
+
+def duration_in_range(min_dur: float, max_dur: float) -> pl.Expr:
+    """Expression that is true for the tracks whose duration lies within the range."""
+    return pl.col("duration_seconds").is_between(min_dur, max_dur)
+
+
+def filter_duration(lf: pl.LazyFrame, min_dur: float, max_dur: float) -> pl.LazyFrame:
+    """
+    Keep only the tracks whose duration (in seconds) lies within the range.
+
+    The derived ``duration_seconds`` cannot be filtered on before it is computed,
+    so the same range is also applied to the source ``duration_ms`` when present,
+    which is pushed down to the parquet scan and skips the row groups out of range.
+    """
+    predicate = duration_in_range(min_dur, max_dur)
+    if "duration_ms" in lf.collect_schema():
+        predicate = _duration_ms_in_range(min_dur, max_dur) & predicate
+    return lf.filter(predicate)
+
+
+def _duration_ms_in_range(min_dur: float, max_dur: float) -> pl.Expr:
+    """``duration_in_range`` applied to ``duration_ms``, which is in milliseconds."""
+    lower = math.ceil(min_dur) * 1_000 if math.isfinite(min_dur) else min_dur
+    upper = (math.floor(max_dur) + 1) * 1_000 - 1 if math.isfinite(max_dur) else max_dur
+    return pl.col("duration_ms").is_between(lower, upper)
+
+
+def filter_genre(lf: pl.LazyFrame, genre: str | None) -> pl.LazyFrame:
+    """
+    Keep only the tracks of a genre, or all of them if ``genre`` is None.
+
+    In the per-track view (with a ``genres`` column), keeps the tracks listed under
+    the genre, with that genre as their ``track_genre``.
+    """
+    if genre is None:
+        return lf
+    schema = lf.collect_schema()
+    if GENRES not in schema:
+        return lf.filter(pl.col("track_genre") == genre)
+    return lf.filter(pl.col(GENRES).list.contains(genre)).with_columns(
+        # Null for a genre missing from an Enum, but no track is left then anyway
+        pl.lit(genre).cast(schema["track_genre"], strict=False).alias("track_genre")
+    )
+
+
+def is_unique_view(tracks: pl.DataFrame | pl.LazyFrame) -> bool:
+    """Whether the tracks are the per-track view, with a list of ``genres``."""
+    return GENRES in tracks.collect_schema()
+
+
+def genre_listings(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    One row per genre of each track, as in the per-listing view.
+
+    Args:
+        lf (pl.LazyFrame): Tracks of either view.
+
+    Returns:
+        pl.LazyFrame: The per-track view expanded on its ``genres``, or the tracks
+            unchanged if they are already per listing.
+    """
+    schema = lf.collect_schema()
+    if GENRES not in schema:
+        return lf
+    return (
+        lf.drop("track_genre")
+        .explode(GENRES)
+        .rename({GENRES: "track_genre"})
+        # Back to the type of the listings, e.g. the Enum of the compact schema
+        .with_columns(pl.col("track_genre").cast(schema["track_genre"]))
+    )
+
+
+def duration_counts(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Number of tracks for each duration in seconds, used for the histogram."""
+    return lf.group_by("duration_seconds").len("count")
+
+
+def explode_artists(
+    lf: pl.LazyFrame, artists: "ArtistModel | None" = None
+) -> pl.LazyFrame:
+    """
+    Repeat each track for each of its (``;``-separated) artists.
+
+    Args:
+        lf (pl.LazyFrame): The cleaned tracks.
+        artists (ArtistModel | None): The artists of the tracks, already split. The
+            names are split and exploded on the fly if omitted.
+
+    Returns:
+        pl.LazyFrame: One row per artist of each track, with its name in ``artists``.
+    """
+    if artists is not None:
+        return artists.explode(lf)
+    return lf.with_columns(pl.col("artists").cast(pl.String).str.split(";")).explode(
+        "artists"
+    )
+
+
+def most_popular_artists(
+    lf: pl.LazyFrame,
+    genre: str | None = None,
+    artists: "ArtistModel | None" = None,
+) -> pl.LazyFrame:
+    """
+    Rank the artists by the average popularity of their top 10 tracks.
+
+    Tracks with multiple artists (separated by ``;``) count towards each of them.
+
+    Args:
+        lf (pl.LazyFrame): The cleaned tracks.
+        genre (str | None): Only consider the tracks of this genre, if given.
+        artists (ArtistModel | None): The artists of the tracks, to join instead of
+            splitting the names again.
+
+    Returns:
+        pl.LazyFrame: One row per artist, sorted by popularity (descending).
+    """
+    return (
+        explode_artists(filter_genre(lf, genre), artists)
+        .group_by("artists")
+        .agg(
+            pl.col("popularity").top_k(10).mean(),
+            pl.col("track_name")
+            .sort_by("popularity")
+            .unique(maintain_order=True)
+            .top_k(5),
+            pl.col("album_name")
+            .sort_by("popularity")
+            .unique(maintain_order=True)
+            .top_k(5),
+            pl.col("track_genre")
+            .top_k_by("popularity", k=1)
+            .alias("Most popular genre"),
+            pl.col("track_name").n_unique().alias("tracks_count"),
+        )
+        .with_columns(pl.col("artists").cast(pl.String))
+        .sort("popularity", descending=True)
+    )
+
+
+def genre_means(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Average duration and popularity of each genre."""
+    return (
+        genre_listings(lf)
+        .group_by("track_genre")
+        .agg(pl.col("duration_seconds", "popularity").mean().round(2))
+        .sort("track_genre", descending=True)
+    )
+
+
+def artist_combinations(
+    lf: pl.LazyFrame,
+    genre: str | None = None,
+    artists: "ArtistModel | None" = None,
+) -> pl.LazyFrame:
+    """
+    Count how often each pair of artists appears together on a track.
+
+    Args:
+        lf (pl.LazyFrame): The cleaned tracks.
+        genre (str | None): Only consider the tracks of this genre, if given.
+        artists (ArtistModel | None): The artists of the tracks, to pair up their
+            integer IDs instead of splitting and exploding the names twice.
+
+    Returns:
+        pl.LazyFrame: Columns ``artists``, ``other_artist`` and ``count``, with
+            each unordered pair listed once (``artists > other_artist``).
+    """
+    if artists is not None:
+        entries = artists.explode(filter_genre(lf, genre).select(ROW_ID))
+        return (
+            entries.join(entries.rename({"artists": "other_artist"}), on=ROW_ID)
+            # The IDs are in the lexical order of the names
+            .filter(
+                pl.col("artists").to_physical() > pl.col("other_artist").to_physical()
+            )
+            .group_by("artists", "other_artist")
+            .len("count")
+            .with_columns(pl.col("artists", "other_artist").cast(pl.String))
+        )
+    return (
+        filter_genre(lf, genre)
+        .with_columns(pl.col("artists").cast(pl.String).str.split(";"))
+        .with_columns(pl.col("artists").alias("other_artist"))
+        .explode("artists")
+        .explode("other_artist")
+        # Remove an artist paired with themselves and the mirrored (B, A) duplicates
+        .filter(pl.col("artists") > pl.col("other_artist"))
+        .group_by("artists", "other_artist")
+        .len("count")
+    )
+
+
+def score_match_text(col: pl.Expr, string: str | None) -> pl.Expr:
+    """
+    Score how well a text column matches a search string.
+
+    Shorter values score higher, with a bonus of 50 if the value contains the
+    string and another 50 if it starts with it. An empty search scores 0.
+
+    Args:
+        col (pl.Expr): The text column to score.
+        string (str | None): The (case-insensitive) search string.
+
+    Returns:
+        pl.Expr: The score of each value.
+    """
+    if not string:
+        return pl.lit(0)
+    col = col.cast(pl.String).str.to_lowercase()
+    string = string.casefold()
+    return (
+        -col.str.len_chars().cast(pl.Int32())
+        + pl.when(col.str.contains(string, literal=True)).then(50).otherwise(0)
+        + pl.when(col.str.starts_with(string)).then(50).otherwise(0)
+    )
+
+
+def match_tracks(
+    lf: pl.LazyFrame,
+    artist: str | None = None,
+    track: str | None = None,
+    artists: "ArtistModel | None" = None,
+) -> pl.LazyFrame:
+    """
+    Find the tracks matching an artist and/or track name search.
+
+    Args:
+        lf (pl.LazyFrame): The cleaned tracks.
+        artist (str | None): Search string for the artist names.
+        track (str | None): Search string for the track name.
+        artists (ArtistModel | None): The artists of the tracks. Each distinct name
+            is then scored once, instead of once per track it appears on.
+
+    Returns:
+        pl.LazyFrame: The matching tracks, best ``match_score`` first.
+    """
+    if artists is None:
+        artist_score = (
+            pl.col("artists")
+            .cast(pl.String)
+            .str.split(";")
+            .list.eval(score_match_text(pl.element(), artist))
+            .list.sum()
+        )
+    else:
+        names = artists.names.to_frame().lazy()
+        scores = (
+            artists.bridge.lazy()
+            .join(
+                names.select(
+                    pl.col("artists").cast(artists.dtype),
+                    score_match_text(pl.col("artists"), artist).alias("artist_score"),
+                ),
+                on="artists",
+            )
+            .group_by(ROW_ID)
+            .agg(pl.col("artist_score").sum())
+        )
+        # Tracks without artists get a null score, as the sum of a null list would
+        lf = lf.join(scores, on=ROW_ID, how="left", maintain_order="left")
+        artist_score = pl.col("artist_score")
+    return (
+        lf.select(
+            pl.col("artists"),
+            pl.col("track_name"),
+            (score_match_text(pl.col("track_name"), track) + artist_score).alias(
+                "match_score"
+            ),
+            pl.col("album_name"),
+            pl.col("track_genre"),
+            pl.col("popularity"),
+            pl.col("duration_seconds"),
+        )
+        .filter(pl.col("match_score") > 0)
+        .sort("match_score", descending=True)
+    )
+
+
+def genres(lf: pl.LazyFrame) -> list[str]:
+    """Sorted list of the distinct genres, used for the genre dropdowns."""
+    return (
+        genre_listings(lf)
+        .select(pl.col("track_genre").cast(pl.String).unique().sort())
+        .collect()["track_genre"]
+        .to_list()
+    )
+
+
+def collect(lf: pl.LazyFrame, *, streaming: bool = False) -> pl.DataFrame:
+    """
+    Execute a lazy query.
+
+    Args:
+        lf (pl.LazyFrame): The query to execute.
+        streaming (bool): Run it with the streaming engine, which processes the
+            data in batches so that it does not need to fit in memory.
+
+    Returns:
+        pl.DataFrame: The result of the query.
+    """
+    return lf.collect(engine="streaming" if streaming else "auto")
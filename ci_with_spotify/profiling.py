@@ -0,0 +1,219 @@
+"""
+Per-stage instrumentation of the pipeline.
+
+Wrapping a stage in ``Profiler.stage`` records its wall time, the number of rows
+going in and out, the peak memory of the process and, for Polars queries, the
+optimized plan, so a slow cell can be traced back to the query at fault. The
+records can be shown as a table with ``to_frame`` or exported with ``to_json``.
+
+A disabled profiler hands out a shared no-op stage, so leaving the instrumentation
+in place costs a couple of attribute lookups per stage and never builds a plan.
+"""
+
+import json
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from pathlib import Path
+from typing import Any
+
+import polars as pl
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+RECORD_SCHEMA = {
+    "stage": pl.String,
+    "seconds": pl.Float64,
+    "rows_in": pl.Int64,
+    "rows_out": pl.Int64,
+    "peak_rss_mb": pl.Float64,
+    "peak_growth_mb": pl.Float64,
+    "plan": pl.String,
+}
+
+
+class Stage:
+    """
+    The measurements of a running stage, filled in by the code being profiled.
+
+    Attributes:
+        rows_in (int | None): Number of input rows, if known.
+        rows_out (int | None): Number of output rows, if known.
+        query (pl.LazyFrame | None): The query run by the stage, whose optimized plan
+            is recorded once the stage ends.
+    """
+
+    def __init__(self, rows_in: int | None = None) -> None:
+        self.rows_in = rows_in
+        self.rows_out: int | None = None
+        self.query: pl.LazyFrame | None = None
+
+
+class _NullStage(Stage):
+    """Stage handed out by a disabled profiler, ignoring whatever is set on it."""
+
+    rows_in = rows_out = query = None
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        pass
+
+
+# Context managers made with ``nullcontext`` are reusable, so this one is shared
+_DISABLED = nullcontext(_NullStage())
+
+
+class Profiler:
+    """
+    Records the cost of each stage of the pipeline.
+
+    Args:
+        enabled (bool): Whether to record anything at all.
+
+    Example:
+        >>> profiler = Profiler(enabled=True)
+        >>> with profiler.stage("clean") as stage:
+        ...     df = clean_tracks(lz).collect()
+        ...     stage.rows_out = df.height
+        >>> df = profiler.collect("genre means", genre_means(df.lazy()))
+        >>> profiler.to_frame()
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.records: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def stage(
+        self, name: str, rows_in: int | None = None
+    ) -> AbstractContextManager[Stage]:
+        """
+        Measure the code running within the block.
+
+        Args:
+            name (str): Name of the stage, e.g. the cell or query it belongs to.
+            rows_in (int | None): Number of input rows, if known.
+
+        Returns:
+            AbstractContextManager[Stage]: Set the ``rows_out`` and ``query`` of the
+                stage it yields to record them too.
+        """
+        if not self.enabled:
+            return _DISABLED
+        return self._measure(name, rows_in)
+
+    @contextmanager
+    def _measure(self, name: str, rows_in: int | None) -> Iterator[Stage]:
+        stage = Stage(rows_in)
+        peak_before = _peak_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            seconds = time.perf_counter() - start
+            peak_after = _peak_rss_mb()
+            record = {
+                "stage": name,
+                "seconds": seconds,
+                "rows_in": stage.rows_in,
+                "rows_out": stage.rows_out,
+                "peak_rss_mb": peak_after,
+                # Only non-zero if the stage pushed the process to a new peak
+                "peak_growth_mb": None
+                if peak_after is None
+                else peak_after - peak_before,
+                # Explained after the timer stopped, so it does not count towards the stage
+                "plan": _explain(stage.query),
+            }
+            with self._lock:
+                self.records.append(record)
+
+    def collect(
+        self,
+        name: str,
+        lf: pl.LazyFrame,
+        *,
+        streaming: bool = False,
+        rows_in: int | None = None,
+    ) -> pl.DataFrame:
+        """
+        Collect a query as a profiled stage, recording its plan and output rows.
+
+        Args:
+            name (str): Name of the stage.
+            lf (pl.LazyFrame): The query to run.
+            streaming (bool): Run it with the streaming engine.
+            rows_in (int | None): Number of input rows, if known.
+
+        Returns:
+            pl.DataFrame: The result of the query.
+        """
+        with self.stage(name, rows_in) as stage:
+            df = lf.collect(engine="streaming" if streaming else "auto")
+            stage.query = lf
+            stage.rows_out = df.height
+        return df
+
+    def to_frame(self) -> pl.DataFrame:
+        """The records as a table, one row per stage run."""
+        with self._lock:
+            return pl.DataFrame(self.records, schema=RECORD_SCHEMA)
+
+    def summary(self) -> pl.DataFrame:
+        """Total and mean time and number of runs of each stage, slowest first."""
+        return (
+            self.to_frame()
+            .group_by("stage")
+            .agg(
+                pl.len().alias("runs"),
+                pl.col("seconds").sum().alias("total_seconds"),
+                pl.col("seconds").mean().alias("mean_seconds"),
+                pl.col("peak_rss_mb").max(),
+            )
+            .sort("total_seconds", descending=True)
+        )
+
+    def to_json(self, path: str | Path | None = None) -> str:
+        """
+        The records as JSON, also written to ``path`` if given.
+
+        Args:
+            path (str | Path | None): File to write the JSON to.
+
+        Returns:
+            str: The JSON document, a list with one object per stage run.
+        """
+        with self._lock:
+            document = json.dumps(self.records, indent=2)
+        if path is not None:
+            Path(path).write_text(document)
+        return document
+
+    def clear(self) -> None:
+        """Forget every record."""
+        with self._lock:
+            self.records.clear()
+
+
+def _explain(query: pl.LazyFrame | None) -> str | None:
+    """The optimized plan of a query, or None if it has none or cannot be planned."""
+    if query is None:
+        return None
+    try:
+        return query.explain()
+    except pl.exceptions.PolarsError:
+        # Explaining is done in a `finally`, where raising would mask the error of the stage
+        return None
+
+
+def _peak_rss_mb() -> float | None:
+    """Peak resident memory of the process so far, in MiB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in KiB on Linux, but in bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
@@ -0,0 +1,209 @@
+"""
+Headless batch reports of the EDA, one genre per task, across a process pool.
+
+The cleaned tracks are first materialized in the ``TracksCache``, as an Arrow IPC
+file that every worker memory-maps: the table is shared between the processes
+through the OS page cache instead of being pickled to each of them. Each task only
+receives a genre and the indices of its rows, and returns the small per-genre
+tables, which are concatenated (with a ``track_genre`` column) and written out as
+parquet or JSON next to a ``report.json`` summary::
+
+    python main.py report input/tracks.parquet --output reports/ --workers 8
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.cache import DEFAULT_CACHE_DIR, TracksCache
+
+TABLES = ["durations", "means", "top_artists", "collaborations"]
+FORMATS = ["parquet", "json"]
+
+# The memory-mapped tracks of a worker process, opened once by ``_init_worker``
+_tracks: pl.DataFrame | None = None
+
+
+def genre_report(tracks: pl.DataFrame, top: int = 20) -> dict[str, pl.DataFrame]:
+    """
+    The report tables of the tracks of a single genre.
+
+    Args:
+        tracks (pl.DataFrame): The cleaned tracks of one genre.
+        top (int): Number of artists and artist pairs to keep.
+
+    Returns:
+        dict[str, pl.DataFrame]: The duration histogram (``durations``), the mean
+            duration and popularity (``means``), the most popular artists
+            (``top_artists``) and the most frequent collaborations
+            (``collaborations``).
+    """
+    lf = tracks.lazy()
+    durations, means, top_artists, collaborations = pl.collect_all(
+        [
+            pipeline.duration_counts(lf).sort("duration_seconds"),
+            pipeline.genre_means(lf).drop("track_genre"),
+            pipeline.most_popular_artists(lf)
+            .sort("popularity", "artists", descending=[True, False])
+            .head(top),
+            pipeline.artist_combinations(lf)
+            .sort("count", "artists", "other_artist", descending=[True, False, False])
+            .head(top),
+        ]
+    )
+    return {
+        "durations": durations,
+        "means": means,
+        "top_artists": top_artists,
+        "collaborations": collaborations,
+    }
+
+
+def build_report(
+    source: str | Path,
+    output: str | Path,
+    *,
+    workers: int | None = None,
+    genres: Iterable[str] | None = None,
+    min_dur: float | None = None,
+    max_dur: float | None = None,
+    top: int = 20,
+    fmt: str = "parquet",
+    cache_dir: str | Path = DEFAULT_CACHE_DIR,
+) -> dict[str, Any]:
+    """
+    Compute the report of every genre and write it to a directory.
+
+    Args:
+        source (str | Path): Path to the raw tracks parquet file, or a glob or
+            directory of parquet shards.
+        output (str | Path): Directory the report is written to, created on demand.
+        workers (int | None): Number of worker processes, defaults to the number of
+            CPUs. With 1, everything runs in the current process.
+        genres (Iterable[str] | None): Only report on these genres, all by default.
+        min_dur (float | None): Only keep the tracks lasting at least this long (s).
+        max_dur (float | None): Only keep the tracks lasting at most this long (s).
+        top (int): Number of artists and artist pairs to keep per genre.
+        fmt (str): ``"parquet"`` or ``"json"``.
+        cache_dir (str | Path): Directory of the ``TracksCache``.
+
+    Returns:
+        dict[str, Any]: The summary written to ``report.json``: the source, the
+            number of tracks per genre, the written files and the timings.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, choose from {FORMATS}")
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    cache = TracksCache(cache_dir)
+    tracks = cache.load(source)
+    path = cache.path(source)
+
+    rows = tracks.select("track_genre", "duration_seconds").with_row_index("row")
+    if min_dur is not None or max_dur is not None:
+        rows = rows.filter(
+            pipeline.duration_in_range(
+                -np.inf if min_dur is None else min_dur,
+                np.inf if max_dur is None else max_dur,
+            )
+        )
+    if genres is not None:
+        rows = rows.filter(pl.col("track_genre").is_in(list(genres)))
+    grouped = rows.group_by("track_genre").agg("row").sort("track_genre")
+    tasks = [
+        (genre, positions.to_numpy())
+        for genre, positions in zip(grouped["track_genre"].to_list(), grouped["row"])
+    ]
+    loaded = time.perf_counter()
+
+    if workers == 1:
+        results = [genre_report(tracks[positions], top) for _, positions in tasks]
+    else:
+        # Submit the largest genres first, so that no worker is left with a big one at the end
+        order = sorted(range(len(tasks)), key=lambda i: -tasks[i][1].size)
+        with (
+            _polars_threads(max(1, (os.cpu_count() or 1) // workers)),
+            ProcessPoolExecutor(
+                max_workers=workers,
+                # Forking a process that already runs Polars' thread pool can deadlock
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(path,),
+            ) as pool,
+        ):
+            done = pool.map(_run_task, [tasks[i] for i in order], [top] * len(tasks))
+            results = [None] * len(tasks)
+            for i, tables in zip(order, done):
+                results[i] = tables
+    computed = time.perf_counter()
+
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for table in TABLES:
+        frames = [
+            tables[table].select(pl.lit(genre).alias("track_genre"), pl.all())
+            for (genre, _), tables in zip(tasks, results)
+        ]
+        df = pl.concat(frames, how="vertical_relaxed") if frames else pl.DataFrame()
+        files[table] = _write(df, output / f"{table}.{fmt}", fmt)
+
+    summary = {
+        "source": str(source),
+        "workers": workers,
+        "tracks": {genre: int(positions.size) for genre, positions in tasks},
+        "files": files,
+        "seconds": {
+            "load": loaded - start,
+            "genres": computed - loaded,
+            "total": time.perf_counter() - start,
+        },
+    }
+    (output / "report.json").write_text(json.dumps(summary, indent=2))
+    return summary
+
+
+def _init_worker(path: Path) -> None:
+    global _tracks
+    _tracks = pl.read_ipc(path, memory_map=True, rechunk=False)
+
+
+def _run_task(task: tuple[str, np.ndarray], top: int) -> dict[str, pl.DataFrame]:
+    _genre, positions = task
+    return genre_report(_tracks[positions], top)
+
+
+def _write(df: pl.DataFrame, path: Path, fmt: str) -> str:
+    if fmt == "parquet":
+        df.write_parquet(path)
+    else:
+        df.write_json(path)
+    return path.name
+
+
+@contextmanager
+def _polars_threads(threads: int) -> Iterator[None]:
+    """
+    Limit the Polars thread pool of the processes started within the block.
+
+    Every worker would otherwise start one thread per CPU, oversubscribing them.
+    """
+    previous = os.environ.get("POLARS_MAX_THREADS")
+    os.environ["POLARS_MAX_THREADS"] = str(threads)
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ["POLARS_MAX_THREADS"]
+        else:
+            os.environ["POLARS_MAX_THREADS"] = previous
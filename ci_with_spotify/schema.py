@@ -0,0 +1,162 @@
+"""
+Compact in-memory schema for the tracks table.
+
+By default every text column is a plain string and every number is 64-bit, even
+the 0 ~ 11 ``key`` and the 0 / 1 ``mode``. ``compact_tracks`` narrows each column
+to the smallest type that holds its values:
+
+- ``track_genre`` becomes an Enum (one byte per row for the 114 genres) when the
+  genres are known up front, and a Categorical otherwise.
+- ``artists`` and ``album_name`` are dictionary encoded as Categoricals, so each
+  distinct value is stored once and every row only holds a 4-byte code.
+- ``key``, ``mode``, ``time_signature`` and the raw 0 ~ 100 ``popularity`` become
+  8-bit integers, the durations and ``row_id`` 32-bit integers.
+- The audio features (and the cleaned 0 ~ 1.0 ``popularity``) become ``Float32``.
+
+``track_name`` is left as a string: most names are distinct, so a dictionary
+would barely make it smaller. Use ``memory_report`` to see what was saved::
+
+    compact = compact_tracks(df)
+    memory_report(df, compact)
+"""
+
+from collections.abc import Iterable
+
+import polars as pl
+
+from ci_with_spotify.pipeline import ROW_ID, clean_tracks
+
+FEATURES = [
+    "danceability",
+    "energy",
+    "loudness",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo",
+]
+
+COMPACT_DTYPES: dict[str, pl.DataType] = {
+    ROW_ID: pl.UInt32(),
+    "Unnamed: 0": pl.UInt32(),
+    "artists": pl.Categorical(),
+    "album_name": pl.Categorical(),
+    "duration_ms": pl.UInt32(),
+    "duration_seconds": pl.UInt32(),
+    # -1 is used when no key was detected
+    "key": pl.Int8(),
+    "mode": pl.UInt8(),
+    "time_signature": pl.UInt8(),
+    **{feature: pl.Float32() for feature in FEATURES},
+}
+
+
+def compact_tracks(
+    tracks: pl.DataFrame | pl.LazyFrame, genres: Iterable[str] | None = None
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Narrow the columns of a tracks table to their compact types.
+
+    Works on the raw as well as the cleaned tracks, eagerly or lazily, and only
+    touches the columns that are present. The casts are strict, so a value that
+    does not fit its compact type raises instead of being silently truncated.
+
+    Args:
+        tracks (pl.DataFrame | pl.LazyFrame): The tracks to compact.
+        genres (Iterable[str] | None): Every genre of the table, to store
+            ``track_genre`` as an Enum. It is stored as a Categorical if omitted.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: The same rows with the compact schema.
+
+    Example:
+        >>> df = compact_tracks(clean_tracks(scan_tracks())).collect()
+    """
+    schema = tracks.collect_schema()
+    dtypes = {name: dtype for name, dtype in COMPACT_DTYPES.items() if name in schema}
+    if "popularity" in schema:
+        # An integer 0 ~ 100 before cleaning, a fraction 0 ~ 1.0 after it
+        integer = schema["popularity"].is_integer()
+        dtypes["popularity"] = pl.UInt8() if integer else pl.Float32()
+    if "track_genre" in schema:
+        dtypes["track_genre"] = (
+            pl.Categorical() if genres is None else pl.Enum(sorted(set(genres)))
+        )
+    return tracks.with_columns(
+        pl.col(name).cast(dtype, strict=True) for name, dtype in dtypes.items()
+    )
+
+
+def clean_compact_tracks(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    The cleaned tracks with the compact schema, as a ``TracksCache`` transform.
+
+    Example:
+        >>> df = TracksCache().load("input/tracks.parquet", clean_compact_tracks)
+    """
+    return compact_tracks(clean_tracks(lf))
+
+
+def column_size(series: pl.Series) -> int:
+    """
+    Estimated number of bytes held by a column, including its dictionary.
+
+    Polars shares the dictionary of Categoricals across columns, so
+    ``estimated_size`` only counts their codes. The size of the distinct values is
+    added here, so dictionary-encoded columns can be compared to plain ones.
+    """
+    size = series.estimated_size()
+    if isinstance(series.dtype, pl.Enum):
+        size += series.dtype.categories.estimated_size()
+    elif isinstance(series.dtype, pl.Categorical):
+        size += series.unique().cast(pl.String).estimated_size()
+    return size
+
+
+def memory_report(before: pl.DataFrame, after: pl.DataFrame) -> pl.DataFrame:
+    """
+    Compare the memory footprint of the columns of two versions of a table.
+
+    Args:
+        before (pl.DataFrame): The table with its original schema.
+        after (pl.DataFrame): The same table with the compact schema.
+
+    Returns:
+        pl.DataFrame: One row per column of ``before`` with its types, sizes in
+            bytes and the ``ratio`` of the sizes, largest saving first, followed by
+            a ``total`` row.
+
+    Example:
+        >>> memory_report(df, compact_tracks(df))
+    """
+    rows = [
+        {
+            "column": name,
+            "dtype_before": str(before[name].dtype),
+            "dtype_after": str(after[name].dtype) if name in after else None,
+            "bytes_before": column_size(before[name]),
+            "bytes_after": column_size(after[name]) if name in after else 0,
+        }
+        for name in before.columns
+    ]
+    report = pl.DataFrame(
+        rows,
+        schema={
+            "column": pl.String,
+            "dtype_before": pl.String,
+            "dtype_after": pl.String,
+            "bytes_before": pl.Int64,
+            "bytes_after": pl.Int64,
+        },
+    ).sort(pl.col("bytes_before") - pl.col("bytes_after"), descending=True)
+    total = report.select(
+        pl.lit("total").alias("column"),
+        pl.lit(None, pl.String).alias("dtype_before"),
+        pl.lit(None, pl.String).alias("dtype_after"),
+        pl.col("bytes_before", "bytes_after").sum(),
+    )
+    return pl.concat([report, total]).with_columns(
+        (pl.col("bytes_before") / pl.col("bytes_after")).round(2).alias("ratio")
+    )
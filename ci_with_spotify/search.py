@@ -0,0 +1,293 @@
+"""
+Precomputed search index for the artist / track name finder.
+
+``pipeline.match_tracks`` lowercases and scans every track and artist name on each
+keystroke. The ``SearchIndex`` does that work once per dataset: it keeps the
+distinct lowercased track and artist names with their lengths, an inverted index
+from character trigrams to the names containing them, and the mapping from each
+name back to the rows it appears on. A search then only verifies the few names
+sharing the query's trigrams and scores the rows they map to, returning the same
+``match_score`` as ``pipeline.score_match_text``.
+"""
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify.artists import ArtistModel
+
+NGRAM = 3
+RESULT_COLUMNS = [
+    "artists",
+    "track_name",
+    "match_score",
+    "album_name",
+    "track_genre",
+    "popularity",
+    "duration_seconds",
+]
+
+
+class _NameIndex:
+    """Distinct lowercased names, their trigram postings and the rows they map to."""
+
+    def __init__(self, codes: np.ndarray, rows: np.ndarray, names: pl.Series) -> None:
+        self.names = names
+        self.lengths = names.str.len_chars().to_numpy().astype(np.int32)
+        # Rows of each name, as a CSR structure: rows[offsets[i]:offsets[i + 1]]
+        order = np.argsort(codes, kind="stable")
+        self.rows = rows[order]
+        self.offsets = _offsets(np.bincount(codes, minlength=names.len()))
+        self.grams, self.gram_offsets, self.postings = _ngram_postings(names)
+
+    def matches(self, query: str) -> tuple[np.ndarray, np.ndarray]:
+        """IDs of the names containing the query, and whether they also start with it."""
+        if len(query) >= NGRAM:
+            codes = np.unique(_gram_codes(_code_points(query)))
+            positions = np.searchsorted(self.grams, codes)
+            if (positions == self.grams.size).any() or (
+                self.grams[positions] != codes
+            ).any():
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+            postings = sorted(
+                (
+                    self.postings[self.gram_offsets[i] : self.gram_offsets[i + 1]]
+                    for i in positions
+                ),
+                key=len,
+            )
+            # Intersect the shortest postings first to keep the intermediate sets small
+            candidates = postings[0]
+            for posting in postings[1:]:
+                candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        else:
+            # Too short for the trigram index, fall back to scanning the distinct names
+            candidates = np.arange(self.names.len())
+        names = self.names.gather(candidates)
+        contains = names.str.contains(query, literal=True).fill_null(False).to_numpy()
+        candidates = candidates[contains]
+        starts = names.filter(contains).str.starts_with(query).to_numpy()
+        return candidates, starts
+
+    def rows_of(self, ids: np.ndarray) -> np.ndarray:
+        """All the rows on which any of the names appear."""
+        starts = self.offsets[ids]
+        return self.rows[_ranges(starts, self.offsets[ids + 1] - starts)]
+
+    def score(
+        self, codes: np.ndarray, ids: np.ndarray, starts: np.ndarray
+    ) -> np.ndarray:
+        """
+        Score of some names, given the (sorted) IDs of the names matching the query.
+
+        Names not containing the query score ``-len(name)``, as in ``score_match_text``.
+        """
+        scores = -self.lengths[codes].astype(np.int64)
+        if ids.size:
+            positions = np.minimum(np.searchsorted(ids, codes), ids.size - 1)
+            hit = ids[positions] == codes
+            scores[hit] += 50 + 50 * starts[positions[hit]].astype(np.int64)
+        return scores
+
+
+def _code_points(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+def _gram_codes(points: np.ndarray) -> np.ndarray:
+    """Pack every run of ``NGRAM`` consecutive code points (21 bits each) in an integer."""
+    count = max(points.size - NGRAM + 1, 0)
+    codes = np.zeros(count, dtype=np.uint64)
+    for i in range(NGRAM):
+        codes = (codes << np.uint64(21)) | points[i : i + count].astype(np.uint64)
+    return codes
+
+
+def _ngram_postings(names: pl.Series) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Inverted index from the trigrams to the IDs of the names containing them.
+
+    Returns the sorted trigram codes, and the CSR offsets and name IDs of their postings.
+    """
+    lengths = names.str.len_chars().to_numpy().astype(np.int64)
+    # All the names back to back, each trigram is kept if it does not cross a boundary
+    codes = _gram_codes(_code_points("".join(names.to_list())))
+    ids = np.repeat(np.arange(lengths.size), lengths)[: codes.size]
+    ends = np.repeat(_offsets(lengths)[1:], lengths)[: codes.size]
+    inside = np.arange(codes.size) + NGRAM <= ends
+    codes, ids = codes[inside], ids[inside]
+
+    # A stable sort keeps the IDs of each trigram in ascending order
+    order = np.argsort(codes, kind="stable")
+    codes, ids = codes[order], ids[order]
+    first = np.ones(codes.size, dtype=bool)
+    first[1:] = (codes[1:] != codes[:-1]) | (ids[1:] != ids[:-1])
+    codes, ids = codes[first], ids[first]
+    grams, starts = np.unique(codes, return_index=True)
+    return grams, np.append(starts, codes.size), ids
+
+
+def _offsets(counts: np.ndarray) -> np.ndarray:
+    """CSR offsets from the number of entries of each item."""
+    return np.concatenate(
+        [np.zeros(1, dtype=np.int64), np.cumsum(counts, dtype=np.int64)]
+    )
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenation of ``arange(start, start + count)`` for each pair, vectorized."""
+    firsts = np.cumsum(counts) - counts
+    return np.repeat(starts - firsts, counts) + np.arange(counts.sum())
+
+
+def _encode(values: pl.Series) -> tuple[np.ndarray, pl.Series]:
+    names = values.unique().sort()
+    codes = values.cast(pl.Enum(names)).to_physical().to_numpy().astype(np.int64)
+    return codes, names
+
+
+class SearchIndex:
+    """
+    Ranked fuzzy search over the track and artist names, built once per dataset.
+
+    Args:
+        tracks (pl.DataFrame): The cleaned tracks.
+        track_names (_NameIndex): Index of the lowercased track names.
+        track_codes (np.ndarray): Track name ID of each row.
+        artists (_NameIndex): Index of the lowercased artist names.
+        artist_codes (np.ndarray): Artist ID of each (row, artist) entry, row-major.
+        artist_offsets (np.ndarray): Entries of row ``i`` are
+            ``artist_codes[artist_offsets[i]:artist_offsets[i + 1]]``.
+
+    Example:
+        >>> index = SearchIndex.build(df)
+        >>> index.search(artist="taylor", track="love", k=20)
+    """
+
+    def __init__(
+        self,
+        tracks: pl.DataFrame,
+        track_names: _NameIndex,
+        track_codes: np.ndarray,
+        artists: _NameIndex,
+        artist_codes: np.ndarray,
+        artist_offsets: np.ndarray,
+    ) -> None:
+        self.tracks = tracks
+        self.track_names = track_names
+        self.track_codes = track_codes
+        self.artists = artists
+        self.artist_codes = artist_codes
+        self.artist_offsets = artist_offsets
+        # Rows missing a searched name never match, as with `match_tracks`
+        self.has_track_name = tracks["track_name"].is_not_null().to_numpy()
+        self.has_artists = tracks["artists"].is_not_null().to_numpy()
+
+    @classmethod
+    def build(
+        cls, tracks: pl.DataFrame, artists: ArtistModel | None = None
+    ) -> "SearchIndex":
+        """
+        Build the index from the cleaned tracks.
+
+        Args:
+            tracks (pl.DataFrame): The cleaned tracks.
+            artists (ArtistModel | None): The artists of the tracks, so only their
+                distinct names are lowercased. Built from the tracks if omitted.
+
+        Returns:
+            SearchIndex: The index of the track and artist names.
+        """
+        rows = np.arange(tracks.height, dtype=np.int64)
+        track_codes, track_names = _encode(
+            tracks["track_name"].cast(pl.String).str.to_lowercase().fill_null("")
+        )
+        if artists is None:
+            artists = ArtistModel.build(tracks)
+        artist_ids, artist_counts = artists.entries(tracks)
+        # Names differing only by case share the same lowercased entry
+        lower_codes, artist_names = _encode(artists.names.str.to_lowercase())
+        artist_codes = lower_codes[artist_ids]
+        return cls(
+            tracks,
+            _NameIndex(track_codes, rows, track_names),
+            track_codes,
+            _NameIndex(artist_codes, np.repeat(rows, artist_counts), artist_names),
+            artist_codes,
+            _offsets(artist_counts),
+        )
+
+    def search(
+        self,
+        artist: str | None = None,
+        track: str | None = None,
+        k: int = 50,
+        where: np.ndarray | None = None,
+    ) -> pl.DataFrame:
+        """
+        The ``k`` best matching tracks for an artist and/or track name search.
+
+        Args:
+            artist (str | None): Search string for the artist names.
+            track (str | None): Search string for the track name.
+            k (int): Maximum number of results.
+            where (np.ndarray | None): Boolean mask of the rows to consider, for
+                example the tracks within the selected duration range.
+
+        Returns:
+            pl.DataFrame: The matching tracks, best ``match_score`` first, with the
+                same columns as ``pipeline.match_tracks``.
+        """
+        artist = artist.casefold() if artist else None
+        track = track.casefold() if track else None
+        # A row can only score above zero if one of its names contains a query
+        candidates = []
+        if track:
+            track_matches = self.track_names.matches(track)
+            candidates.append(self.track_names.rows_of(track_matches[0]))
+        if artist:
+            artist_matches = self.artists.matches(artist)
+            candidates.append(self.artists.rows_of(artist_matches[0]))
+        if not candidates:
+            return self.tracks.clear().with_columns(
+                pl.lit(0, dtype=pl.Int64).alias("match_score")
+            )[RESULT_COLUMNS]
+
+        rows = np.unique(np.concatenate(candidates))
+        # The artist part of the score is null without artists, even if not searched
+        rows = rows[self.has_artists[rows]]
+        if track:
+            rows = rows[self.has_track_name[rows]]
+        if where is not None:
+            rows = rows[where[rows]]
+        scores = np.zeros(rows.size, dtype=np.int64)
+        if track:
+            scores += self.track_names.score(self.track_codes[rows], *track_matches)
+        if artist:
+            scores += self._artist_score_sums(rows, artist_matches)
+
+        keep = scores > 0
+        rows, scores = rows[keep], scores[keep]
+        if rows.size > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.lexsort((rows, -scores))
+        return (
+            self.tracks[rows[order]]
+            .with_columns(pl.Series("match_score", scores[order]))
+            .select(RESULT_COLUMNS)
+        )
+
+    def _artist_score_sums(
+        self, rows: np.ndarray, matches: tuple[np.ndarray, np.ndarray]
+    ) -> np.ndarray:
+        """Sum of the artist scores of each row."""
+        if rows.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts = self.artist_offsets[rows]
+        counts = self.artist_offsets[rows + 1] - starts
+        entries = _ranges(starts, counts)
+        # Rows with artists have at least one entry, so the segments are never empty
+        return np.add.reduceat(
+            self.artists.score(self.artist_codes[entries], *matches),
+            np.cumsum(counts) - counts,
+        )
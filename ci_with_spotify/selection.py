@@ -0,0 +1,62 @@
+"""
+Resolving plot selections back to the rows they came from.
+
+Joining the selected points back to the tracks on the plotted columns is a wide
+hash join on float keys, which is slow and also matches any other track sharing
+the same values. Instead the plots carry the ``row_id`` of each point (through
+``hover_data``, which plotly stores as the points' custom data), and a selection
+is resolved with a binary search over the ascending ``row_id`` column followed by
+a gather.
+"""
+
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+import polars as pl
+
+from ci_with_spotify.pipeline import ROW_ID
+
+
+def selected_row_ids(points: Iterable[Mapping[str, Any]] | None) -> pl.Series | None:
+    """
+    The row IDs of the selected points of a plot.
+
+    Args:
+        points (Iterable[Mapping[str, Any]] | None): The selected points, such as the
+            value of a ``mo.ui.plotly`` whose figure has ``row_id`` in its hover data.
+
+    Returns:
+        pl.Series | None: The distinct row IDs, or None if nothing is selected or the
+            points do not carry row IDs (e.g. the cells of a density grid).
+    """
+    ids = [point[ROW_ID] for point in points or () if ROW_ID in point]
+    if not ids:
+        return None
+    return pl.Series(ROW_ID, ids, dtype=pl.Int64).unique()
+
+
+def take_rows(df: pl.DataFrame, row_ids: Iterable[int]) -> pl.DataFrame:
+    """
+    The rows of a table with the given row IDs, in ``row_id`` order.
+
+    Args:
+        df (pl.DataFrame): Tracks with a ``row_id`` column, such as the cleaned
+            tracks or any filtered subset of them.
+        row_ids (Iterable[int]): The IDs to look up. Unknown IDs are ignored.
+
+    Returns:
+        pl.DataFrame: The matching rows.
+
+    Example:
+        >>> take_rows(filtered_duration, selected_row_ids(chart2.value))
+    """
+    column = df[ROW_ID]
+    ids = pl.Series(ROW_ID, row_ids).cast(column.dtype).unique().sort()
+    if ids.is_empty() or df.is_empty():
+        return df.clear()
+    if not column.is_sorted():
+        return df.filter(pl.col(ROW_ID).is_in(ids.implode()))
+    # Filtering preserves the order of the rows, so the IDs can be binary searched
+    positions = column.search_sorted(ids, side="left").clip(upper_bound=df.height - 1)
+    found = column.gather(positions) == ids
+    return df[positions.filter(found)]
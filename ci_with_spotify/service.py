@@ -0,0 +1,501 @@
+"""
+Local HTTP/JSON query service over the EDA aggregations.
+
+The notebook recomputes its tables inside one Python process, for one user. The
+``QueryService`` serves the same aggregations to other local tools (scripts,
+dashboards, ``curl``) over HTTP:
+
+- the cleaned tracks are loaded once, through the ``TracksCache``, and stay
+  resident together with their ``ArtistModel`` and ``SearchIndex``;
+- the aggregations of each duration range (``PopularArtists``,
+  ``CollaborationIndex``, the genre means) are built on the first query that needs
+  them and kept in an LRU, as are the encoded responses, keyed by the normalized
+  query parameters, so ``?genre=pop&limit=10`` and ``?limit=10&genre=pop`` share an
+  entry. Concurrent requests for the same entry wait for a single computation;
+- every response carries an ``ETag`` (a hash of its body), and requests whose
+  ``If-None-Match`` header lists it get an empty ``304 Not Modified``;
+- the requests are handled by a fixed pool of worker threads. Polars releases the
+  GIL while it runs a query, so a slow aggregation does not hold up the lookups.
+  A kept-alive connection holds its worker until its next request, so idle ones
+  are closed after ``idle_timeout`` seconds, and never starve the other clients
+  for longer than that.
+
+Endpoints (``GET`` only, the duration range is ``min_duration`` / ``max_duration``
+in seconds, every track by default)::
+
+    /health                                    the number of tracks and cache stats
+    /genres                                    the genres, sorted
+    /genres/means                              average duration and popularity
+    /artists?genre=pop&limit=20                most popular artists (all genres
+                                               without ``genre``)
+    /collaborations?genre=pop&limit=20         most frequent artist pairs
+    /collaborations?artist=Adele&limit=10      top collaborators of an artist
+    /search?artist=taylor&track=love&limit=20  tracks matching the names
+
+Example:
+    >>> service = QueryService.load("input/tracks.parquet")
+    >>> server = make_server(service, port=8000)
+    >>> server.serve_forever()  # curl "localhost:8000/artists?genre=pop&limit=5"
+"""
+
+import hashlib
+import json
+import math
+import sys
+import threading
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future, ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+import polars as pl
+
+from ci_with_spotify.aggregations import PopularArtists
+from ci_with_spotify.artists import ArtistModel
+from ci_with_spotify.cache import LRUCache, TracksCache, Transform
+from ci_with_spotify.collaborations import CollaborationIndex
+from ci_with_spotify.pipeline import (
+    clean_tracks,
+    duration_in_range,
+    filter_duration,
+    genre_means,
+    genres,
+)
+from ci_with_spotify.search import SearchIndex
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 1_000
+# Seconds a kept-alive connection may wait for its next request, holding a worker
+DEFAULT_IDLE_TIMEOUT = 5.0
+
+# The parameters each endpoint accepts, besides the duration range
+_PARAMETERS = {
+    "/health": set(),
+    "/genres": set(),
+    "/genres/means": set(),
+    "/artists": {"genre", "limit"},
+    "/collaborations": {"genre", "artist", "limit"},
+    "/search": {"artist", "track", "limit"},
+}
+_DURATION = {"min_duration", "max_duration"}
+
+
+def _float(name: str, value: str) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {value!r}") from None
+    if math.isnan(number):
+        raise ValueError(f"{name} must be a number, got {value!r}")
+    return number
+
+
+def _limit(value: str) -> int:
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError(f"limit must be an integer, got {value!r}") from None
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}, got {limit}")
+    return limit
+
+
+def normalize_query(path: str, query: str) -> tuple[str, tuple[tuple[str, Any], ...]]:
+    """
+    The endpoint and its parameters, parsed, validated and with the defaults filled in.
+
+    Two requests for the same result normalize to the same key, whatever the order
+    of their parameters, the spelling of the numbers or the blanks around the names.
+
+    Args:
+        path (str): The path of the request, e.g. ``"/artists"``.
+        query (str): Its query string, e.g. ``"genre=pop&limit=10"``.
+
+    Returns:
+        tuple[str, tuple[tuple[str, Any], ...]]: The endpoint and the sorted
+            ``(name, value)`` pairs of its parameters.
+
+    Raises:
+        LookupError: If there is no such endpoint.
+        ValueError: If a parameter is unknown, repeated or invalid.
+    """
+    endpoint = path.rstrip("/") or "/"
+    if endpoint not in _PARAMETERS:
+        raise LookupError(f"no endpoint {path!r}")
+    allowed = _PARAMETERS[endpoint] | (_DURATION if endpoint != "/health" else set())
+    raw = parse_qs(query, keep_blank_values=True)
+    unknown = sorted(set(raw) - allowed)
+    if unknown:
+        raise ValueError(f"unknown parameters for {endpoint}: {', '.join(unknown)}")
+    repeated = sorted(name for name, values in raw.items() if len(values) > 1)
+    if repeated:
+        raise ValueError(f"repeated parameters: {', '.join(repeated)}")
+
+    params: dict[str, Any] = {}
+    for name in sorted(allowed):
+        value = raw[name][0].strip() if name in raw else ""
+        if name == "limit":
+            params[name] = _limit(value) if value else DEFAULT_LIMIT
+        elif name == "min_duration":
+            params[name] = _float(name, value) if value else 0.0
+        elif name == "max_duration":
+            params[name] = _float(name, value) if value else math.inf
+        else:
+            # An empty name means no filter, as with the notebook's text boxes
+            params[name] = value or None
+    if params.get("min_duration", 0.0) > params.get("max_duration", math.inf):
+        raise ValueError("min_duration must not be greater than max_duration")
+    return endpoint, tuple(params.items())
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _encode(payload: Any) -> bytes:
+    if isinstance(payload, pl.DataFrame):
+        payload = {"rows": payload.to_dicts()}
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class QueryService:
+    """
+    The cleaned tracks kept in memory, and the cached answers of the endpoints.
+
+    Args:
+        tracks (pl.DataFrame): The cleaned tracks.
+        max_results (int): Maximum number of encoded responses kept in the LRU.
+        max_aggregates (int): Maximum number of aggregations (e.g. the
+            ``PopularArtists`` of a duration range) kept in the LRU.
+
+    Attributes:
+        hits (int): Number of queries answered from the cache.
+        misses (int): Number of queries that were computed.
+
+    Example:
+        >>> service = QueryService(tracks)
+        >>> etag, body = service.query("/artists", "genre=pop&limit=5")
+    """
+
+    def __init__(
+        self, tracks: pl.DataFrame, max_results: int = 256, max_aggregates: int = 16
+    ) -> None:
+        self.tracks = tracks
+        self.artist_model = ArtistModel.build(tracks)
+        self.search_index = SearchIndex.build(tracks, self.artist_model)
+        self.results = LRUCache(max_results)
+        self.aggregates = LRUCache(max_aggregates)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(
+        cls,
+        source: str | Path = "input/tracks.parquet",
+        transform: Transform = clean_tracks,
+        *,
+        cache: TracksCache | None = None,
+        **kwargs: Any,
+    ) -> "QueryService":
+        """
+        Load the cleaned tracks once, through the ``TracksCache``.
+
+        Args:
+            source (str | Path): Parquet file, glob or directory holding the raw tracks.
+            transform (Transform): The cleaning steps.
+            cache (TracksCache | None): The cache to load the tracks from, the
+                default ``TracksCache()`` if None.
+            **kwargs: Passed on to ``QueryService``.
+
+        Returns:
+            QueryService: The service over the loaded tracks.
+        """
+        return cls((cache or TracksCache()).load(source, transform), **kwargs)
+
+    def query(self, path: str, query: str = "") -> tuple[str, bytes]:
+        """
+        The ETag and JSON body answering a request.
+
+        Args:
+            path (str): The path of the request, e.g. ``"/artists"``.
+            query (str): Its query string.
+
+        Returns:
+            tuple[str, bytes]: The ETag and the UTF-8 encoded JSON body.
+
+        Raises:
+            LookupError: If there is no such endpoint.
+            ValueError: If the parameters are invalid.
+        """
+        endpoint, params = normalize_query(path, query)
+        if endpoint == "/health":
+            # Never cached, so that it reports the current counters
+            body = _encode(self.health())
+            return _etag(body), body
+
+        def compute() -> tuple[str, bytes]:
+            body = _encode(self._answer(endpoint, **dict(params)))
+            return _etag(body), body
+
+        return self._cached(self.results, (endpoint, params), compute, count=True)
+
+    def health(self) -> dict[str, Any]:
+        """The number of tracks, and the state of the result cache."""
+        return {
+            "status": "ok",
+            "tracks": self.tracks.height,
+            "cache": {
+                "entries": len(self.results),
+                "hits": self.hits,
+                "misses": self.misses,
+            },
+        }
+
+    def _cached(
+        self,
+        cache: LRUCache,
+        key: Hashable,
+        compute: Callable[[], Any],
+        *,
+        count: bool = False,
+    ) -> Any:
+        """
+        ``cache.get_or_compute``, but with a single computation per key.
+
+        The cache holds a ``Future`` per key, so a request arriving while the same
+        result is being computed waits for it instead of computing it again.
+        """
+        with self._lock:
+            future = cache.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                cache.put(key, future)
+            if count:
+                self.misses += owner
+                self.hits += not owner
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as error:  # noqa: BLE001 - re-raised by result()
+                # Failures are not cached, the next request tries again
+                cache.discard(key)
+                future.set_exception(error)
+        return future.result()
+
+    def _aggregate(self, name: str, min_duration: float, max_duration: float) -> Any:
+        """An aggregation over the tracks within a duration range, built once."""
+
+        def compute() -> Any:
+            lf = filter_duration(self.tracks.lazy(), min_duration, max_duration)
+            if name == "genres":
+                return genres(lf)
+            if name == "genre_means":
+                return genre_means(lf).collect()
+            if name == "popular_artists":
+                return PopularArtists.build(lf, artists=self.artist_model)
+            return CollaborationIndex.build(lf, self.artist_model)
+
+        key = (name, min_duration, max_duration)
+        return self._cached(self.aggregates, key, compute)
+
+    def _answer(
+        self, endpoint: str, *, min_duration: float, max_duration: float, **params: Any
+    ) -> Any:
+        duration = (min_duration, max_duration)
+        if endpoint == "/genres":
+            return {"genres": self._aggregate("genres", *duration)}
+        if endpoint == "/genres/means":
+            return self._aggregate("genre_means", *duration)
+        if endpoint == "/artists":
+            popular = self._aggregate("popular_artists", *duration)
+            return popular.get(params["genre"]).head(params["limit"])
+        if endpoint == "/collaborations":
+            index = self._aggregate("collaborations", *duration)
+            if params["artist"] is not None:
+                return index.top_collaborators(
+                    params["artist"], params["genre"], k=params["limit"]
+                )
+            return index.pairs(params["genre"]).head(params["limit"])
+        # /search, over the tracks within the range
+        where = self.tracks.select(duration_in_range(*duration)).to_series()
+        return self.search_index.search(
+            artist=params["artist"],
+            track=params["track"],
+            k=params["limit"],
+            where=where.to_numpy(),
+        )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "QueryServer"
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        # Read by StreamRequestHandler.setup, which sets it on the socket
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        try:
+            etag, body = self.server.service.query(url.path, url.query)
+        except LookupError as error:
+            self._send_error(HTTPStatus.NOT_FOUND, error)
+            return
+        except ValueError as error:
+            self._send_error(HTTPStatus.BAD_REQUEST, error)
+            return
+        except Exception as error:  # noqa: BLE001 - answered with a 500
+            self.log_error("%s failed: %r", self.path, error)
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, error)
+            return
+
+        if _not_modified(self.headers.get("If-None-Match"), etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self._send_body(body, etag)
+
+    def _send_error(self, status: HTTPStatus, error: Exception) -> None:
+        message = error.args[0] if error.args else status.phrase
+        self.send_response(status)
+        self._send_body(_encode({"error": str(message)}))
+
+    def _send_body(self, body: bytes, etag: str | None = None) -> None:
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            # The tracks only change when the service restarts, but clients should
+            # still revalidate (cheaply, with If-None-Match) rather than assume so
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.log_requests:
+            super().log_message(format, *args)
+
+
+def _not_modified(header: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header lists the ETag (weakly compared) or is ``*``."""
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in tags or "*" in tags
+
+
+class QueryServer(HTTPServer):
+    """
+    An HTTP server handing its requests to a fixed pool of worker threads.
+
+    ``ThreadingHTTPServer`` starts a new thread per request, without any bound;
+    here at most ``workers`` requests are handled at once, and the next ones wait
+    in the pool's queue.
+
+    Args:
+        address (tuple[str, int]): The host and port to listen on, port 0 picking
+            a free one.
+        service (QueryService): Answers the requests.
+        workers (int): Number of worker threads.
+        log_requests (bool): Log each request to the standard error.
+        idle_timeout (float): Seconds after which an idle kept-alive connection is
+            closed, freeing its worker.
+    """
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        service: QueryService,
+        workers: int = 4,
+        log_requests: bool = False,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    ) -> None:
+        super().__init__(address, _Handler)
+        self.service = service
+        self.log_requests = log_requests
+        self.idle_timeout = idle_timeout
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="query")
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server, e.g. ``http://127.0.0.1:8000``."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request: Any, client_address: Any) -> None:
+        # What ThreadingMixIn.process_request_thread does, on a pooled thread
+        try:
+            self.finish_request(request, client_address)
+        except Exception:  # noqa: BLE001 - reported by handle_error
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+def make_server(
+    service: QueryService,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    *,
+    workers: int = 4,
+    log_requests: bool = False,
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+) -> QueryServer:
+    """
+    Bind a server for the service, without starting it.
+
+    Args:
+        service (QueryService): Answers the requests.
+        host (str): The interface to listen on, only the local one by default.
+        port (int): The port to listen on, 0 to pick a free one.
+        workers (int): Number of worker threads.
+        log_requests (bool): Log each request to the standard error.
+        idle_timeout (float): Seconds after which an idle kept-alive connection is
+            closed, freeing its worker.
+
+    Returns:
+        QueryServer: The server, to run with ``serve_forever()``.
+
+    Example:
+        >>> with make_server(QueryService(tracks), port=0) as server:
+        ...     threading.Thread(target=server.serve_forever, daemon=True).start()
+        ...     urllib.request.urlopen(f"{server.url}/genres")
+        ...     server.shutdown()
+    """
+    return QueryServer((host, port), service, workers, log_requests, idle_timeout)
+
+
+def serve(
+    source: str | Path,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    *,
+    workers: int = 4,
+    cache: TracksCache | None = None,
+) -> None:
+    """Load the tracks and serve them until interrupted."""
+    service = QueryService.load(source, cache=cache)
+    with make_server(service, host, port, workers=workers, log_requests=True) as server:
+        print(
+            f"Serving {service.tracks.height} tracks on {server.url}", file=sys.stderr
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,356 @@
+"""
+Nearest-neighbour index over the audio features, to find similar tracks.
+
+Comparing a track against every other one costs a full pass over the feature
+matrix per query. The ``SimilarityIndex`` is an inverted file (IVF) index instead:
+
+- the audio features are standardized (zero mean, unit variance, so ``tempo`` does
+  not outweigh the 0 ~ 1 features) and stored as a contiguous ``Float32`` matrix;
+- a k-means pass over a sample of the tracks picks ``n_lists`` centroids, and every
+  track is assigned to the list of its nearest centroid;
+- the matrix is reordered so that each list is a contiguous block of rows.
+
+A query only computes distances to the centroids and to the tracks of the
+``n_probe`` lists whose centroids are closest, a small fraction of the table. The
+results are approximate: a neighbour sitting in a list that was not probed is
+missed. Raising ``n_probe`` trades speed for recall, and probing every list gives
+the exact answer. ``save`` writes the arrays as ``.npy`` files, which ``load``
+memory-maps, so opening an index is instant and the OS only pages in the lists
+that are probed::
+
+    index = SimilarityIndex.build(df)
+    index.save("cache/similarity")
+    SimilarityIndex.load("cache/similarity").similar([42], k=10)
+"""
+
+import json
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify.pipeline import ROW_ID
+from ci_with_spotify.schema import FEATURES
+
+FORMAT_VERSION = 1
+# Rows per block when computing the distances of many vectors to the centroids
+CHUNK = 8_192
+
+
+class SimilarityIndex:
+    """
+    An IVF index of the standardized audio features of the tracks.
+
+    Args:
+        features (Sequence[str]): The names of the indexed feature columns.
+        mean (np.ndarray): The mean of each feature, used to standardize queries.
+        scale (np.ndarray): The standard deviation of each feature.
+        centroids (np.ndarray): The ``(n_lists, d)`` centroids of the lists.
+        offsets (np.ndarray): The rows of list ``i`` are
+            ``vectors[offsets[i]:offsets[i + 1]]``.
+        vectors (np.ndarray): The ``(n, d)`` standardized features, grouped by list.
+        row_ids (np.ndarray): The ``row_id`` of each row of ``vectors``.
+
+    Example:
+        >>> index = SimilarityIndex.build(df)
+        >>> index.similar([42, 1337], k=5)  # the 5 closest tracks to each
+        >>> index.query(df.select(FEATURES).to_numpy()[:100], k=10, n_probe=16)
+    """
+
+    def __init__(
+        self,
+        features: Sequence[str],
+        mean: np.ndarray,
+        scale: np.ndarray,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        vectors: np.ndarray,
+        row_ids: np.ndarray,
+    ) -> None:
+        self.features = list(features)
+        self.mean = mean
+        self.scale = scale
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.row_ids = row_ids
+        self._by_row_id: np.ndarray | None = None
+
+    @classmethod
+    def build(
+        cls,
+        tracks: pl.DataFrame | pl.LazyFrame,
+        features: Sequence[str] = FEATURES,
+        *,
+        n_lists: int | None = None,
+        sample: int = 50_000,
+        iterations: int = 10,
+        seed: int = 0,
+    ) -> "SimilarityIndex":
+        """
+        Build the index from the cleaned tracks.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): Tracks with a ``row_id`` and the
+                feature columns. Missing values are replaced by the feature's mean.
+            features (Sequence[str]): The columns to compare the tracks on.
+            n_lists (int | None): Number of lists, about the square root of the
+                number of tracks by default.
+            sample (int): Number of tracks the centroids are fitted on.
+            iterations (int): Number of k-means iterations.
+            seed (int): Seed of the sample and of the initial centroids.
+
+        Returns:
+            SimilarityIndex: The index of the tracks.
+
+        Raises:
+            ValueError: If there are no tracks.
+        """
+        df = tracks.lazy().select(ROW_ID, *features).collect()
+        matrix = df.select(features).to_numpy().astype(np.float64)
+        if df.is_empty():
+            raise ValueError("Cannot build a similarity index without tracks")
+        mean = np.nan_to_num(np.nanmean(matrix, axis=0))
+        scale = np.nan_to_num(np.nanstd(matrix, axis=0))
+        # A constant feature does not tell the tracks apart anyway
+        scale[scale == 0] = 1.0
+        vectors = np.nan_to_num((matrix - mean) / scale).astype(np.float32)
+        del matrix
+
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(df)))
+        n_lists = max(1, min(n_lists, len(df)))
+        rng = np.random.default_rng(seed)
+        fit_on = vectors
+        if len(vectors) > sample:
+            fit_on = vectors[rng.choice(len(vectors), sample, replace=False)]
+        centroids = _kmeans(fit_on, n_lists, iterations, rng)
+
+        lists = _nearest(vectors, centroids, 1)[:, 0]
+        order = np.argsort(lists, kind="stable")
+        offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(lists, minlength=n_lists))]
+        ).astype(np.int64)
+        return cls(
+            features,
+            mean,
+            scale,
+            centroids,
+            offsets,
+            np.ascontiguousarray(vectors[order]),
+            df[ROW_ID].to_numpy()[order].astype(np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.row_ids)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def standardize(self, features: np.ndarray) -> np.ndarray:
+        """Standardize raw feature values, one row per track, like the index."""
+        features = np.atleast_2d(np.asarray(features, dtype=np.float64))
+        return np.nan_to_num((features - self.mean) / self.scale).astype(np.float32)
+
+    def query(
+        self, features: np.ndarray, k: int = 10, n_probe: int = 8
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The nearest tracks of each of a batch of feature vectors.
+
+        Args:
+            features (np.ndarray): The ``(q, d)`` raw feature values to search for,
+                in the order of ``features``.
+            k (int): Number of neighbours of each query.
+            n_probe (int): Number of lists searched per query.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The ``(q, k)`` row IDs of the neighbours,
+                closest first, and their Euclidean distances in standardized
+                units. Queries with fewer than ``k`` candidates are padded with
+                the row ID -1 and an infinite distance.
+        """
+        return self._search(self.standardize(features), k, n_probe)
+
+    def similar(
+        self, row_ids: Iterable[int], k: int = 10, n_probe: int = 8
+    ) -> pl.DataFrame:
+        """
+        The tracks closest to some tracks of the index, excluding themselves.
+
+        Args:
+            row_ids (Iterable[int]): The ``row_id`` of the tracks to search for.
+                Unknown IDs are ignored.
+            k (int): Number of similar tracks per track.
+            n_probe (int): Number of lists searched per track.
+
+        Returns:
+            pl.DataFrame: The columns ``row_id`` (of the track searched for),
+                ``similar_row_id``, ``distance`` and ``rank`` (from 1), closest
+                first.
+        """
+        ids = np.unique(np.fromiter(row_ids, dtype=np.int64))
+        positions = self._positions(ids)
+        found = positions >= 0
+        ids, positions = ids[found], positions[found]
+        neighbours, distances = self._search(
+            np.asarray(self.vectors[positions]), k + 1, n_probe
+        )
+        # Drop each track itself (or, for exact duplicates, the last of the k + 1)
+        keep = neighbours != ids[:, None]
+        keep[keep.all(axis=1), -1] = False
+        neighbours = neighbours[keep].reshape(len(ids), k)
+        distances = distances[keep].reshape(len(ids), k)
+        valid = neighbours >= 0
+        return pl.DataFrame(
+            {
+                ROW_ID: np.repeat(ids, k)[valid.ravel()],
+                "similar_row_id": neighbours[valid],
+                "distance": distances[valid],
+                "rank": np.tile(np.arange(1, k + 1, dtype=np.uint32), len(ids))[
+                    valid.ravel()
+                ],
+            }
+        )
+
+    def save(self, path: str | Path) -> Path:
+        """
+        Write the index as a directory of ``.npy`` arrays and a JSON header.
+
+        Args:
+            path (str | Path): The directory, created if needed.
+
+        Returns:
+            Path: The directory.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ["centroids", "offsets", "vectors", "row_ids"]:
+            np.save(path / f"{name}.npy", np.asarray(getattr(self, name)))
+        header = {
+            "version": FORMAT_VERSION,
+            "features": self.features,
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+        }
+        (path / "index.json").write_text(json.dumps(header, indent=2))
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path, *, mmap: bool = True) -> "SimilarityIndex":
+        """
+        Open an index written by ``save``.
+
+        Args:
+            path (str | Path): The directory of the index.
+            mmap (bool): Memory-map the arrays instead of reading them.
+
+        Returns:
+            SimilarityIndex: The index.
+
+        Raises:
+            ValueError: If the index was written in another format version.
+        """
+        path = Path(path)
+        header = json.loads((path / "index.json").read_text())
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported similarity index version in {path}")
+        arrays = {
+            name: np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None)
+            for name in ["centroids", "offsets", "vectors", "row_ids"]
+        }
+        return cls(
+            header["features"],
+            np.asarray(header["mean"]),
+            np.asarray(header["scale"]),
+            **arrays,
+        )
+
+    def _positions(self, ids: np.ndarray) -> np.ndarray:
+        """Position in ``vectors`` of each row ID, or -1 if it is not indexed."""
+        if self._by_row_id is None:
+            self._by_row_id = np.argsort(self.row_ids, kind="stable")
+        sorted_ids = self.row_ids[self._by_row_id]
+        found = np.searchsorted(sorted_ids, ids).clip(max=len(sorted_ids) - 1)
+        return np.where(sorted_ids[found] == ids, self._by_row_id[found], -1)
+
+    def _search(
+        self, queries: np.ndarray, k: int, n_probe: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        neighbours = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if not len(queries):
+            return neighbours, distances
+        n_probe = max(1, min(n_probe, self.n_lists))
+        probes = _nearest(queries, self.centroids, n_probe)
+        starts, ends = self.offsets[probes], self.offsets[probes + 1]
+        for i, query in enumerate(queries):
+            candidates = _ranges(starts[i], ends[i])
+            if not len(candidates):
+                continue
+            # Computed from the differences, which is exact for the duplicates of a query
+            difference = self.vectors[candidates] - query
+            squared = np.einsum("ij,ij->i", difference, difference)
+            top = min(k, len(candidates))
+            best = np.argpartition(squared, top - 1)[:top]
+            best = best[np.argsort(squared[best], kind="stable")]
+            neighbours[i, :top] = self.row_ids[candidates[best]]
+            distances[i, :top] = np.sqrt(squared[best])
+        return neighbours, distances
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray, n: int) -> np.ndarray:
+    """The ``n`` nearest centroids of each row of ``x``, closest first."""
+    result = np.empty((len(x), n), dtype=np.int64)
+    norms = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(x), CHUNK):
+        # The squared distances, minus the squared norm of the row, which is the
+        # same for every centroid and so does not change their order
+        scores = x[start : start + CHUNK] @ centroids.T
+        scores *= -2
+        scores += norms
+        if n == 1:
+            result[start : start + CHUNK, 0] = scores.argmin(axis=1)
+            continue
+        if n < len(centroids):
+            nearest = np.argpartition(scores, n - 1, axis=1)[:, :n]
+        else:
+            nearest = np.broadcast_to(np.arange(len(centroids)), scores.shape)
+        order = np.argsort(np.take_along_axis(scores, nearest, axis=1), axis=1)
+        result[start : start + CHUNK] = np.take_along_axis(nearest, order, axis=1)
+    return result
+
+
+def _kmeans(
+    x: np.ndarray, k: int, iterations: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Lloyd's k-means, starting from ``k`` distinct random rows."""
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest(x, centroids, 1)[:, 0]
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack(
+            [np.bincount(labels, weights=column, minlength=k) for column in x.T], axis=1
+        )
+        filled = counts > 0
+        # An empty list keeps its centroid
+        centroids[filled] = (sums[filled] / counts[filled, None]).astype(np.float32)
+    return centroids
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """The concatenation of ``arange(start, end)`` for each pair of bounds."""
+    lengths = ends - starts
+    total = lengths.sum()
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    # Jump from the end of each range to the start of the next one
+    steps = np.ones(total, dtype=np.int64)
+    nonempty = lengths > 0
+    first = starts[nonempty]
+    steps[0] = first[0]
+    jumps = np.cumsum(lengths[nonempty])[:-1]
+    steps[jumps] = first[1:] - ends[nonempty][:-1] + 1
+    return np.cumsum(steps)
@@ -0,0 +1,317 @@
+"""
+Faster startup of the notebook: deferred imports and a background warm-up.
+
+Before the first interactive cell, the notebook used to import Polars, NumPy and
+plotly.express, then load the tracks and compute the genre lists and the first
+aggregations, one after the other. Instead:
+
+- ``import ci_with_spotify`` only imports a submodule once one of its names is
+  used, and ``lazy_import`` hands out modules (e.g. plotly.express) that are only
+  imported on their first attribute access;
+- ``start_warmup`` submits the imports, the loading of the cleaned tracks and the
+  aggregations that the notebook shows first to a background thread pool, while
+  the first cells render. The cells pick the results up with
+  ``Warmup.get_or_compute``, only waiting for the ones that are not ready yet, and
+  compute anything that was not warmed up (e.g. for another duration range);
+- the time from the start of the warm-up until each result was ready, how long
+  the cells waited for it and the marks set by the notebook are recorded, and
+  ``Warmup.log`` writes them as a single JSON line to the standard error of the
+  process, e.g. to the logs of the container::
+
+    warmup = start_warmup("input/tracks.parquet")
+    df = warmup.get_or_compute("tracks", lambda: TracksCache().load(...))
+    warmup.mark("interactive")
+    warmup.log()  # {"event": "startup", "ready": {"tracks": 0.41, ...}, ...}
+
+This module does not import Polars itself, so that starting the warm-up is instant.
+"""
+
+import importlib
+import json
+import sys
+import threading
+import time
+import types
+from collections.abc import Callable, Hashable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from ci_with_spotify.cache import TracksCache, Transform
+
+# The duration range (in seconds) the notebook keeps until a region is selected
+DEFAULT_DURATION = (120, 360)
+# Imported first by the warm-up, as most cells need them
+DEFAULT_MODULES = ("polars", "numpy", "plotly.express")
+
+
+class _LazyModule(types.ModuleType):
+    """Placeholder of a module, replaced by its contents on the first attribute access."""
+
+    def __getattr__(self, attr: str) -> Any:
+        # Only called for missing attributes, so the module is imported once
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    A module that is only imported when one of its attributes is first used.
+
+    Args:
+        name (str): The absolute name of the module, e.g. ``"plotly.express"``.
+
+    Returns:
+        types.ModuleType: The module if it was already imported, else a placeholder.
+
+    Example:
+        >>> px = lazy_import("plotly.express")  # nothing is imported yet
+        >>> px.bar(df, x="duration_seconds", y="count")  # imports plotly.express
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
+
+
+def _label(key: Hashable) -> str:
+    """A readable name for a key, e.g. ``genres/120/360`` for ``("genres", 120, 360)``."""
+    if isinstance(key, tuple):
+        return "/".join(map(str, key))
+    return str(key)
+
+
+class Warmup:
+    """
+    Named results computed on a background thread pool, ahead of the cells using them.
+
+    Args:
+        max_workers (int): Number of threads. A couple is enough, as Polars runs each
+            query on its own thread pool, and releases the GIL while doing so.
+
+    Attributes:
+        ready (dict[str, float]): Seconds from the start until each result was ready.
+        waited (dict[str, float]): Seconds spent waiting for each result.
+        marks (dict[str, float]): Seconds from the start until each mark.
+
+    Example:
+        >>> warmup = Warmup()
+        >>> warmup.submit("tracks", lambda: TracksCache().load(source))
+        >>> df = warmup.get_or_compute("tracks", lambda: TracksCache().load(source))
+    """
+
+    def __init__(self, max_workers: int = 2) -> None:
+        self.started = time.perf_counter()
+        self.ready: dict[str, float] = {}
+        self.waited: dict[str, float] = {}
+        self.marks: dict[str, float] = {}
+        self._futures: dict[Hashable, Future] = {}
+        # The key last submitted for each kind of result
+        self._latest: dict[Hashable, Hashable] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="warmup")
+
+    def elapsed(self) -> float:
+        """Seconds since the warm-up started."""
+        return time.perf_counter() - self.started
+
+    def submit(
+        self,
+        key: Hashable,
+        compute: Callable[[], Any],
+        *,
+        kind: Hashable | None = None,
+    ) -> Future:
+        """
+        Start computing a result in the background.
+
+        The tasks are started in the order they are submitted, so a task may wait for
+        the result of a task submitted before it, but not for a later one.
+
+        Args:
+            key (Hashable): The name of the result.
+            compute (Callable[[], Any]): Computes the result.
+            kind (Hashable | None): Only the last result submitted with this kind is
+                kept, e.g. the index of the current duration range: the result it
+                replaces is forgotten, and cancelled if it has not started yet.
+
+        Returns:
+            Future: The pending result.
+        """
+
+        def run() -> Any:
+            value = compute()
+            self.ready[_label(key)] = self.elapsed()
+            return value
+
+        with self._lock:
+            if kind is not None:
+                replaced = self._latest.get(kind)
+                if replaced in self._futures:
+                    self._futures.pop(replaced).cancel()
+                self._latest[kind] = key
+            future = self._futures[key] = self._executor.submit(run)
+        return future
+
+    def result(self, key: Hashable) -> Any:
+        """
+        The result of a submitted task, waiting for it if needed.
+
+        Raises:
+            KeyError: If no task was submitted under this key.
+        """
+        with self._lock:
+            future = self._futures[key]
+        if future.done():
+            return future.result()
+        start = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            self.waited[_label(key)] = time.perf_counter() - start
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """The result of a submitted task (waiting for it), or else computed now."""
+        with self._lock:
+            submitted = key in self._futures
+        return self.result(key) if submitted else compute()
+
+    def wait(self) -> None:
+        """Wait for every submitted task, raising the error of the first that failed."""
+        with self._lock:
+            keys = list(self._futures)
+        for key in keys:
+            self.result(key)
+
+    def mark(self, name: str) -> float:
+        """Record (and return) the seconds since the start, e.g. once the page is ready."""
+        self.marks[name] = seconds = self.elapsed()
+        return seconds
+
+    def report(self) -> dict[str, Any]:
+        """The recorded timings, rounded to the millisecond, and the pending results."""
+        with self._lock:
+            pending = [_label(key) for key, f in self._futures.items() if not f.done()]
+        return {
+            "event": "startup",
+            **{
+                name: {key: round(seconds, 3) for key, seconds in timings.items()}
+                for name, timings in [
+                    ("ready", self.ready),
+                    ("waited", self.waited),
+                    ("marks", self.marks),
+                ]
+            },
+            "pending": pending,
+        }
+
+    def log(self, file: IO[str] | None = None) -> dict[str, Any]:
+        """
+        Write the report as a single JSON line.
+
+        Args:
+            file (IO[str] | None): Where to write it. Defaults to the standard error of
+                the process, which the notebook does not capture, so the line ends up
+                in the logs of the server (or of its container).
+
+        Returns:
+            dict[str, Any]: The report.
+        """
+        report = self.report()
+        print(json.dumps(report), file=file or sys.__stderr__ or sys.stderr, flush=True)
+        return report
+
+    def shutdown(self) -> None:
+        """Cancel the tasks that have not started, without waiting for the others."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def start_warmup(
+    source: str | Path = "input/tracks.parquet",
+    transform: "Transform | None" = None,
+    *,
+    duration: tuple[float, float] = DEFAULT_DURATION,
+    streaming: bool = False,
+    modules: Sequence[str] = DEFAULT_MODULES,
+    cache: "TracksCache | None" = None,
+    max_workers: int = 2,
+) -> Warmup:
+    """
+    Warm up the imports, the cleaned tracks and the first aggregations of the notebook.
+
+    Submits, in this order:
+
+    - ``imports``: importing ``modules``;
+    - ``tracks``: the cleaned tracks, loaded through the ``TracksCache``;
+    - ``duration_counts`` and ``artist_model``, over every track;
+    - ``("genres", *duration)``, ``("genre_means", *duration)`` and
+      ``("popular_artists", *duration)``, over the tracks within ``duration``.
+
+    With ``streaming``, the notebook never collects the whole table, so only the
+    imports are warmed up.
+
+    Args:
+        source (str | Path): Parquet file, glob or directory holding the raw tracks.
+        transform (Transform | None): The cleaning steps, ``clean_tracks`` by default.
+        duration (tuple[float, float]): The duration range to aggregate.
+        streaming (bool): Whether the notebook runs with the streaming engine.
+        modules (Sequence[str]): The modules to import.
+        cache (TracksCache | None): The cache to load the tracks from, the default
+            ``TracksCache()`` if None.
+        max_workers (int): Number of threads.
+
+    Returns:
+        Warmup: The pending results.
+    """
+    warmup = Warmup(max_workers)
+    warmup.submit("imports", lambda: [importlib.import_module(m) for m in modules])
+    if streaming:
+        return warmup
+
+    def tracks():
+        from ci_with_spotify.cache import TracksCache
+        from ci_with_spotify.pipeline import clean_tracks
+
+        return (cache or TracksCache()).load(source, transform or clean_tracks)
+
+    def filtered():
+        from ci_with_spotify.pipeline import filter_duration
+
+        return filter_duration(warmup.result("tracks").lazy(), *duration)
+
+    def duration_counts():
+        from ci_with_spotify.pipeline import duration_counts
+
+        return duration_counts(warmup.result("tracks").lazy()).collect()
+
+    def artist_model():
+        from ci_with_spotify.artists import ArtistModel
+
+        return ArtistModel.build(warmup.result("tracks"))
+
+    def genres():
+        from ci_with_spotify.pipeline import genres
+
+        return genres(filtered())
+
+    def genre_means():
+        from ci_with_spotify.pipeline import genre_means
+
+        return genre_means(filtered()).collect()
+
+    def popular_artists():
+        from ci_with_spotify.aggregations import PopularArtists
+
+        return PopularArtists.build(filtered(), artists=warmup.result("artist_model"))
+
+    warmup.submit("tracks", tracks)
+    warmup.submit("duration_counts", duration_counts)
+    warmup.submit("artist_model", artist_model)
+    for name, compute in [
+        ("genres", genres),
+        ("genre_means", genre_means),
+        ("popular_artists", popular_artists),
+    ]:
+        warmup.submit((name, *duration), compute)
+    return warmup
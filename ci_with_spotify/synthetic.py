@@ -0,0 +1,108 @@
+"""
+Seeded generator of Spotify-shaped synthetic tracks.
+
+The generated table has the same schema as ``input/tracks.parquet`` and roughly
+the same shape: 114 equally sized genres, about one distinct artist per four
+tracks with a heavy-tailed number of tracks per artist, ``;``-separated lists of
+one to four artists, track names built from a small vocabulary (so searches such
+as "love" have plenty of matches) and audio features in their usual ranges.
+Everything is generated with vectorized NumPy / Polars code from a single seed,
+so the same ``(rows, seed)`` always gives the same table, without any network
+access.
+"""
+
+import numpy as np
+import polars as pl
+
+GENRES = 114
+
+WORDS = [
+    "love", "night", "heart", "baby", "time", "girl", "world", "dream", "fire",
+    "light", "home", "summer", "dance", "blue", "gold", "rain", "star", "sun",
+    "moon", "wild", "young", "lost", "sweet", "black", "city", "road", "day",
+    "life", "king", "queen", "river", "ocean", "party", "magic", "ghost", "angel",
+    "paradise", "forever", "tonight", "together", "alone", "again", "never",
+    "everything", "nothing", "something", "radio", "money", "highway", "lonely",
+]  # fmt: skip
+SUFFIXES = ["", "", "", "", " (Remix)", " (Live)", " - Acoustic", " (feat. Friends)"]
+# Share of the tracks with 1, 2, 3 and 4 artists
+ARTIST_COUNTS = [0.75, 0.17, 0.06, 0.02]
+
+
+def synthetic_tracks(rows: int, seed: int = 0) -> pl.DataFrame:
+    """
+    Generate a synthetic raw tracks table.
+
+    Args:
+        rows (int): Number of tracks to generate.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        pl.DataFrame: A table with the schema of ``input/tracks.parquet``.
+
+    Example:
+        >>> synthetic_tracks(100_000, seed=42).write_parquet("input/synthetic.parquet")
+    """
+    rng = np.random.default_rng(seed)
+    genre_names = pl.Series([f"genre-{i:03d}" for i in range(GENRES)])
+    artist_count = max(rows // 4, 1)
+    album_count = max(rows // 2, 1)
+
+    # Up to 4 artists per track, the unused slots are null and skipped when joining
+    n_artists = rng.choice(len(ARTIST_COUNTS), size=rows, p=ARTIST_COUNTS) + 1
+    artist_slots = [
+        pl.when(pl.lit(n_artists > slot))
+        .then(pl.format("Artist {}", pl.lit(_heavy_tailed(rng, artist_count, rows))))
+        .otherwise(None)
+        for slot in range(len(ARTIST_COUNTS))
+    ]
+    first_word = pl.lit(rng.integers(0, len(WORDS), rows)).replace_strict(
+        range(len(WORDS)), WORDS, return_dtype=pl.String
+    )
+    second_word = pl.lit(rng.integers(0, len(WORDS), rows)).replace_strict(
+        range(len(WORDS)), [word.title() for word in WORDS], return_dtype=pl.String
+    )
+    suffix = pl.lit(rng.integers(0, len(SUFFIXES), rows)).replace_strict(
+        range(len(SUFFIXES)), SUFFIXES, return_dtype=pl.String
+    )
+    # About as many combinations as rows, so ~60% of the track names are distinct
+    title_number = pl.lit(rng.integers(0, max(rows // 12_500, 1), rows))
+
+    return pl.select(
+        pl.lit(np.arange(rows, dtype=np.int64)).alias("Unnamed: 0"),
+        pl.format("trk{}", pl.lit(rng.permutation(rows))).alias("track_id"),
+        pl.concat_str(artist_slots, separator=";", ignore_nulls=True).alias("artists"),
+        pl.format("Album {}", pl.lit(_heavy_tailed(rng, album_count, rows))).alias(
+            "album_name"
+        ),
+        pl.concat_str(
+            [first_word, pl.lit(" "), second_word, pl.lit(" "), title_number, suffix]
+        ).alias("track_name"),
+        pl.lit(np.clip(rng.normal(35, 20, rows), 0, 100).astype(np.int64)).alias(
+            "popularity"
+        ),
+        pl.lit(np.clip(rng.lognormal(np.log(215_000), 0.35, rows), 8_000, 5_200_000))
+        .cast(pl.Int64)
+        .alias("duration_ms"),
+        pl.lit(rng.random(rows) < 0.085).alias("explicit"),
+        pl.lit(rng.beta(5, 3, rows)).alias("danceability"),
+        pl.lit(rng.beta(4, 2, rows)).alias("energy"),
+        pl.lit(rng.integers(0, 12, rows)).alias("key"),
+        pl.lit(np.clip(rng.normal(-8, 5, rows), -50, 4)).alias("loudness"),
+        pl.lit((rng.random(rows) < 0.64).astype(np.int64)).alias("mode"),
+        pl.lit(rng.beta(1, 10, rows)).alias("speechiness"),
+        pl.lit(rng.beta(0.6, 1.2, rows)).alias("acousticness"),
+        pl.lit(rng.beta(0.2, 1.5, rows)).alias("instrumentalness"),
+        pl.lit(rng.beta(2, 8, rows)).alias("liveness"),
+        pl.lit(rng.beta(2, 2, rows)).alias("valence"),
+        pl.lit(np.clip(rng.normal(122, 30, rows), 0, 250)).alias("tempo"),
+        pl.lit(rng.choice([4, 3, 5, 1], size=rows, p=[0.89, 0.08, 0.02, 0.01])).alias(
+            "time_signature"
+        ),
+        genre_names.gather(np.sort(rng.integers(0, GENRES, rows))).alias("track_genre"),
+    )
+
+
+def _heavy_tailed(rng: np.random.Generator, cardinality: int, size: int) -> np.ndarray:
+    """IDs in ``[0, cardinality)``, with a few very frequent ones and a long tail."""
+    return (cardinality * rng.random(size) ** 3).astype(np.int64)
@@ -0,0 +1,195 @@
+"""
+Fast approximate LOWESS trendline for the interactive scatter plot.
+
+plotly's ``trendline="lowess"`` runs statsmodels over every point of the plot,
+and does so again whenever any argument of ``px.scatter`` changes, even cosmetic
+ones like the opacity. Here the points are first reduced to at most ``bins``
+uniform bins along ``x``, keeping the sufficient statistics of a linear fit in
+each bin (count, sums of ``x``, ``y``, ``x²`` and ``xy``). A tricube-weighted
+local linear regression is then solved in closed form, at a bounded number of
+anchor points, for all anchors at once. The cost no longer depends on the number
+of rows past the binning, and ``Trendlines`` memoizes each fit by the columns,
+the genre filter and the dataset version, so it is only computed once.
+
+Unlike statsmodels, no robustifying iterations are run, so outliers pull the line
+a little more.
+"""
+
+from collections.abc import Hashable
+
+import numpy as np
+import polars as pl
+
+from ci_with_spotify.cache import LRUCache
+from ci_with_spotify.pipeline import filter_genre
+
+DEFAULT_FRAC = 2 / 3
+DEFAULT_ANCHORS = 100
+DEFAULT_BINS = 1_000
+
+
+def lowess(
+    x: np.ndarray,
+    y: np.ndarray,
+    frac: float = DEFAULT_FRAC,
+    anchors: int = DEFAULT_ANCHORS,
+    bins: int = DEFAULT_BINS,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Locally weighted linear regression of ``y`` on ``x``, evaluated at anchor points.
+
+    Args:
+        x (np.ndarray): The explanatory values.
+        y (np.ndarray): The values to smooth. Pairs with a NaN are dropped.
+        frac (float): Fraction of the points used for each local fit, as in
+            ``statsmodels.nonparametric.lowess``.
+        anchors (int): Maximum number of points at which the fit is evaluated. They
+            are placed at quantiles of ``x``, so dense regions get more of them.
+        bins (int): Number of bins the points are reduced to before fitting.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The sorted anchor positions and the fitted
+            values at each of them.
+
+    Example:
+        >>> x, fitted = lowess(df["energy"].to_numpy(), df["danceability"].to_numpy())
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    present = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[present], y[present]
+    if x.size == 0:
+        return np.empty(0), np.empty(0)
+
+    counts, sum_x, sum_y, sum_xx, sum_xy = _binned_moments(x, y, bins)
+    centres = sum_x / counts
+    cumulative = np.cumsum(counts)
+    targets = np.linspace(0, x.size - 1, min(anchors, x.size))
+    positions = np.unique(centres[np.searchsorted(cumulative, targets, side="right")])
+
+    # Distance from each anchor (rows) to each bin (columns)
+    distances = np.abs(centres[None, :] - positions[:, None])
+    # The bandwidth of an anchor is the distance to its k-th nearest point
+    k = min(max(int(np.ceil(frac * x.size)), 1), x.size)
+    order = np.argsort(distances, axis=1, kind="stable")
+    nearest = np.cumsum(counts[order], axis=1)
+    reach = (nearest < k).sum(axis=1)
+    bandwidth = np.take_along_axis(distances, order, axis=1)[
+        np.arange(positions.size), reach
+    ]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(
+            bandwidth[:, None] > 0,
+            distances / bandwidth[:, None],
+            np.where(distances == 0, 0.0, 1.0),
+        )
+    weights = np.where(ratio < 1, (1 - ratio**3) ** 3, 0.0)
+
+    # Weighted least squares from the per bin sums, for every anchor at once
+    s_w = weights @ counts
+    s_x = weights @ sum_x
+    s_y = weights @ sum_y
+    s_xx = weights @ sum_xx
+    s_xy = weights @ sum_xy
+    denominator = s_w * s_xx - s_x**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = s_y / s_w
+        slope = (s_w * s_xy - s_x * s_y) / denominator
+        intercept = (s_y - slope * s_x) / s_w
+        fitted = intercept + slope * positions
+    # Without any spread in x around an anchor, the local fit is just the mean
+    flat = np.abs(denominator) <= 1e-12 * np.maximum(s_w * s_xx, 1e-300)
+    return positions, np.where(flat, mean, fitted)
+
+
+def _binned_moments(x: np.ndarray, y: np.ndarray, bins: int) -> tuple[np.ndarray, ...]:
+    """Count and sums of ``x``, ``y``, ``x²`` and ``xy`` of the non-empty uniform bins."""
+    low, high = x.min(), x.max()
+    if high > low:
+        cells = np.clip(((x - low) / (high - low) * bins).astype(np.int64), 0, bins - 1)
+    else:
+        cells = np.zeros(x.size, dtype=np.int64)
+    moments = [
+        np.bincount(cells, weights=weights, minlength=bins)
+        for weights in (None, x, y, x * x, x * y)
+    ]
+    occupied = moments[0] > 0
+    return tuple(moment[occupied].astype(np.float64) for moment in moments)
+
+
+class Trendlines:
+    """
+    Memoized LOWESS trendlines, keyed by ``(x, y, genre, version)``.
+
+    Only the plotted columns, the genre filter and the data determine a trendline,
+    so changing the colour, opacity or any other cosmetic setting of the plot
+    reuses the cached fit.
+
+    Args:
+        max_entries (int): Maximum number of fits kept in the LRU cache.
+        frac (float): Fraction of the points used for each local fit.
+        anchors (int): Maximum number of points at which the fit is evaluated.
+
+    Example:
+        >>> trendlines = Trendlines()
+        >>> line = trendlines.get(filtered_duration, "energy", "danceability", "pop", version)
+        >>> fig.add_scatter(x=line["energy"], y=line["danceability"], mode="lines")
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 64,
+        frac: float = DEFAULT_FRAC,
+        anchors: int = DEFAULT_ANCHORS,
+    ) -> None:
+        self.frac = frac
+        self.anchors = anchors
+        self.cache = LRUCache(max_entries)
+
+    def get(
+        self,
+        tracks: pl.DataFrame | pl.LazyFrame,
+        x: str,
+        y: str,
+        genre: str | None = None,
+        version: Hashable = None,
+    ) -> pl.DataFrame:
+        """
+        The trendline of ``y`` against ``x`` over the tracks of a genre.
+
+        Args:
+            tracks (pl.DataFrame | pl.LazyFrame): The tracks, before filtering by genre.
+            x (str): Column of the horizontal axis.
+            y (str): Column of the vertical axis.
+            genre (str | None): Only fit the tracks of this genre, if given.
+            version (Hashable): Identifies the contents of ``tracks``, for example
+                the source and the selected duration range. Fits computed for
+                another version are never reused.
+
+        Returns:
+            pl.DataFrame: The anchor points in the ``x`` column and the fitted values
+                in the ``y`` column, sorted by ``x``.
+        """
+        return self.cache.get_or_compute(
+            (x, y, genre, version, self.frac, self.anchors),
+            lambda: self._fit(tracks, x, y, genre),
+        )
+
+    def _fit(
+        self, tracks: pl.DataFrame | pl.LazyFrame, x: str, y: str, genre: str | None
+    ) -> pl.DataFrame:
+        values = (
+            filter_genre(tracks.lazy(), genre)
+            .select(
+                pl.col(x).cast(pl.Float64).alias("x"),
+                pl.col(y).cast(pl.Float64).alias("y"),
+            )
+            .drop_nulls()
+            .collect()
+        )
+        positions, fitted = lowess(
+            values["x"].to_numpy(), values["y"].to_numpy(), self.frac, self.anchors
+        )
+        if x == y:
+            return pl.DataFrame({x: positions})
+        return pl.DataFrame({x: positions, y: fitted})
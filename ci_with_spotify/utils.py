@@ -0,0 +1,99 @@
+"""Utility functions shared by the notebook and the pipeline."""
+
+from collections.abc import Mapping
+from typing import Any
+
+import numpy as np
+import polars as pl
+
+
+def get_extremes(
+    selection: Any, col: str | int, defaults_if_missing: tuple[float, float]
+) -> tuple[float, float]:
+    """
+    Extract the minimum and maximum values from a specific column in a selection.
+
+    The selection may be row-oriented, such as the list of dicts returned by a
+    plotly selection, in which case both extremes are found in a single pass. It may
+    also be columnar (a Polars DataFrame or Series, a NumPy array or a dict of
+    lists), in which case a vectorized reduction is used instead. If the selection
+    is empty or None, it returns default values and prints a warning message.
+
+    Args:
+        selection (Any): A list of rows where each row is indexable (e.g., dict, list,
+                         tuple), a ``pl.DataFrame``, a ``pl.Series``, a 1-D or 2-D
+                         ``np.ndarray`` or a dict mapping column names to values.
+                         Can be None or empty.
+        col (str | int): The column to extract values from. Ignored for a Series or
+                         a 1-D array, which already hold a single column.
+        defaults_if_missing (tuple[float, float]): A tuple containing
+                         (min_default, max_default) to return when selection is invalid.
+
+    Returns:
+        tuple[float, float]: A tuple containing (minimum_value, maximum_value) from the
+                        specified column, or the default values if the selection is invalid.
+
+    Example:
+        >>> data = [[1, 10, 100], [2, 20, 200], [3, 30, 300]]
+        >>> get_extremes(data, 1, (0, 0))
+        (10, 30)
+
+        >>> get_extremes(pl.DataFrame({"x": [3, 1, 2]}), "x", (0, 0))
+        (1, 3)
+
+        >>> get_extremes([], 0, (5, 10))
+        Could not find a selected region. Using default values (5, 10) instead...
+        (5, 10)
+    """
+    extremes = None if selection is None else _extremes(selection, col)
+    if extremes is None:
+        print(
+            f"Could not find a selected region. Using default values {defaults_if_missing} instead, try clicking and dragging in the plot to change them."
+        )
+        return defaults_if_missing
+    return extremes
+
+
+def _extremes(selection: Any, col: str | int) -> tuple[Any, Any] | None:
+    if isinstance(selection, pl.DataFrame):
+        if isinstance(col, int):
+            return _series_extremes(selection.to_series(col))
+        return _series_extremes(selection.get_column(col))
+    if isinstance(selection, pl.Series):
+        return _series_extremes(selection)
+    if isinstance(selection, np.ndarray):
+        return _array_extremes(selection if selection.ndim == 1 else selection[:, col])
+    if isinstance(selection, Mapping):
+        values = selection[col]
+        if isinstance(values, pl.Series):
+            return _series_extremes(values)
+        return _array_extremes(np.asarray(values))
+    return _rows_extremes(selection, col)
+
+
+def _series_extremes(values: pl.Series) -> tuple[Any, Any] | None:
+    if values.len() == values.null_count():
+        return None
+    return values.min(), values.max()
+
+
+def _array_extremes(values: np.ndarray) -> tuple[Any, Any] | None:
+    if values.size == 0:
+        return None
+    return values.min().item(), values.max().item()
+
+
+def _rows_extremes(rows: Any, col: str | int) -> tuple[Any, Any] | None:
+    iterator = iter(rows)
+    try:
+        low = high = next(iterator)[col]
+    except StopIteration:
+        return None
+    # Single pass, each value is compared with at most one of the extremes
+    for row in iterator:
+        value = row[col]
+        if value < low:
+            low = value
+        elif value > high:
+            high = value
+    return low, high
@@ -1,6 +1,197 @@
-def main():
-    print("Hello from ci-with-spotify!")
+"""
+Command line entry point of the Spotify EDA, for running it without the notebook.
+
+    python main.py report input/tracks.parquet --output reports/ --workers 8
+    python main.py bench --sizes 100k,1M
+    python main.py partition input/tracks.parquet input/tracks
+    python main.py warmup input/tracks.parquet
+    python main.py serve input/tracks.parquet --port 8000
+    python main.py classify input/tracks.parquet "dumps/*.parquet" --output predictions/
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Spotify tracks EDA")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report = commands.add_parser(
+        "report", help="Write the per-genre report of a tracks file"
+    )
+    report.add_argument(
+        "source",
+        nargs="?",
+        default="input/tracks.parquet",
+        help="Parquet file, glob or directory of shards (default: %(default)s)",
+    )
+    report.add_argument("-o", "--output", type=Path, default=Path("reports"))
+    report.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of worker processes (default: the number of CPUs)",
+    )
+    report.add_argument("--genres", help="Comma separated genres (default: all)")
+    report.add_argument("--min-duration", type=float, help="In seconds")
+    report.add_argument("--max-duration", type=float, help="In seconds")
+    report.add_argument("--top", type=int, default=20, help="Artists and pairs kept")
+    report.add_argument("--format", choices=["parquet", "json"], default="parquet")
+    report.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Directory of the cleaned tracks cache (default: $SPOTIFY_EDA_CACHE_DIR)",
+    )
+
+    partition = commands.add_parser(
+        "partition", help="Rewrite tracks as a directory partitioned by genre"
+    )
+    partition.add_argument("source", help="Parquet file, glob or directory of shards")
+    partition.add_argument("target", type=Path, help="Directory to write")
+    partition.add_argument(
+        "--overwrite", action="store_true", help="Replace the target if it exists"
+    )
+
+    warmup = commands.add_parser(
+        "warmup",
+        help="Cache the cleaned tracks and the notebook's first aggregations, "
+        "and report how long each took",
+    )
+    warmup.add_argument(
+        "source",
+        nargs="?",
+        default="input/tracks.parquet",
+        help="Parquet file, glob or directory of shards (default: %(default)s)",
+    )
+    warmup.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Directory of the cleaned tracks cache (default: $SPOTIFY_EDA_CACHE_DIR)",
+    )
+
+    serve = commands.add_parser(
+        "serve", help="Serve the aggregations as JSON over HTTP, on localhost"
+    )
+    serve.add_argument(
+        "source",
+        nargs="?",
+        default="input/tracks.parquet",
+        help="Parquet file, glob or directory of shards (default: %(default)s)",
+    )
+    serve.add_argument("--host", default="127.0.0.1", help="(default: %(default)s)")
+    serve.add_argument("--port", type=int, default=8000, help="(default: %(default)s)")
+    serve.add_argument(
+        "-w", "--workers", type=int, default=4, help="Worker threads (default: 4)"
+    )
+    serve.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Directory of the cleaned tracks cache (default: $SPOTIFY_EDA_CACHE_DIR)",
+    )
+
+    classify = commands.add_parser(
+        "classify",
+        help="Predict the genres of unlabelled tracks, shard by shard, "
+        "and report the throughput",
+    )
+    classify.add_argument("train", help="Labelled tracks to fit the classifier on")
+    classify.add_argument("source", help="Parquet file, glob or directory to score")
+    classify.add_argument("-o", "--output", type=Path, default=Path("predictions"))
+    classify.add_argument(
+        "--batch-size", type=int, default=100_000, help="(default: %(default)s)"
+    )
+    classify.add_argument("--top", type=int, default=1, help="Genres per track")
+    classify.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Directory of the cleaned tracks cache (default: $SPOTIFY_EDA_CACHE_DIR)",
+    )
+
+    commands.add_parser(
+        "bench", help="Benchmark the pipeline stages on synthetic data", add_help=False
+    )
+
+    args, extra = parser.parse_known_args(argv)
+    # Imported here, so that `--help` does not wait for Polars to load
+    if args.command == "bench":
+        from ci_with_spotify.benchmark import main as bench
+
+        return bench(extra)
+    if extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+
+    if args.command == "partition":
+        from ci_with_spotify.ingest import write_partitioned
+
+        genres = write_partitioned(args.source, args.target, overwrite=args.overwrite)
+        print(f"Wrote {len(genres)} genre partitions to {args.target}")
+        return 0
+
+    if args.command == "warmup":
+        from ci_with_spotify.cache import DEFAULT_CACHE_DIR, TracksCache
+        from ci_with_spotify.startup import start_warmup
+
+        warmup = start_warmup(
+            args.source, cache=TracksCache(args.cache_dir or DEFAULT_CACHE_DIR)
+        )
+        warmup.wait()
+        warmup.mark("done")
+        warmup.log(sys.stdout)
+        return 0
+
+    if args.command == "serve":
+        from ci_with_spotify.cache import DEFAULT_CACHE_DIR, TracksCache
+        from ci_with_spotify.service import serve
+
+        serve(
+            args.source,
+            args.host,
+            args.port,
+            workers=args.workers,
+            cache=TracksCache(args.cache_dir or DEFAULT_CACHE_DIR),
+        )
+        return 0
+
+    if args.command == "classify":
+        from ci_with_spotify.cache import DEFAULT_CACHE_DIR, TracksCache
+        from ci_with_spotify.classifier import GenreClassifier
+
+        tracks = TracksCache(args.cache_dir or DEFAULT_CACHE_DIR).load(args.train)
+        classifier = GenreClassifier.fit(tracks)
+        summary = classifier.score_shards(
+            args.source, args.output, batch_size=args.batch_size, k=args.top
+        )
+        print(
+            f"Wrote the genres of {summary['rows']:,} tracks to {args.output} "
+            f"in {summary['seconds']:.2f}s ({summary['rows_per_second']:,.0f} rows/s)"
+        )
+        print(classifier.throughput())
+        return 0
+
+    from ci_with_spotify.cache import DEFAULT_CACHE_DIR
+    from ci_with_spotify.report import build_report
+
+    summary = build_report(
+        args.source,
+        args.output,
+        workers=args.workers,
+        genres=args.genres.split(",") if args.genres else None,
+        min_dur=args.min_duration,
+        max_dur=args.max_duration,
+        top=args.top,
+        fmt=args.format,
+        cache_dir=args.cache_dir or DEFAULT_CACHE_DIR,
+    )
+    seconds = summary["seconds"]
+    print(
+        f"Wrote the report of {len(summary['tracks'])} genres to {args.output} "
+        f"in {seconds['total']:.2f}s ({seconds['genres']:.2f}s for the genres, "
+        f"{summary['workers']} workers)"
+    )
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
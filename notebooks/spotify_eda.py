@@ -4,9 +4,19 @@ __generated_with = "0.17.8"
 app = marimo.App(width="medium")
 
 with app.setup:
+    import sys
+    from pathlib import Path
+
     import marimo as mo
-    import plotly.express as px
-    import polars as pl
+
+    # Make the `ci_with_spotify` package importable when running from any directory
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    import ci_with_spotify as eda
+
+    # Only imported once a cell uses them (and imported ahead of that in the background, see below),
+    # so the first cells render without waiting for them
+    pl = eda.lazy_import("polars")
+    px = eda.lazy_import("plotly.express")
 
 
 @app.cell(hide_code=True)
@@ -28,9 +38,60 @@ def _():
 
 @app.cell
 def _():
+    # Either a parquet file, a glob of shards or a directory partitioned by genre (see `python main.py partition`),
+    # in which case filtering on a genre only reads the files of that genre
     URL = "input/tracks.parquet"
-    lz = pl.scan_parquet(URL)
-    return (lz,)
+    # Set to True to run the queries with the streaming engine, for datasets larger than memory.
+    # In that case only the small aggregated results are collected, and the tables below show a preview.
+    STREAMING = False
+    # Set to True to record the time, rows, peak memory and query plan of each stage, shown at the end of the notebook
+    PROFILE = False
+    profiler = eda.Profiler(enabled=PROFILE)
+    # Set to True to keep the tracks in a compact schema (categorical text, 8/32-bit numbers), using about half the memory
+    COMPACT = False
+    # Set to True to collapse the tracks listed under several genres into a single row, with a list of their genres
+    UNIQUE_TRACKS = False
+    # Set to True to show the duration histogram and the genre means estimated from a sample first, with error bars,
+    # switching to the exact results once they are computed in the background
+    APPROXIMATE = False
+
+    # The cleaning steps live in `ci_with_spotify.pipeline.clean_tracks`:
+    # - Filter data we consider relevant (somewhat arbitrary in this example)
+    # - Keep the row index as a stable `row_id`, drop the original ID and the explicit flag
+    # - Convert the duration from milliseconds to seconds (int)
+    # - Convert the popularity from an integer 0 ~ 100 to a percentage 0 ~ 1.0
+    # With `COMPACT`, the columns are then narrowed by `ci_with_spotify.schema.compact_tracks`, and with
+    # `UNIQUE_TRACKS` the listings of a track are collapsed by `ci_with_spotify.dedup.unique_tracks`
+    def clean(lf):
+        if UNIQUE_TRACKS:
+            lf = eda.with_track_key(lf)
+        lf = eda.clean_compact_tracks(lf) if COMPACT else eda.clean_tracks(lf)
+        return eda.unique_tracks(lf) if UNIQUE_TRACKS else lf
+
+    # Load the tracks and compute the first aggregations on a background thread pool while the next cells render.
+    # The cells below pick the results up with `warmup.get_or_compute`, and compute anything that was not warmed up.
+    warmup = eda.start_warmup(URL, clean, streaming=STREAMING)
+    lz = eda.scan_tracks(URL)
+    # Identifies the cleaned tracks, so results cached across reruns (e.g. the trendlines) are not reused once the
+    # source files or the cleaning steps (`COMPACT`, `UNIQUE_TRACKS`) change: the key of the cached table, or with
+    # `STREAMING`, which never loads it, the paths, sizes and modification times of the files
+    tracks_version = (
+        eda.source_version(URL, clean)
+        if STREAMING
+        else eda.TracksCache().key(URL, clean)
+    )
+    return (
+        APPROXIMATE,
+        COMPACT,
+        STREAMING,
+        UNIQUE_TRACKS,
+        URL,
+        clean,
+        lz,
+        profiler,
+        tracks_version,
+        warmup,
+    )
 
 
 @app.cell(hide_code=True)
@@ -40,30 +101,64 @@ def _():
 
     The [Polars Lazy API](https://docs.pola.rs/user-guide/lazy/) allows for you define operations before loading the data, and polars will optimize the plan in order to avoid doing unnecessary operations or loading data we do not care about.
 
-    Let's say that looking at the dataset's preview in the Data Viewer, we decided we do not want the Unnamed column (which appears to be the row index), nor do we care about the original ID, and we only want non-explicit tracks.
+    Let's say that looking at the dataset's preview in the Data Viewer, we decided to rename the Unnamed column (which appears to be the row index) to `row_id`, which lets us find rows again later on, we do not care about the original ID, and we only want non-explicit tracks.
     """)
     return
 
 
 @app.cell
-def _(lz):
-    df = (
-        lz
-        # Filter data we consider relevant (somewhat arbitrary in this example)
-        .filter(pl.col("explicit") == False)  # noqa
-        .drop("Unnamed: 0", "track_id", "explicit")
-        .with_columns(
-            # Perform whichever transformations you want  (again somewhat arbitrary in this example)
-            # Convert the duration from milliseconds to seconds (int)
-            pl.col("duration_ms").floordiv(1_000).alias("duration_seconds"),
-            # Convert the popularity from an integer 0 ~ 100 to a percentage 0 ~ 1.0
-            pl.col("popularity").truediv(100),
+def _(STREAMING, URL, clean, lz, profiler, warmup):
+    if STREAMING:
+        # With the streaming engine we only collect a preview, and keep working on the lazy `tracks`
+        tracks = clean(lz)
+        df = profiler.collect(
+            "load + clean (preview)", tracks.head(10_000), streaming=True
         )
-        # lastly, download (if needed) and collect into memory
-        .collect()
-    )
+    else:
+        # lastly, download (if needed) and collect into memory.
+        # The cleaned table is cached on disk and memory-mapped, so this is only slow the first time.
+        with profiler.stage("load + clean") as _stage:
+            df = warmup.get_or_compute(
+                "tracks", lambda: eda.TracksCache().load(URL, clean)
+            )
+            _stage.rows_out = df.height
+        tracks = df.lazy()
     df
-    return (df,)
+    return df, tracks
+
+
+@app.cell
+def _(STREAMING, profiler, tracks, warmup):
+    # The artists column holds `;` separated lists of names. They are split once here into an artist dimension
+    # (integer IDs) and a track-artist bridge table, which the artist rankings, collaborations and search below reuse.
+    with profiler.stage("artist model (build)") as _stage:
+        artist_model = warmup.get_or_compute(
+            "artist_model", lambda: eda.ArtistModel.build(tracks, streaming=STREAMING)
+        )
+        _stage.rows_out = len(artist_model)
+    return (artist_model,)
+
+
+@app.cell
+def _(COMPACT, STREAMING, UNIQUE_TRACKS, df, lz):
+    # How much memory the compact schema saves, compared to the plain cleaned table
+    if COMPACT and not STREAMING and not UNIQUE_TRACKS:
+        _report = eda.memory_report(eda.clean_tracks(lz).collect(), df)
+        _total = _report.row(-1, named=True)
+        _output = mo.vstack(
+            [
+                mo.md(
+                    f"The compact table takes {_total['bytes_after'] / 2**20:,.1f} MiB "
+                    f"instead of {_total['bytes_before'] / 2**20:,.1f} MiB "
+                    f"({_total['ratio']:.1f}x less)."
+                ),
+                _report,
+            ]
+        )
+    else:
+        _output = None
+    _output
+    return
 
 
 @app.cell(hide_code=True)
@@ -82,13 +177,16 @@ def _():
 
 
 @app.cell
-def _(df):
+def _(STREAMING, tracks):
     # We *could* just filter some of the rows and look at them as a table, for example...
-    pl.concat(
-        [
-            df.sort("duration_ms").head(5),
-            df.sort("duration_ms", descending=True).head(5),
-        ]
+    eda.collect(
+        pl.concat(
+            [
+                tracks.sort("duration_ms").head(5),
+                tracks.sort("duration_ms", descending=True).head(5),
+            ]
+        ),
+        streaming=STREAMING,
     )
     # But creating a visualisation for this helps paint the full picture of how the data is distributed, rather than focusing *only* on some outiers
     return
@@ -105,13 +203,82 @@ def _():
 
 
 @app.cell
-def _(df):
-    duration_counts = df.group_by("duration_seconds").len("count")
-    fig = px.bar(duration_counts, x="duration_seconds", y="count")
-    fig.update_layout(selectdirection="h")
-    plot = mo.ui.plotly(fig)
+def _(APPROXIMATE, STREAMING, profiler, tracks):
+    # With `APPROXIMATE`, about 5% of the tracks of each genre (and at least 100 of them) are sampled, each weighted
+    # by how many tracks it stands for. The aggregations of the sample come with 95% error bounds,
+    # see `ci_with_spotify/approx.py`
+    approx = None
+    if APPROXIMATE:
+        with profiler.stage("stratified sample") as _stage:
+            approx = eda.StratifiedSample.build(tracks, streaming=STREAMING)
+            _stage.rows_out = approx.sample.height
+    return (approx,)
+
+
+@app.cell
+def _(STREAMING, approx, profiler, tracks, warmup):
+    # The exact counts are computed on a background thread. Until they are ready, the histogram shows the estimate,
+    # and setting the state once they are re-runs it
+    get_counts_exact, set_counts_exact = mo.state(False)
+    # The selected durations, so the selection carries over to the exact histogram (its bars are not the same)
+    get_duration_range, set_duration_range = mo.state(None)
+    duration_progress = eda.Progressive(
+        approx.duration_counts() if approx else None,
+        lambda: warmup.get_or_compute(
+            "duration_counts",
+            lambda: profiler.collect(
+                "duration histogram", eda.duration_counts(tracks), streaming=STREAMING
+            ),
+        ),
+        on_exact=(lambda _: set_counts_exact(True)) if approx else None,
+        thread=mo.Thread,
+    )
+    return (
+        duration_progress,
+        get_counts_exact,
+        get_duration_range,
+        set_duration_range,
+    )
+
+
+@app.cell
+def _(
+    duration_progress,
+    get_counts_exact,
+    get_duration_range,
+    profiler,
+    set_duration_range,
+):
+    get_counts_exact()  # Only read to re-run this cell once the exact counts are ready
+    duration_counts, _exact = duration_progress.get()
+    with profiler.stage("plot duration histogram", rows_in=duration_counts.height):
+        fig = px.bar(
+            duration_counts,
+            x="duration_seconds",
+            y="count",
+            error_y=None if _exact else "count_error",
+            title=None
+            if _exact
+            else "Estimated from a sample, computing the exact counts...",
+        )
+        fig.update_layout(selectdirection="h")
+        if get_duration_range() is not None:
+            # Selects the bars within the durations selected on the previous histogram
+            _low, _high = get_duration_range()
+            fig.add_selection(
+                x0=_low, x1=_high, y0=0, y1=duration_counts["count"].max()
+            )
+
+        def _remember_range(_value):
+            # Setting the state from this cell does not re-run it
+            _durations = duration_counts[plot.indices]["duration_seconds"]
+            set_duration_range(
+                (_durations.min(), _durations.max()) if plot.indices else None
+            )
+
+        plot = mo.ui.plotly(fig, on_change=_remember_range)
     plot
-    return (plot,)
+    return duration_counts, plot
 
 
 @app.cell(hide_code=True)
@@ -126,6 +293,25 @@ def _():
     return
 
 
+@app.cell
+def _(APPROXIMATE, tracks):
+    # With `APPROXIMATE`, the extremes of the durations come from a quantile sketch (within 1% of the exact values)
+    # and the numbers of distinct tracks and artists from HyperLogLog sketches (within about 3%), in a single pass
+    _summary = None
+    if APPROXIMATE:
+        _distinct = pl.concat(
+            [
+                eda.approx_n_unique(tracks, column).select(
+                    pl.lit(column).alias("column"), pl.all()
+                )
+                for column in ["track_name", "artists", "album_name"]
+            ]
+        )
+        _summary = mo.hstack([eda.duration_summary(tracks), _distinct])
+    _summary
+    return
+
+
 @app.cell
 def _(plot):
     # The format of plot.value may vary depending on which kind of plot you are working with, let's see what we have for this case:
@@ -134,21 +320,40 @@ def _(plot):
 
 
 @app.cell
-def _(df, plot):
+def _(STREAMING, duration_counts, plot, profiler, tracks):
     # Now, we want to filter to only include tracks whose duration falls inside of our selection - we will need to first identify the extremes, then filter based on them
-    min_dur, max_dur = get_extremes(
-        plot.value, col="duration_seconds", defaults_if_missing=(120, 360)
-    )  # Utility function defined in the bottom of the Notebook
+    # The indices of the selected bars are positions in `duration_counts`, so we can gather them directly
+    min_dur, max_dur = eda.get_extremes(
+        duration_counts[plot.indices] if plot.indices else None,
+        col="duration_seconds",
+        defaults_if_missing=eda.DEFAULT_DURATION,
+    )  # Utility function defined in `ci_with_spotify/utils.py`
     # Calculate how many we are keeping vs throwing away with the filter
-    duration_in_range = pl.col("duration_seconds").is_between(min_dur, max_dur)
+    duration_in_range = eda.duration_in_range(min_dur, max_dur)
+    thrown_away = profiler.collect(
+        "duration filter (share)",
+        tracks.select(1 - duration_in_range.mean()),
+        streaming=STREAMING,
+    ).item()
     print(
-        f"Filtering to keep rows between {min_dur}s and {max_dur}s duration - Throwing away {df.select(1 - duration_in_range.mean()).item():.2%} of the rows"
+        f"Filtering to keep rows between {min_dur}s and {max_dur}s duration - Throwing away {thrown_away:.2%} of the rows"
     )
 
-    # Actually apply the filter
-    filtered_duration = df.filter(duration_in_range)
+    # Actually apply the filter, keeping a lazy version around for the aggregations
+    filtered_tracks = eda.filter_duration(tracks, min_dur, max_dur)
+    filtered_duration = profiler.collect(
+        "duration filter",
+        filtered_tracks.head(10_000) if STREAMING else filtered_tracks,
+        streaming=STREAMING,
+    )
     filtered_duration
-    return (filtered_duration,)
+    return (
+        duration_in_range,
+        filtered_duration,
+        filtered_tracks,
+        max_dur,
+        min_dur,
+    )
 
 
 @app.cell(hide_code=True)
@@ -171,48 +376,30 @@ def _():
 
 
 @app.cell(hide_code=True)
-def _(filter_genre, filtered_duration):
-    most_popular_artists = (
-        filtered_duration.lazy()
-        # If you saw the Dataset description or looked closely at the Artists column you may notice there are some rows with multiple artists separated by ;;. We will have to separate each of these.
-        .with_columns(pl.col("artists").str.split(";"))
-        # Similarly to the utility function you saw before, filter_genre is also defined in a later cell.
-        # While developing, you can add things out of order then go back to old cells and edit them
-        # it's up to you whenever to put them in whichever order makes the most sense to you.
-        .filter(
-            True
-            if filter_genre.value is None
-            else pl.col("track_genre").eq(filter_genre.value)
-        )
-        .explode("artists")
-        .group_by("artists")
-        .agg(
-            # How to aggregate it is also a question,
-            # Do we take the sum of each of their songs popularity?
-            # Do we just take their most popular song?
-            # Do we take an average of their songs popularity?
-            # We'll proceed with the average of their top 10 most popular songs for now,
-            # but that is something you may want to modify and experiment with, or ask for input from stakeholders in real problems.
-            pl.col("popularity").top_k(10).mean(),
-            # Say that after doing this you don't recognize them and want to know what are their top hits,
-            # Let's also take some of their most popular albums songs for reference:
-            pl.col("track_name")
-            .sort_by("popularity")
-            .unique(maintain_order=True)
-            .top_k(5),
-            pl.col("album_name")
-            .sort_by("popularity")
-            .unique(maintain_order=True)
-            .top_k(5),
-            pl.col("track_genre")
-            .top_k_by("popularity", k=1)
-            .alias("Most popular genre"),
-            # And for good measure, see how many total tracks they have
-            pl.col("track_name").n_unique().alias("tracks_count"),
+def _(STREAMING, artist_model, filtered_tracks, max_dur, min_dur, profiler, warmup):
+    # If you saw the Dataset description or looked closely at the Artists column you may notice there are some rows with multiple artists separated by ;;.
+    # `PopularArtists` separates each of these, then ranks the artists by the average of their top 10 most popular songs.
+    # How to aggregate it is also a question - do we take the sum of each of their songs popularity? Their most popular song?
+    # That is something you may want to modify and experiment with in `ci_with_spotify/aggregations.py`, or ask for input from stakeholders in real problems.
+    # The aggregation runs once for every genre here, so changing the genre filter below is just a lookup.
+    with profiler.stage("popular artists (build)"):
+        popular_artists = warmup.get_or_compute(
+            ("popular_artists", min_dur, max_dur),
+            lambda: eda.PopularArtists.build(
+                filtered_tracks, streaming=STREAMING, artists=artist_model
+            ),
         )
-        .sort("popularity", descending=True)
-        .collect()
-    )
+    return (popular_artists,)
+
+
+@app.cell(hide_code=True)
+def _(filter_genre, popular_artists, profiler):
+    # Similarly to the utility function you saw before, filter_genre is also defined in a later cell.
+    # While developing, you can add things out of order then go back to old cells and edit them
+    # it's up to you whenever to put them in whichever order makes the most sense to you.
+    with profiler.stage("popular artists (lookup)") as _stage:
+        most_popular_artists = popular_artists.get(filter_genre.value)
+        _stage.rows_out = most_popular_artists.height
     mo.vstack(
         [
             mo.md("Let's start by taking a look at the most popular artists"),
@@ -243,16 +430,46 @@ def _():
 
 
 @app.cell
-def _(filtered_duration):
+def _(
+    STREAMING,
+    approx,
+    duration_in_range,
+    filtered_tracks,
+    max_dur,
+    min_dur,
+    profiler,
+    warmup,
+):
+    # As for the histogram, the means are estimated from the sample while the exact ones are computed
+    get_means_exact, set_means_exact = mo.state(False)
+    means_progress = eda.Progressive(
+        approx.genre_means(duration_in_range) if approx else None,
+        lambda: warmup.get_or_compute(
+            ("genre_means", min_dur, max_dur),
+            lambda: profiler.collect(
+                "genre means", eda.genre_means(filtered_tracks), streaming=STREAMING
+            ),
+        ),
+        on_exact=(lambda _: set_means_exact(True)) if approx else None,
+        thread=mo.Thread,
+    )
+    return get_means_exact, means_progress
+
+
+@app.cell
+def _(get_means_exact, means_progress):
+    get_means_exact()  # Only read to re-run this cell once the exact means are ready
+    _means, _exact = means_progress.get()
     fig_dur_per_genre = px.scatter(
-        filtered_duration.group_by("track_genre")
-        .agg(
-            pl.col("duration_seconds", "popularity").mean().round(2),
-        )
-        .sort("track_genre", descending=True),
+        _means,
         hover_name="track_genre",
         y="duration_seconds",
         x="popularity",
+        error_y=None if _exact else "duration_seconds_error",
+        error_x=None if _exact else "popularity_error",
+        title=None
+        if _exact
+        else "Estimated from a sample, computing the exact means...",
     )
     fig_dur_per_genre
     return
@@ -266,39 +483,92 @@ def _():
     We will use Dropdowns to allow for the user to select any column to use for the visualisation, and throw in some extras
 
     - A slider for the transparency to help understand dense clusters
-    - Add a Trendline to the scatterplot (requires statsmodels)
+    - Add a Trendline to the scatterplot
     - Filter by some specific Genre
     """)
     return
 
 
+@app.cell
+def _():
+    # Trendlines only depend on the axes, the genre and the data, so they are cached across reruns caused by cosmetic changes
+    trendlines = eda.Trendlines()
+    return (trendlines,)
+
+
 @app.cell(hide_code=True)
 def _(
+    STREAMING,
     alpha,
     color,
     filter_genre2,
     filtered_duration,
     include_trendline,
+    max_dur,
+    min_dur,
+    profiler,
+    tracks_version,
+    trendlines,
     x_axis,
     y_axis,
 ):
-    fig2 = px.scatter(
-        filtered_duration.filter(
-            (pl.col("track_genre") == filter_genre2.value)
-            if filter_genre2.value is not None
-            else True
-        ),
-        x=x_axis.value,
-        y=y_axis.value,
-        color=color.value,
-        opacity=alpha.value,
-        trendline="lowess" if include_trendline.value else None,
-        render_mode="webgl",
-        # strings on hover get fairly heavy when there are too many rows, but you can try using it after applying a few filters
-        # hover_name="track_name",
-        # hover_data=("artists", "album_name"),
-    )
-    chart2 = mo.ui.plotly(fig2)
+    # Above a few thousand rows every point is binned into a grid server side, so what is sent to the browser stays the same size however large the dataset is
+    with profiler.stage("scatter data", rows_in=filtered_duration.height) as _stage:
+        scatter_data, binned = eda.scatter_frame(
+            eda.filter_genre(filtered_duration.lazy(), filter_genre2.value),
+            x_axis.value,
+            y_axis.value,
+            color.value,
+        )
+        _stage.rows_out = scatter_data.height
+    with profiler.stage("plot scatter", rows_in=scatter_data.height):
+        if binned:
+            # Each point is a cell of the grid, sized by the number of tracks in it and coloured by their mean
+            fig2 = px.scatter(
+                scatter_data,
+                x=x_axis.value,
+                y=y_axis.value,
+                color=f"{color.value}_mean" if color.value else "count",
+                size="count",
+                size_max=12,
+                opacity=alpha.value,
+                hover_data=["count"],
+                render_mode="webgl",
+            )
+        else:
+            fig2 = px.scatter(
+                scatter_data,
+                x=x_axis.value,
+                y=y_axis.value,
+                color=color.value,
+                opacity=alpha.value,
+                render_mode="webgl",
+                # The row ID of each point lets us gather the selected tracks rather than joining on the (float) plotted values
+                hover_data=[eda.ROW_ID],
+                # strings on hover get fairly heavy when there are too many rows, but you can try using it after applying a few filters
+                # hover_name="track_name",
+                # hover_data=(eda.ROW_ID, "artists", "album_name"),
+            )
+    if include_trendline.value:
+        with profiler.stage("trendline") as _stage:
+            # Only a preview is plotted with `STREAMING`
+            trendline = trendlines.get(
+                filtered_duration,
+                x_axis.value,
+                y_axis.value,
+                filter_genre2.value,
+                version=(tracks_version, STREAMING, min_dur, max_dur),
+            )
+            _stage.rows_out = trendline.height
+        fig2.add_scatter(
+            x=trendline[x_axis.value],
+            y=trendline[y_axis.value],
+            mode="lines",
+            name="LOWESS trendline",
+            line_color="black",
+        )
+    with profiler.stage("plot scatter (serialize)"):
+        chart2 = mo.ui.plotly(fig2)
 
     mo.vstack(
         [
@@ -320,18 +590,108 @@ def _():
 
 
 @app.cell
-def _(chart2, filtered_duration):
+def _(chart2, color, filter_genre2, filtered_duration, x_axis, y_axis):
     # Looking at which sort of songs were included in that region
-    if len(chart2.value) == 0:
+    selected_ids = eda.selected_row_ids(chart2.value)
+    if selected_ids is not None:
+        # Raw points carry their row ID, so the selection is a gather rather than a join
+        selected = eda.take_rows(filtered_duration, selected_ids)
+    elif chart2.ranges:
+        # The cells of the density grid do not, but a box selection gives us the ranges
+        selected = eda.filter_ranges(
+            eda.filter_genre(filtered_duration.lazy(), filter_genre2.value),
+            chart2.ranges,
+        ).collect()
+    else:
+        selected = None
+    if selected is None or selected.is_empty():
         out = mo.md("No data found in selection")
-        active_columns = column_order = None
     else:
-        active_columns = list(chart2.value[0].keys())
-        column_order = ["track_name", *active_columns, "album_name", "artists"]
-        out = filtered_duration.join(
-            pl.DataFrame(chart2.value).unique(), on=active_columns
-        ).select(pl.col(column_order), pl.exclude(*column_order))
+        column_order = [
+            "track_name",
+            x_axis.value,
+            y_axis.value,
+            "album_name",
+            "artists",
+        ]
+        column_order = list(dict.fromkeys(column_order))
+        # Zooming into the selected region shows the raw (downsampled if needed) points again
+        zoomed, _binned = eda.scatter_frame(
+            selected, x_axis.value, y_axis.value, color.value, ranges=chart2.ranges
+        )
+        out = mo.vstack(
+            [
+                px.scatter(
+                    zoomed,
+                    x=x_axis.value,
+                    y=y_axis.value,
+                    color=f"{color.value}_mean"
+                    if _binned and color.value
+                    else color.value,
+                    hover_name="track_name",
+                    render_mode="webgl",
+                ),
+                selected.select(pl.col(column_order), pl.exclude(*column_order)),
+            ]
+        )
     out
+    return (selected,)
+
+
+@app.cell
+def _(STREAMING, artist_model, df, profiler, warmup):
+    # The indexes over every track are built on the warm-up threads, so the cells keep rendering meanwhile,
+    # and a cell only waits for an index once it needs it (e.g. the similar tracks, once there is a selection).
+    # - Standardized audio features grouped into clusters, so finding the closest tracks only
+    #   compares against a few clusters instead of every track (see `ci_with_spotify/similarity.py`)
+    # - The names lowercased and indexed once, so typing in the text boxes does not rescan the whole table
+    def _build_similarity_index():
+        with profiler.stage("similar tracks (build index)", rows_in=df.height):
+            return eda.SimilarityIndex.build(df)
+
+    def _build_search_index():
+        with profiler.stage("search (build index)", rows_in=df.height):
+            return eda.SearchIndex.build(df, artist_model)
+
+    similarity_key, search_key = (
+        (None, None) if STREAMING else ("similarity_index", "search_index")
+    )
+    if not STREAMING:
+        warmup.submit(similarity_key, _build_similarity_index, kind=similarity_key)
+        warmup.submit(search_key, _build_search_index, kind=search_key)
+    return search_key, similarity_key
+
+
+@app.cell
+def _(df, profiler, selected, similarity_key, warmup):
+    # The tracks that sound the most like the first few tracks of the selection
+    if similarity_key is None or selected is None or selected.is_empty():
+        _similar = None
+    else:
+        similarity_index = warmup.result(similarity_key)
+        with profiler.stage("similar tracks", rows_in=len(similarity_index)) as _stage:
+            _neighbours = similarity_index.similar(
+                selected[eda.ROW_ID].head(5), k=5
+            ).with_columns(
+                pl.col(eda.ROW_ID, "similar_row_id").cast(df[eda.ROW_ID].dtype)
+            )
+            _similar = (
+                _neighbours.join(
+                    df.select(eda.ROW_ID, "track_name", "artists"), on=eda.ROW_ID
+                )
+                .join(
+                    df.select(
+                        pl.col(eda.ROW_ID).alias("similar_row_id"),
+                        pl.col("track_name").alias("similar_track"),
+                        pl.col("artists").alias("similar_artists"),
+                        "track_genre",
+                    ),
+                    on="similar_row_id",
+                )
+                .sort(eda.ROW_ID, "rank")
+            )
+            _stage.rows_out = _similar.height
+    _similar
     return
 
 
@@ -354,55 +714,18 @@ def _():
 def _():
     mo.md(r"""
     # Utility Functions and UI Elements
+
+    The utility functions, such as `get_extremes`, live in the `ci_with_spotify` package next to the notebook so that they can be tested.
     """)
     return
 
 
-@app.function
-def get_extremes(selection, col, defaults_if_missing):
-    """
-    Extract the minimum and maximum values from a specific column in a selection.
-
-    This function processes a list of rows (selection) and extracts the minimum and maximum
-    values from a specified column index. If the selection is empty or None, it returns
-    default values and prints a warning message.
-
-    Args:
-        selection (list): A list of rows where each row is indexable (e.g., list, tuple).
-                         Can be None or empty.
-        col (int): The column index to extract values from in each row.
-        defaults_if_missing (tuple[int, int]): A tuple containing (min_default, max_default)
-                                              to return when selection is invalid.
-
-    Returns:
-        tuple[int, int]: A tuple containing (minimum_value, maximum_value) from the specified
-                        column, or the default values if the selection is invalid.
-
-    Example:
-        >>> data = [[1, 10, 100], [2, 20, 200], [3, 30, 300]]
-        >>> get_extremes(data, 1, (0, 0))
-        (10, 30)
-        
-        >>> get_extremes([], 0, (5, 10))
-        Could not find a selected region. Using default values (5, 10) instead...
-        (5, 10)
-    """
-    if selection is None or len(selection) == 0:
-        print(
-            f"Could not find a selected region. Using default values {defaults_if_missing} instead, try clicking and dragging in the plot to change them."
-        )
-        return defaults_if_missing
-    else:
-        return (
-            min(row[col] for row in selection),
-            max(row[col] for row in selection),
-        )
-
-
 @app.cell
-def _(filtered_duration):
+def _(filtered_tracks, max_dur, min_dur, warmup):
     filter_genre = mo.ui.dropdown(
-        options=filtered_duration["track_genre"].unique().sort().to_list(),
+        options=warmup.get_or_compute(
+            ("genres", min_dur, max_dur), lambda: eda.genres(filtered_tracks)
+        ),
         allow_select_none=True,
         value=None,
         searchable=True,
@@ -412,7 +735,7 @@ def _(filtered_duration):
 
 
 @app.cell
-def _(filtered_duration):
+def _(filtered_tracks, max_dur, min_dur, warmup):
     # Columns that make sense for the scatterplot and the corresponding UI elements
     options = [
         "duration_seconds",
@@ -444,13 +767,63 @@ def _(filtered_duration):
     include_trendline = mo.ui.checkbox(label="Trendline")
     # We *could* reuse the same filter_genre from above, but it would cause marimo to rerun both the table and the graph whenever we change it
     filter_genre2 = mo.ui.dropdown(
-        options=filtered_duration["track_genre"].unique().sort().to_list(),
+        options=warmup.get_or_compute(
+            ("genres", min_dur, max_dur), lambda: eda.genres(filtered_tracks)
+        ),
         allow_select_none=True,
         value=None,
         searchable=True,
         label="Filter by Track Genre:",
     )
-    return alpha, color, filter_genre2, include_trendline, x_axis, y_axis
+    return alpha, color, filter_genre2, include_trendline, options, x_axis, y_axis
+
+
+@app.cell
+def _(
+    STREAMING,
+    artist_model,
+    filtered_duration,
+    filtered_tracks,
+    max_dur,
+    min_dur,
+    options,
+    profiler,
+    warmup,
+):
+    # Like the indexes over every track, the ones over the duration range are built on the warm-up threads,
+    # and the appendix cells below wait for them. Submitting them with a `kind` keeps only those of the current range:
+    # the indexes of the range left behind are dropped, and cancelled if they have not started yet
+    def _build_collaborations():
+        # The counts of every genre are computed once here, so changing the genre filter below is just a lookup.
+        with profiler.stage("artist collaborations (build)"):
+            return eda.CollaborationIndex.build(filtered_tracks, artist_model)
+
+    def _build_crossfilter():
+        # The columns are sorted and binned once here, so moving a slider only visits the tracks crossing its bounds
+        # (see `ci_with_spotify/crossfilter.py`) instead of filtering the whole table again
+        with profiler.stage("crossfilter (build)", rows_in=filtered_duration.height):
+            return eda.Crossfilter(filtered_duration, options, bins=40)
+
+    def _fit_classifier():
+        # Fitting is a single group_by (see `ci_with_spotify/classifier.py`), and scoring a matrix product per batch,
+        # so the same classifier can label millions of tracks: `python main.py classify <labelled> <unlabelled>`
+        held_out = pl.col(eda.ROW_ID) % 5 == 0
+        with profiler.stage("genre classifier (fit)"):
+            classifier = eda.GenreClassifier.fit(
+                filtered_tracks.filter(~held_out), options, streaming=STREAMING
+            )
+        with profiler.stage("genre classifier (evaluate)") as stage:
+            scores = classifier.evaluate(filtered_duration.filter(held_out), k=5)
+            stage.rows_in = scores["rows"]
+        return classifier, scores
+
+    collaborations_key = ("collaborations", min_dur, max_dur)
+    crossfilter_key = ("crossfilter", min_dur, max_dur)
+    classifier_key = ("classifier", min_dur, max_dur)
+    warmup.submit(collaborations_key, _build_collaborations, kind="collaborations")
+    warmup.submit(crossfilter_key, _build_crossfilter, kind="crossfilter")
+    warmup.submit(classifier_key, _fit_classifier, kind="classifier")
+    return classifier_key, collaborations_key, crossfilter_key
 
 
 @app.cell(hide_code=True)
@@ -466,58 +839,65 @@ def _():
     # Components to filter for some specific song
     filter_artist = mo.ui.text(label="Artist: ")
     filter_track = mo.ui.text(label="Track name: ")
-    return filter_artist, filter_track
-
-
-@app.cell(disabled=True)
-def _(filtered_duration):
-    # Note that we cannot use dropdown due to the sheer number of elements being enormous:
-    all_artists = filtered_duration.select(
-        pl.col("artists").str.split(";").explode().unique().sort()
-    )["artists"].to_list()
-    all_tracks = filtered_duration["track_name"].unique().sort().to_list()
-    mo.ui.dropdown(all_artists, value=None, searchable=True)
-    mo.ui.dropdown(all_tracks, value=None, searchable=True)
-    # So we just provide freeform text boxes and filter ourselfves later
-    # (the "alternative_" in the name is just to avoid conflicts with the above cell,
-    #  despite this being disabled marimo still requires global variables to be unique)
-    return
+    collaborators_prefix = mo.ui.text(
+        label="Top collaborators of (start of the name): "
+    )
+    return collaborators_prefix, filter_artist, filter_track
 
 
 @app.cell
-def _(filter_artist, filter_track, filtered_duration):
-    def score_match_text(col: pl.Expr, string: str | None) -> pl.Expr:
-        if not string:
-            return pl.lit(0)
-        col = col.str.to_lowercase()
-        string = string.casefold()
-        return (
-            # For a more professional use case, you might want to look into string distance functions
-            # in the polars-ds package or other polars plugins
-            -col.str.len_chars().cast(pl.Int32())
-            + pl.when(col.str.contains(string)).then(50).otherwise(0)
-            + pl.when(col.str.starts_with(string)).then(50).otherwise(0)
-        )
+def _(artist_model, collaborators_prefix):
+    # A dropdown of every artist would be enormous, but the artist model keeps the names sorted,
+    # so a binary search finds the (at most 50) artists starting with what was typed above
+    collaborators_of = mo.ui.dropdown(
+        artist_model.complete(collaborators_prefix.value, k=50),
+        value=None,
+        searchable=True,
+        label="Artist: ",
+    )
+    return (collaborators_of,)
+
 
-    filtered_artist_track = (
-        filtered_duration.select(
-            pl.col("artists"),
-            pl.col("track_name"),
-            (
-                score_match_text(pl.col("track_name"), filter_track.value)
-                + pl.col("artists")
-                .str.split(";")
-                .list.eval(score_match_text(pl.element(), filter_artist.value))
-                .list.sum()
-            ).alias("match_score"),
-            pl.col("album_name"),
-            pl.col("track_genre"),
-            pl.col("popularity"),
-            pl.col("duration_seconds"),
+@app.cell
+def _(
+    STREAMING,
+    artist_model,
+    df,
+    filter_artist,
+    filter_track,
+    filtered_tracks,
+    max_dur,
+    min_dur,
+    profiler,
+    search_key,
+    warmup,
+):
+    # `score_match_text` (in `ci_with_spotify/pipeline.py`) favours short names that contain or start with the search.
+    # For a more professional use case, you might want to look into string distance functions
+    # in the polars-ds package or other polars plugins
+    if search_key is None:
+        filtered_artist_track = profiler.collect(
+            "search",
+            eda.match_tracks(
+                filtered_tracks,
+                artist=filter_artist.value,
+                track=filter_track.value,
+                artists=artist_model,
+            ),
+            streaming=STREAMING,
         )
-        .filter(pl.col("match_score") > 0)
-        .sort("match_score", descending=True)
-    )
+    else:
+        search_index = warmup.result(search_key)
+        with profiler.stage("search", rows_in=df.height) as _stage:
+            # Only the tracks within the selected duration range
+            in_range = df.select(eda.duration_in_range(min_dur, max_dur)).to_series()
+            filtered_artist_track = search_index.search(
+                artist=filter_artist.value,
+                track=filter_track.value,
+                k=100,
+                where=in_range.to_numpy(),
+            )
+            _stage.rows_out = filtered_artist_track.height
 
     mo.vstack(
         [
@@ -531,39 +911,223 @@ def _(filter_artist, filter_track, filtered_duration):
 
 
 @app.cell
-def _(filter_genre2, filtered_duration):
-    # Artists combinations
-    artist_combinations = (
-        filtered_duration.lazy()
-        .filter(
-            (pl.col("track_genre") == filter_genre2.value)
-            if filter_genre2.value is not None
-            else True
-        )
-        .with_columns(pl.col("artists").str.split(";"))
-        .with_columns(pl.col("artists").alias("other_artist"))
-        .explode("artists")
-        .explode("other_artist")
-        # Filter to:
-        # 1) Remove an artist with themselves
-        # 2) Remove duplicate combinations, otherwise we would have once row for (A, B) and one for (B, A)
-        .filter(pl.col("artists") > pl.col("other_artist"))
-        .group_by("artists", "other_artist")
-        .len("count")
-        .collect()
-    )
+def _(
+    collaborations_key, collaborators_of, collaborators_prefix, filter_genre2, warmup
+):
+    # Artists combinations: pair each artist of a track with every other artist of that track,
+    # keeping only one of (A, B) and (B, A) and removing an artist paired with themselves.
+    collaborations = warmup.result(collaborations_key)
     mo.vstack(
         [
             mo.md(
                 "Check which artists collaborate with others most often (reuses the last genre filter)"
             ),
             filter_genre2,
-            artist_combinations.sort("count", descending=True),
+            collaborations.pairs(filter_genre2.value),
+            mo.hstack([collaborators_prefix, collaborators_of]),
+            collaborations.top_collaborators(
+                collaborators_of.value or "", genre=filter_genre2.value
+            ),
         ],
         align="center",
     )
     return
 
 
+@app.cell(hide_code=True)
+def _():
+    mo.md(r"""
+    ## Crossfilter
+
+    Instead of selecting a single region, we can also narrow the tracks down on every column at once.
+    Each histogram below shows the tracks within the ranges of all the *other* columns, so moving one slider updates every other histogram.
+    """)
+    return
+
+
+@app.cell
+def _(crossfilter_key, options, warmup):
+    crossfilter = warmup.result(crossfilter_key)
+    # The sliders snap to the edges of the histogram bins
+    brushes = mo.ui.dictionary(
+        {
+            _column: mo.ui.range_slider(
+                steps=crossfilter.edges(_column),
+                value=crossfilter.extent(_column),
+                label=_column,
+            )
+            for _column in options
+        }
+    )
+    return brushes, crossfilter
+
+
+@app.cell
+def _(brushes, crossfilter, profiler):
+    with profiler.stage("crossfilter (brush)", rows_in=len(crossfilter.df)) as _stage:
+        for _column, _bounds in brushes.value.items():
+            # A slider spanning every value is no filter at all
+            _full = tuple(_bounds) == crossfilter.extent(_column)
+            crossfilter.brush(_column, None if _full else _bounds)
+        _stage.rows_out = crossfilter.count
+    _charts = [
+        px.bar(
+            _histogram,
+            x="bin_start",
+            y="count",
+            color="in_brush",
+            title=_column,
+            height=250,
+        ).update_layout(showlegend=False)
+        for _column, _histogram in crossfilter.histograms().items()
+    ]
+    mo.vstack(
+        [
+            mo.md(f"**{crossfilter.count:,}** tracks within every range"),
+            mo.hstack(list(brushes.elements.values()), wrap=True),
+            mo.hstack(_charts, wrap=True, widths="equal"),
+        ]
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _():
+    mo.md(r"""
+    ## Classifying genres
+
+    Back to one of the open questions: can you classify a song's genre based on its attributes?
+    A simple baseline assigns each track to the genre whose average (standardized) attributes are the closest.
+    It is fitted on four out of five tracks, and checked on the fifth.
+    """)
+    return
+
+
+@app.cell
+def _(classifier_key, warmup):
+    classifier, _scores = warmup.result(classifier_key)
+    mo.vstack(
+        [
+            mo.md(
+                f"The closest genre is right for **{_scores['accuracy']:.1%}** of the {_scores['rows']:,} held out tracks, "
+                f"and one of the 5 closest for **{_scores['top_k_accuracy']:.1%}** of them "
+                f"(always guessing the most frequent genre: {_scores['baseline_accuracy']:.1%})."
+            ),
+            classifier.throughput(),
+        ]
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _():
+    mo.md(r"""
+    ## Incremental refresh
+
+    When new shards are added next to the `URL` files, refreshing only reads, cleans and aggregates the new ones.
+    The duration counts, genre means, artist rankings and collaboration counts are merged with the existing ones,
+    and only the genres of the new tracks are recomputed. The first refresh ingests every file.
+    """)
+    return
+
+
+@app.cell
+def _(STREAMING, URL, clean):
+    # Each batch is cleaned on its own, with the same steps as the rest of the notebook
+    incremental = eda.IncrementalTracks(URL, clean, streaming=STREAMING)
+    refresh_tracks = mo.ui.run_button(label="Refresh tracks")
+    return incremental, refresh_tracks
+
+
+@app.cell
+def _(UNIQUE_TRACKS, incremental, profiler, refresh_tracks):
+    if UNIQUE_TRACKS:
+        # Collapsing the listings of a track needs all of them, not only the ones of a batch
+        _output = mo.md(
+            "The incremental refresh works on the listings, set `UNIQUE_TRACKS = False` to use it."
+        )
+    elif refresh_tracks.value:
+        with profiler.stage("incremental refresh") as _stage:
+            _summary = incremental.refresh()
+            _stage.rows_out = _summary["rows"]
+        _output = mo.vstack(
+            [
+                refresh_tracks,
+                mo.md(
+                    f"Ingested {len(_summary['files'])} new files ({_summary['rows']:,} tracks) "
+                    f"in {len(_summary['genres'])} genres"
+                    + (", rebuilt after a file changed" if _summary["rebuilt"] else "")
+                    + f". {incremental.tracks.height:,} tracks in total."
+                ),
+                mo.hstack(
+                    [
+                        incremental.genre_means(),
+                        incremental.popular_artists.get().head(10)
+                        if incremental.popular_artists
+                        else None,
+                    ],
+                    widths="equal",
+                ),
+            ]
+        )
+    else:
+        _output = refresh_tracks
+    _output
+    return
+
+
+@app.cell(hide_code=True)
+def _():
+    mo.md(r"""
+    ## Profiling
+
+    Set `PROFILE = True` at the top of the notebook to record the wall time, rows in and out, peak memory and optimized query plan of each stage.
+    Interact with the notebook, then refresh the table below to find which cell or query is slow.
+    """)
+    return
+
+
+@app.cell
+def _():
+    refresh_profile = mo.ui.button(label="Refresh profile")
+    return (refresh_profile,)
+
+
+@app.cell
+def _(profiler, refresh_profile):
+    refresh_profile
+    if profiler.enabled:
+        _profile = mo.vstack(
+            [
+                refresh_profile,
+                profiler.summary(),
+                profiler.to_frame(),
+                mo.download(
+                    profiler.to_json().encode(),
+                    filename="profile.json",
+                    mimetype="application/json",
+                    label="Export as JSON",
+                ),
+            ]
+        )
+    else:
+        _profile = mo.md("Profiling is disabled")
+    _profile
+    return
+
+
+@app.cell
+def _(warmup):
+    # The last cell to run: how long the warm-up results took to be ready and how long the cells waited for them,
+    # also written as a JSON line to the server's standard error (e.g. the container logs) to track the startup time
+    warmup.mark("notebook")
+    _startup = warmup.log()
+    mo.md(
+        f"Startup: the notebook ran in {_startup['marks']['notebook']:.2f}s, "
+        f"waiting {sum(_startup['waited'].values()):.2f}s for the warm-up"
+    )
+    return
+
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,56 @@
+import polars as pl
+import pytest
+
+from ci_with_spotify import pipeline
+
+
+@pytest.fixture
+def raw_tracks() -> pl.DataFrame:
+    """A tiny stand-in for ``input/tracks.parquet`` with the same schema."""
+    n = 6
+    return pl.DataFrame(
+        {
+            "Unnamed: 0": list(range(n)),
+            "track_id": [f"id{i}" for i in range(n)],
+            "artists": ["A;B", "B", "A;B;C", "C", "D", "A"],
+            "album_name": ["x", "y", "z", "w", "v", "u"],
+            "track_name": ["Hello", "World", "Hello Again", "Bye", "Rude", "Yellow"],
+            "popularity": [80, 60, 40, 20, 90, 70],
+            "duration_ms": [200_500, 130_000, 361_000, 250_000, 180_000, 90_000],
+            "explicit": [False, False, False, False, True, False],
+            "danceability": [0.1, 0.2, 0.3, 0.4, 0.5, 0.6],
+            "energy": [0.6, 0.5, 0.4, 0.3, 0.2, 0.1],
+            "key": [0, 1, 2, 3, 4, 5],
+            "loudness": [-5.0, -6.0, -7.0, -8.0, -9.0, -10.0],
+            "mode": [1, 0, 1, 0, 1, 0],
+            "speechiness": [0.05] * n,
+            "acousticness": [0.5] * n,
+            "instrumentalness": [0.0] * n,
+            "liveness": [0.1] * n,
+            "valence": [0.3, 0.4, 0.5, 0.6, 0.7, 0.8],
+            "tempo": [120.0, 100.0, 90.0, 130.0, 140.0, 110.0],
+            "time_signature": [4] * n,
+            "track_genre": ["pop", "pop", "rock", "rock", "pop", "jazz"],
+        }
+    )
+
+
+@pytest.fixture
+def tracks_parquet(raw_tracks, tmp_path) -> str:
+    path = tmp_path / "tracks.parquet"
+    raw_tracks.write_parquet(path)
+    return str(path)
+
+
+@pytest.fixture
+def extra_tracks() -> pl.DataFrame | None:
+    """Raw rows added to ``raw_tracks`` by ``tracks``, overridden by some test modules."""
+    return None
+
+
+@pytest.fixture
+def tracks(raw_tracks, extra_tracks) -> pl.DataFrame:
+    """The cleaned ``raw_tracks``, and ``extra_tracks`` if any."""
+    if extra_tracks is not None:
+        raw_tracks = pl.concat([raw_tracks, extra_tracks])
+    return pipeline.clean_tracks(raw_tracks.lazy()).collect()
@@ -0,0 +1,55 @@
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.aggregations import PopularArtists
+from ci_with_spotify.cache import LRUCache
+
+
+@pytest.fixture
+def extra_tracks(raw_tracks) -> pl.DataFrame:
+    return raw_tracks.with_columns(
+        pl.lit("jazz").alias("track_genre"),
+        pl.col("track_name") + " (live)",
+        (pl.col("popularity") // 2),
+    )
+
+
+def _normalize(df: pl.DataFrame) -> pl.DataFrame:
+    return df.with_columns(
+        pl.col("track_name", "album_name").list.sort(),
+    ).sort("artists")
+
+
+@pytest.mark.parametrize("genre", [None, "pop", "rock", "jazz"])
+def test_matches_pipeline(tracks, genre):
+    popular = PopularArtists.build(tracks)
+    expected = pipeline.most_popular_artists(tracks.lazy(), genre).collect()
+    assert_frame_equal(
+        _normalize(popular.get(genre)),
+        _normalize(expected),
+        check_dtypes=False,
+    )
+
+
+def test_results_are_cached(tracks):
+    popular = PopularArtists.build(tracks)
+    assert popular.get("pop") is popular.get("pop")
+    assert popular.get() is popular.get(None)
+    assert popular.get("metal").is_empty()
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert len(cache) == 2
+
+    calls = []
+    assert cache.get_or_compute("d", lambda: calls.append("d") or 4) == 4
+    assert cache.get_or_compute("d", lambda: calls.append("d") or 5) == 4
+    assert calls == ["d"]
@@ -0,0 +1,168 @@
+import threading
+
+import numpy as np
+import polars as pl
+import pytest
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.approx import (
+    HyperLogLog,
+    Progressive,
+    QuantileSketch,
+    StratifiedSample,
+    approx_n_unique,
+    duration_summary,
+)
+from ci_with_spotify.synthetic import synthetic_tracks
+
+
+@pytest.fixture(scope="module")
+def tracks() -> pl.DataFrame:
+    return pipeline.clean_tracks(synthetic_tracks(50_000).lazy()).collect()
+
+
+def test_sample_keeps_every_genre(tracks):
+    sample = StratifiedSample.build(tracks, fraction=0.1, min_rows=20)
+    assert sample.population == tracks.height
+    assert 0.08 < sample.fraction < 0.12
+    counts = sample.sample.group_by("track_genre").len()
+    assert counts.height == tracks["track_genre"].n_unique()
+    assert counts["len"].min() >= 15
+    # The same tracks on every run, others with another seed
+    again = StratifiedSample.build(tracks.lazy(), fraction=0.1, min_rows=20)
+    assert again.sample.equals(sample.sample)
+    other = StratifiedSample.build(tracks, fraction=0.1, min_rows=20, seed=1)
+    assert not other.sample.equals(sample.sample)
+    # Genres smaller than `min_rows` are kept whole, with a weight of 1
+    whole = StratifiedSample.build(tracks, fraction=0.1, min_rows=tracks.height)
+    assert whole.sample.height == tracks.height
+    assert (whole.sample["sample_weight"] == 1).all()
+    with pytest.raises(ValueError):
+        StratifiedSample.build(tracks, fraction=0)
+
+
+def test_sample_estimates_are_within_their_bounds(tracks):
+    sample = StratifiedSample.build(tracks, fraction=0.1)
+    exact = pipeline.duration_counts(tracks.lazy()).collect()
+    estimate = sample.duration_counts()
+    assert estimate.columns == ["duration_seconds", "count", "count_error"]
+    assert estimate["count"].sum() == pytest.approx(tracks.height, rel=0.02)
+    joined = exact.join(estimate, on="duration_seconds", suffix="_estimate")
+    covered = (joined["count"] - joined["count_estimate"]).abs() <= joined[
+        "count_error"
+    ]
+    assert covered.mean() > 0.9
+
+    where = pipeline.duration_in_range(120, 360)
+    exact = pipeline.genre_means(pipeline.filter_duration(tracks.lazy(), 120, 360))
+    estimate = sample.genre_means(where)
+    joined = exact.collect().join(estimate, on="track_genre", suffix="_estimate")
+    assert joined.height == estimate.height == tracks["track_genre"].n_unique()
+    for column in ["duration_seconds", "popularity"]:
+        # The exact means are rounded to 2 decimals
+        error = (joined[column] - joined[f"{column}_estimate"]).abs()
+        assert (error <= joined[f"{column}_error"] + 0.01).mean() > 0.85
+
+
+def test_hyperloglog():
+    values = pl.Series(np.arange(100_000) % 30_000)
+    sketch = HyperLogLog().add(values)
+    assert sketch.estimate() == pytest.approx(30_000, rel=3 * sketch.relative_error)
+    low, high = sketch.bounds()
+    assert low < sketch.estimate() < high
+    assert high - low == pytest.approx(
+        2 * 1.96 * sketch.relative_error * sketch.estimate(), rel=1e-3
+    )
+    # Small counts are exact enough with linear counting
+    assert HyperLogLog().add(["a", "b", "c", None]).estimate() == pytest.approx(
+        3, abs=0.1
+    )
+    # Merging the sketches of two halves is the sketch of the whole
+    first = HyperLogLog().add(values[:50_000])
+    second = HyperLogLog().add(values[50_000:])
+    assert first.merge(second).estimate() == sketch.estimate()
+    with pytest.raises(ValueError):
+        sketch.merge(HyperLogLog(precision=10))
+    with pytest.raises(ValueError):
+        HyperLogLog(precision=2)
+
+
+def test_approx_n_unique(tracks):
+    artists = pipeline.explode_artists(tracks.lazy())
+    estimate = approx_n_unique(artists, "track_name", by="artists")
+    assert estimate.columns == ["artists", "n_unique", "n_unique_low", "n_unique_high"]
+    exact = artists.group_by("artists").agg(pl.col("track_name").n_unique()).collect()
+    joined = exact.join(estimate, on="artists")
+    assert joined.height == exact.height
+    covered = joined["track_name"].is_between(
+        joined["n_unique_low"], joined["n_unique_high"]
+    )
+    assert covered.mean() > 0.95
+
+    total = approx_n_unique(tracks, "track_name")
+    assert total["n_unique"].item() == pytest.approx(
+        HyperLogLog().add(tracks["track_name"]).estimate()
+    )
+    assert approx_n_unique(tracks.clear(), "track_name")["n_unique"].item() == 0
+
+
+def test_quantile_sketch():
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.lognormal(5, 1, 10_000), [0, 0, -3.5, -120]])
+    sketch = QuantileSketch(relative_accuracy=0.01).add(values)
+    for q in [0, 0.001, 0.01, 0.25, 0.5, 0.99, 1]:
+        exact = np.quantile(values, q, method="lower")
+        estimate, low, high = sketch.quantile(q)
+        assert low <= exact <= high
+        assert estimate == pytest.approx(exact, rel=0.01, abs=1e-9)
+    assert sketch.quantile(0)[0] == -120
+    assert sketch.quantile(1)[0] == values.max()
+
+    halves = (
+        QuantileSketch().add(values[:5000]).merge(QuantileSketch().add(values[5000:]))
+    )
+    assert halves.quantile(0.5) == sketch.quantile(0.5)
+    with pytest.raises(ValueError):
+        QuantileSketch().quantile(0.5)
+    with pytest.raises(ValueError):
+        sketch.quantile(1.5)
+
+
+def test_duration_summary(tracks):
+    summary = duration_summary(tracks.lazy())
+    assert summary.columns == ["quantile", "duration_seconds", "low", "high"]
+    durations = tracks["duration_seconds"].to_numpy()
+    for q, estimate, low, high in summary.iter_rows():
+        exact = np.quantile(durations, q, method="lower")
+        assert low <= exact <= high
+        assert estimate == pytest.approx(exact, rel=0.01)
+    assert duration_summary(tracks.clear()).is_empty()
+
+
+def test_progressive_switches_to_the_exact_result():
+    release = threading.Event()
+    seen = []
+
+    def exact():
+        release.wait(10)
+        return "exact"
+
+    progress = Progressive("estimate", exact, on_exact=seen.append)
+    assert progress.get() == ("estimate", False)
+    assert not progress.done
+    release.set()
+    assert progress.result(10) == "exact"
+    assert progress.get() == ("exact", True)
+    assert seen == ["exact"]
+
+    # Without an estimate, waits for the exact result
+    assert Progressive(None, lambda: 42).get() == (42, True)
+
+    def fail():
+        raise RuntimeError("boom")
+
+    failed = Progressive("estimate", fail)
+    with pytest.raises(RuntimeError):
+        failed.result(10)
+    with pytest.raises(RuntimeError):
+        failed.get()
@@ -0,0 +1,102 @@
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.aggregations import PopularArtists
+from ci_with_spotify.artists import ArtistModel
+from ci_with_spotify.collaborations import CollaborationIndex
+from ci_with_spotify.search import SearchIndex
+
+
+@pytest.fixture
+def extra_tracks(raw_tracks) -> pl.DataFrame:
+    return raw_tracks.head(3).with_columns(
+        pl.Series("Unnamed: 0", [6, 7, 8]),
+        # Distinct from the other tracks, so the most popular genre has no ties
+        pl.Series("popularity", [85, 65, 45]),
+        pl.Series("artists", ["B;A;B", "adele;Adele", None]),
+        pl.lit("jazz").alias("track_genre"),
+    )
+
+
+@pytest.fixture
+def artists(tracks) -> ArtistModel:
+    return ArtistModel.build(tracks)
+
+
+def test_dimension_and_bridge(tracks, artists):
+    assert artists.names.to_list() == ["A", "Adele", "B", "C", "adele"]
+    assert len(artists) == 5
+    # One entry per artist of each track, in the order of the tracks
+    assert artists.bridge["row_id"].to_list() == [0, 0, 1, 2, 2, 2, 3, 5, 6, 6, 6, 7, 7]
+    assert artists.bridge["artists"].cast(pl.String).to_list()[-5:] == [
+        "B",
+        "A",
+        "B",
+        "adele",
+        "Adele",
+    ]
+    assert artists.artist_id("B") == 2
+    assert artists.artist_id("Nobody") is None
+
+
+def test_complete(artists):
+    assert artists.complete("a") == ["A", "Adele", "adele"]
+    assert artists.complete("ADE") == ["Adele", "adele"]
+    assert artists.complete("ad", k=1) == ["Adele"]
+    assert artists.complete("z") == []
+    assert artists.complete("") == ["A", "Adele", "adele", "B", "C"]
+
+
+def test_explode_matches_split(tracks, artists):
+    lf = tracks.lazy().filter(pl.col("track_genre") != "rock")
+    expected = pipeline.explode_artists(lf).drop_nulls("artists").collect()
+    result = pipeline.explode_artists(lf, artists).collect()
+    assert_frame_equal(
+        result.with_columns(pl.col("artists").cast(pl.String)),
+        expected.select(result.columns),
+    )
+
+
+@pytest.mark.parametrize("genre", [None, "pop", "jazz", "metal"])
+def test_queries_match_split(tracks, artists, genre):
+    lf = tracks.drop_nulls("artists").lazy()
+    assert_frame_equal(
+        pipeline.most_popular_artists(lf, genre, artists).collect(),
+        pipeline.most_popular_artists(lf, genre).collect(),
+        check_row_order=False,
+    )
+    assert_frame_equal(
+        pipeline.artist_combinations(lf, genre, artists).collect(),
+        pipeline.artist_combinations(lf, genre).collect(),
+        check_row_order=False,
+    )
+
+
+@pytest.mark.parametrize(("artist", "track"), [("a", None), ("ad", "hello"), ("", "o")])
+def test_match_tracks_matches_split(tracks, artists, artist, track):
+    assert_frame_equal(
+        pipeline.match_tracks(tracks.lazy(), artist, track, artists).collect(),
+        pipeline.match_tracks(tracks.lazy(), artist, track).collect(),
+        check_row_order=False,
+    )
+
+
+def test_indexes_share_the_model(tracks, artists):
+    subset = tracks.filter(pl.col("duration_seconds") > 100)
+    # Splitting the names keeps a null artist, which has no entry in the bridge table
+    assert (
+        None not in PopularArtists.build(subset, artists=artists).get(None)["artists"]
+    )
+    subset = subset.drop_nulls("artists")
+    assert_frame_equal(
+        PopularArtists.build(subset, artists=artists).get(None),
+        PopularArtists.build(subset).get(None),
+    )
+    index = CollaborationIndex.build(subset, artists)
+    assert_frame_equal(index.pairs(), CollaborationIndex.build(subset).pairs())
+    assert_frame_equal(
+        SearchIndex.build(subset, artists).search(artist="adele"),
+        SearchIndex.build(subset).search(artist="adele"),
+    )
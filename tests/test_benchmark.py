@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from ci_with_spotify import benchmark
+
+
+def test_run_times_every_stage():
+    results = benchmark.run([2_000], repeats=1, log=None)
+    assert [r["stage"] for r in results["results"]] == list(benchmark.STAGES)
+    assert all(r["rows"] == 2_000 and r["seconds"] > 0 for r in results["results"])
+    assert results["metadata"]["polars"]
+    json.dumps(results)
+
+
+def test_run_rejects_unknown_stages():
+    with pytest.raises(ValueError, match="Unknown stages"):
+        benchmark.run([100], ["nope"], log=None)
+
+
+def _results(seconds: dict[str, float]) -> dict:
+    return {
+        "results": [
+            {"stage": stage, "rows": 100, "seconds": value}
+            for stage, value in seconds.items()
+        ]
+    }
+
+
+def test_compare():
+    baseline = _results({"a": 1.0, "b": 1.0, "c": 0.001})
+    results = _results({"a": 1.2, "b": 1.5, "c": 0.002, "new": 9.0})
+    regressions = benchmark.compare(results, baseline, tolerance=0.25)
+    assert [r["stage"] for r in regressions] == ["b"]
+    assert regressions[0]["ratio"] == pytest.approx(1.5)
+
+
+@pytest.mark.parametrize(
+    "size, rows", [("100k", 100_000), ("1M", 1_000_000), ("2.5k", 2_500), ("300", 300)]
+)
+def test_parse_size(size, rows):
+    assert benchmark.parse_size(size) == rows
+
+
+def test_main_flags_regressions(tmp_path, capsys):
+    baseline = tmp_path / "baseline.json"
+    args = ["--sizes", "1k", "--stages", "genre_scatter", "--repeats", "1"]
+    assert benchmark.main([*args, "--save-baseline", "--baseline", str(baseline)]) == 0
+    saved = json.loads(baseline.read_text())
+    assert saved["results"][0]["stage"] == "genre_scatter"
+
+    # A baseline no run can keep up with
+    saved["results"][0]["seconds"] = -1.0
+    baseline.write_text(json.dumps(saved))
+    assert benchmark.main([*args, "--baseline", str(baseline)]) == 1
+    assert "REGRESSION genre_scatter" in capsys.readouterr().out
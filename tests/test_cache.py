@@ -0,0 +1,96 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.cache import TracksCache, source_version
+
+
+def test_load_caches_cleaned_tracks(tracks_parquet, tmp_path):
+    cache = TracksCache(tmp_path / "cache")
+    expected = pipeline.clean_tracks(pl.scan_parquet(tracks_parquet)).collect()
+
+    first = cache.load(tracks_parquet)
+    path = cache.path(tracks_parquet)
+    assert path.exists()
+    mtime = path.stat().st_mtime_ns
+
+    second = cache.load(tracks_parquet)
+    assert path.stat().st_mtime_ns >= mtime
+    assert_frame_equal(first, expected)
+    assert_frame_equal(second, expected)
+
+
+def test_transform_change_invalidates(tracks_parquet, tmp_path):
+    cache = TracksCache(tmp_path / "cache")
+    cache.load(tracks_parquet)
+
+    def only_pop(lf: pl.LazyFrame) -> pl.LazyFrame:
+        return pipeline.clean_tracks(lf).filter(pl.col("track_genre") == "pop")
+
+    assert cache.key(tracks_parquet, only_pop) != cache.key(tracks_parquet)
+    assert cache.load(tracks_parquet, only_pop)["track_genre"].unique().to_list() == [
+        "pop"
+    ]
+
+
+def test_source_change_evicts_stale_entry(raw_tracks, tracks_parquet, tmp_path):
+    cache = TracksCache(tmp_path / "cache")
+    cache.load(tracks_parquet)
+    stale = cache.path(tracks_parquet)
+
+    raw_tracks.head(3).write_parquet(tracks_parquet)
+    assert cache.load(tracks_parquet).height == 3
+    assert not stale.exists()
+    assert len(list(cache.cache_dir.glob("*.arrow"))) == 1
+
+
+def test_source_version(raw_tracks, tracks_parquet, tmp_path):
+    version = source_version(tracks_parquet)
+    assert source_version(tracks_parquet) == version
+    assert source_version(tracks_parquet, lambda lf: lf) != version
+    raw_tracks.head(3).write_parquet(tracks_parquet)
+    assert source_version(tracks_parquet) != version
+    # Nothing is hashed or written next to the tracks
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["tracks.parquet"]
+
+
+def test_max_entries(raw_tracks, tmp_path):
+    cache = TracksCache(tmp_path / "cache", max_entries=2)
+    for i in range(3):
+        path = tmp_path / f"tracks{i}.parquet"
+        raw_tracks.write_parquet(path)
+        cache.load(path)
+    assert len(list(cache.cache_dir.glob("*.arrow"))) == 2
+
+    cache.clear()
+    assert list(cache.cache_dir.iterdir()) == []
+
+
+def test_concurrent_loads_write_their_own_temporary_files(
+    tracks_parquet, tmp_path, monkeypatch
+):
+    cache = TracksCache(tmp_path / "cache")
+    expected = pipeline.clean_tracks(pl.scan_parquet(tracks_parquet)).collect()
+    # Both threads are writing the same entry at once
+    both_writing = threading.Barrier(2, timeout=10)
+    targets = []
+    write_ipc = pl.DataFrame.write_ipc
+
+    def slow_write_ipc(df, target, **kwargs):
+        targets.append(target)
+        both_writing.wait()
+        return write_ipc(df, target, **kwargs)
+
+    monkeypatch.setattr(pl.DataFrame, "write_ipc", slow_write_ipc)
+    with ThreadPoolExecutor(2) as pool:
+        loaded = list(pool.map(lambda _: cache.load(tracks_parquet), range(2)))
+    assert len(set(targets)) == 2
+    for df in loaded:
+        assert_frame_equal(df, expected)
+    assert sorted(path.suffix for path in cache.cache_dir.iterdir()) == [
+        ".arrow",
+        ".json",
+    ]
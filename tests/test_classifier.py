@@ -0,0 +1,159 @@
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+import main
+from ci_with_spotify import pipeline
+from ci_with_spotify.classifier import GenreClassifier
+from ci_with_spotify.dedup import clean_unique_tracks
+from ci_with_spotify.ingest import write_partitioned
+from ci_with_spotify.synthetic import synthetic_tracks
+
+
+def brute_force(classifier, matrix):
+    """The squared distances of every track to every centroid, in float64."""
+    x = classifier.standardize(matrix).astype(np.float64)
+    return ((x[:, None, :] - classifier.centroids[None].astype(np.float64)) ** 2).sum(
+        axis=2
+    )
+
+
+def test_fit_computes_standardized_genre_means(tracks):
+    features = ["danceability", "tempo"]
+    classifier = GenreClassifier.fit(tracks.lazy(), features)
+    assert classifier.genres.to_list() == ["jazz", "pop", "rock"]
+    matrix = tracks.select(features).to_numpy()
+    np.testing.assert_allclose(classifier.mean, matrix.mean(axis=0))
+    np.testing.assert_allclose(classifier.scale, matrix.std(axis=0))
+    pop = tracks.filter(pl.col("track_genre") == "pop").select(features).to_numpy()
+    np.testing.assert_allclose(
+        classifier.centroids[1],
+        (pop.mean(axis=0) - classifier.mean) / classifier.scale,
+        rtol=1e-6,
+    )
+    assert classifier.stats["fit"]["rows"] == tracks.height
+    with pytest.raises(ValueError):
+        GenreClassifier.fit(tracks.clear())
+
+
+def test_nearest_matches_brute_force():
+    tracks = pipeline.clean_tracks(synthetic_tracks(20_000).lazy()).collect()
+    classifier = GenreClassifier.fit(tracks)
+    matrix = tracks.select(classifier.features).to_numpy()
+    expected = brute_force(classifier, matrix)
+    for k in [1, 5]:
+        indices, distances = classifier.nearest(matrix, k)
+        assert indices.shape == distances.shape == (len(matrix), k)
+        np.testing.assert_array_equal(indices, expected.argsort(axis=1)[:, :k])
+        np.testing.assert_allclose(
+            distances, np.sqrt(np.sort(expected, axis=1)[:, :k]), atol=1e-3
+        )
+
+
+def test_predict_and_evaluate(tracks):
+    classifier = GenreClassifier.fit(tracks)
+    predictions = classifier.predict(tracks, k=2)
+    assert predictions.columns == [
+        pipeline.ROW_ID,
+        "predicted_genre",
+        "distance",
+        "top_genres",
+    ]
+    assert predictions[pipeline.ROW_ID].to_list() == tracks[pipeline.ROW_ID].to_list()
+    assert (
+        predictions["top_genres"].list.first() == predictions["predicted_genre"]
+    ).all()
+    # Missing features count as the mean, rather than failing the batch
+    with_nulls = tracks.with_columns(pl.lit(None, dtype=pl.Float64).alias("tempo"))
+    assert classifier.predict(with_nulls)["distance"].is_finite().all()
+
+    scores = classifier.evaluate(tracks, k=3)
+    correct = predictions["predicted_genre"] == tracks["track_genre"]
+    assert scores["rows"] == tracks.height
+    assert scores["accuracy"] == pytest.approx(correct.mean())
+    assert scores["top_k_accuracy"] == 1.0  # every genre is among the 3 closest
+    # Always "pop", which ties with "rock" but comes first
+    assert scores["baseline_accuracy"] == pytest.approx(2 / 5)
+    # predict, with nulls and within evaluate
+    assert classifier.stats["score"]["rows"] == 3 * tracks.height
+
+
+def test_unique_tracks_count_towards_each_genre(raw_tracks):
+    listed_twice = pl.concat(
+        [raw_tracks, raw_tracks.head(1).with_columns(track_genre=pl.lit("jazz"))]
+    )
+    unique = clean_unique_tracks(listed_twice.lazy()).collect()
+    classifier = GenreClassifier.fit(unique)
+    listings = GenreClassifier.fit(pipeline.clean_tracks(listed_twice.lazy()))
+    np.testing.assert_allclose(classifier.centroids, listings.centroids, rtol=1e-6)
+    # The first track is right if it is predicted as any of its two genres
+    scores = classifier.evaluate(unique.head(1), k=2)
+    assert scores["top_k_accuracy"] == 1.0
+
+
+def test_score_shards_in_batches(raw_tracks, tracks, tmp_path):
+    for i in range(2):
+        raw_tracks.with_columns(pl.col("Unnamed: 0") + 10 * i).write_parquet(
+            tmp_path / f"shard-{i}.parquet"
+        )
+    classifier = GenreClassifier.fit(tracks)
+    summary = classifier.score_shards(
+        tmp_path / "shard-*.parquet", tmp_path / "out", batch_size=2
+    )
+    assert summary["rows"] == 2 * tracks.height
+    assert len(summary["files"]) >= 2
+    written = pl.read_parquet(tmp_path / "out" / "*.parquet").sort(pipeline.ROW_ID)
+    expected = classifier.predict(tracks)
+    # The distances may differ by float32 rounding, between batches of other sizes
+    assert_frame_equal(
+        written.filter(pl.col(pipeline.ROW_ID) < 10),
+        expected,
+        check_dtypes=False,
+        abs_tol=1e-2,
+    )
+    throughput = classifier.throughput()
+    assert throughput["stage"].to_list() == ["fit", "score"]
+    assert (throughput["rows_per_second"] > 0).all()
+
+
+def test_score_shards_of_a_partitioned_source(raw_tracks, tmp_path):
+    dump = synthetic_tracks(3_000)
+    dump.write_parquet(tmp_path / "dump.parquet")
+    write_partitioned(tmp_path / "dump.parquet", tmp_path / "partitioned")
+    classifier = GenreClassifier.fit(pipeline.clean_tracks(raw_tracks.lazy()))
+    summary = classifier.score_shards(
+        tmp_path / "partitioned", tmp_path / "out", batch_size=1_000
+    )
+    # Every shard is called 0.parquet, in its own partition
+    assert len(set(summary["files"])) == len(summary["files"]) > 1
+    assert all(Path(file).exists() for file in summary["files"])
+    written = pl.read_parquet(tmp_path / "out" / "**" / "*.parquet")
+    cleaned = pipeline.clean_tracks(dump.lazy()).collect()
+    assert summary["rows"] == written.height == cleaned.height
+    assert sorted(written[pipeline.ROW_ID]) == sorted(cleaned[pipeline.ROW_ID])
+
+
+def test_main_classify(tracks_parquet, tmp_path, capsys):
+    args = [
+        "classify",
+        tracks_parquet,
+        tracks_parquet,
+        "--output",
+        str(tmp_path / "out"),
+        "--cache-dir",
+        str(tmp_path / "cache"),
+        "--top",
+        "2",
+    ]
+    assert main.main(args) == 0
+    assert "rows/s" in capsys.readouterr().out
+    written = pl.read_parquet(tmp_path / "out" / "*.parquet")
+    assert written.columns == [
+        pipeline.ROW_ID,
+        "predicted_genre",
+        "distance",
+        "top_genres",
+    ]
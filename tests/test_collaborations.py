@@ -0,0 +1,55 @@
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.collaborations import CollaborationIndex
+
+
+@pytest.fixture
+def extra_tracks(raw_tracks) -> pl.DataFrame:
+    return raw_tracks.head(2).with_columns(
+        pl.Series("Unnamed: 0", [6, 7]),
+        pl.Series("artists", ["B;A;B", "E;D;C;A"]),
+        pl.lit("jazz").alias("track_genre"),
+    )
+
+
+@pytest.mark.parametrize("genre", [None, "pop", "rock", "jazz"])
+def test_pairs_match_explode(tracks, genre):
+    index = CollaborationIndex.build(tracks)
+    expected = pipeline.artist_combinations(tracks.lazy(), genre).collect()
+    assert_frame_equal(
+        index.pairs(genre),
+        expected,
+        check_row_order=False,
+        check_dtypes=False,
+    )
+
+
+def test_pairs_are_sorted_and_cached(tracks):
+    index = CollaborationIndex.build(tracks)
+    pairs = index.pairs()
+    assert pairs["count"].to_list() == sorted(pairs["count"].to_list(), reverse=True)
+    assert index.pairs() is pairs
+
+
+def test_unknown_genre(tracks):
+    index = CollaborationIndex.build(tracks)
+    assert index.pairs("metal").is_empty()
+    assert index.top_collaborators("A", genre="metal").is_empty()
+
+
+def test_top_collaborators(tracks):
+    index = CollaborationIndex.build(tracks)
+    top = index.top_collaborators("A", k=2)
+    assert top.rows() == [("B", 4), ("C", 2)]
+    assert index.top_collaborators("nobody").is_empty()
+
+
+def test_no_collaborations(raw_tracks):
+    solo = pipeline.clean_tracks(raw_tracks.lazy()).filter(
+        ~pl.col("artists").str.contains(";")
+    )
+    index = CollaborationIndex.build(solo)
+    assert index.pairs().is_empty()
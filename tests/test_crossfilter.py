@@ -0,0 +1,108 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.crossfilter import Crossfilter
+from ci_with_spotify.density import filter_ranges
+from ci_with_spotify.synthetic import synthetic_tracks
+
+COLUMNS = ["energy", "danceability", "tempo", "key"]
+
+
+@pytest.fixture
+def tracks() -> pl.DataFrame:
+    return pipeline.clean_tracks(synthetic_tracks(3_000, seed=2).lazy()).collect()
+
+
+def expected_histogram(cf: Crossfilter, tracks: pl.DataFrame, column: str):
+    """The histogram of a column over the rows within every other brush, by filtering."""
+    others = {c: bounds for c, bounds in cf.brushes.items() if c != column}
+    values = filter_ranges(tracks.lazy(), others).collect()[column].to_numpy()
+    edges = np.append(cf.histogram(column)["bin_start"], cf.extent(column)[1])
+    bins = (np.searchsorted(edges, values, side="right") - 1).clip(0, len(edges) - 2)
+    return np.bincount(bins, minlength=len(edges) - 1)
+
+
+def test_histograms_before_brushing(tracks):
+    cf = Crossfilter(tracks, COLUMNS, bins=20)
+    assert cf.count == tracks.height
+    assert cf.brushes == {}
+    energy = cf.histogram("energy")
+    assert energy.columns == ["bin_start", "bin_end", "count", "in_brush"]
+    assert energy.height == 20
+    assert energy["count"].sum() == tracks.height
+    assert energy["in_brush"].all()
+    # One bin per value of an integer column
+    assert cf.histogram("key")["bin_start"].to_list() == list(range(12))
+    assert cf.rows() is tracks
+
+
+def test_brushes_match_filtering(tracks):
+    cf = Crossfilter(tracks, COLUMNS, bins=20)
+    moves = [
+        ("energy", (0.2, 0.7)),
+        ("tempo", (140, 90)),
+        ("energy", (0.4, 0.9)),
+        ("key", (3, 5)),
+        ("energy", (0.95, 0.99)),
+        ("tempo", None),
+        ("energy", (0.0, 1.0)),
+    ]
+    for column, bounds in moves:
+        cf.brush(column, bounds)
+        expected = filter_ranges(tracks.lazy(), cf.brushes).collect()
+        assert cf.count == expected.height
+        assert (
+            cf.rows()[pipeline.ROW_ID].to_list() == expected[pipeline.ROW_ID].to_list()
+        )
+        for other in COLUMNS:
+            assert cf.histogram(other)["count"].to_list() == list(
+                expected_histogram(cf, tracks, other)
+            )
+    assert cf.brushes == {"energy": (0.0, 1.0), "key": (3, 5)}
+
+
+def test_in_brush_and_clear(tracks):
+    cf = Crossfilter(tracks, COLUMNS, bins=10)
+    cf.brush("energy", (0.25, 0.45))
+    in_brush = cf.histogram("energy").filter("in_brush")
+    assert in_brush["bin_start"].min() <= 0.25
+    assert in_brush["bin_end"].max() >= 0.45
+    # Its own brush does not change a column's histogram
+    assert cf.histogram("energy")["count"].sum() == tracks.height
+    cf.clear()
+    assert cf.count == tracks.height
+    assert cf.brushes == {}
+    assert cf.histogram("tempo")["count"].sum() == tracks.height
+
+
+def test_missing_values_are_outside_brushes():
+    df = pl.DataFrame({"a": [0.1, None, 0.5, 0.9], "b": [1, 2, 3, None]})
+    cf = Crossfilter(df, ["a", "b"], bins=4)
+    assert cf.histogram("a")["count"].sum() == 3
+    cf.brush("b", (1, 3))
+    assert cf.count == 3
+    assert cf.histogram("a")["count"].sum() == 2
+    cf.brush("a", (0, 1))
+    assert cf.rows()["a"].to_list() == [0.1, 0.5]
+
+
+def test_many_columns_and_bins(tracks):
+    # About 96,000 bins in total, numbered past the range of 16-bit integers
+    columns = [f"c{i}" for i in range(32)]
+    wide = pl.DataFrame(
+        {column: tracks["energy"] + i for i, column in enumerate(columns)}
+    )
+    cf = Crossfilter(wide, columns, bins=3_000)
+    cf.brush("c0", (0.2, 0.6))
+    cf.brush("c31", (31.1, 31.5))
+    for column in ["c0", "c15", "c31"]:
+        expected = expected_histogram(cf, wide, column)
+        assert cf.histogram(column)["count"].to_list() == expected.tolist()
+
+
+def test_rejects_too_many_columns():
+    df = pl.DataFrame({f"c{i}": [0.0] for i in range(33)})
+    with pytest.raises(ValueError, match="at most 32"):
+        Crossfilter(df, df.columns)
@@ -0,0 +1,149 @@
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.aggregations import PopularArtists
+from ci_with_spotify.artists import ArtistModel
+from ci_with_spotify.cache import TracksCache
+from ci_with_spotify.collaborations import CollaborationIndex
+from ci_with_spotify.dedup import (
+    TRACK_KEY,
+    clean_unique_tracks,
+    duplicate_summary,
+    unique_tracks,
+    with_track_key,
+)
+from ci_with_spotify.schema import compact_tracks
+
+
+@pytest.fixture
+def raw_listings(raw_tracks) -> pl.DataFrame:
+    """The tracks, with "Hello" also listed under rock and "Hello Again" under jazz."""
+    extra = raw_tracks[[0, 2, 2]].with_columns(
+        pl.Series("Unnamed: 0", [6, 7, 8]),
+        pl.Series("track_genre", ["rock", "jazz", "pop"]),
+    )
+    return pl.concat([raw_tracks, extra])
+
+
+@pytest.fixture
+def listings(raw_listings) -> pl.DataFrame:
+    return pipeline.clean_tracks(with_track_key(raw_listings.lazy())).collect()
+
+
+@pytest.fixture
+def unique(listings) -> pl.DataFrame:
+    return unique_tracks(listings.lazy()).collect()
+
+
+def test_with_track_key_falls_back_without_id(raw_listings):
+    keyed = with_track_key(raw_listings.lazy()).collect()
+    assert keyed[TRACK_KEY].dtype == pl.UInt64
+    assert keyed[TRACK_KEY].n_unique() == 6
+    # The name, artists and duration identify the tracks missing their ID
+    missing = raw_listings.with_columns(
+        pl.when(pl.col("Unnamed: 0") == 6)
+        .then(None)
+        .otherwise("track_id")
+        .alias("track_id")
+    )
+    missing_keys = with_track_key(missing.lazy()).collect()[TRACK_KEY]
+    dropped = with_track_key(raw_listings.drop("track_id").lazy()).collect()[TRACK_KEY]
+    assert missing_keys[6] == dropped[0] == dropped[6]
+    assert missing_keys[0] != missing_keys[6]
+
+
+def test_unique_tracks(unique):
+    assert unique[pipeline.ROW_ID].to_list() == [0, 1, 2, 3, 5]
+    # The first listing is kept as the primary genre
+    assert unique["track_genre"].to_list() == ["pop", "pop", "rock", "rock", "jazz"]
+    genres = unique["genres"].cast(pl.List(pl.String)).to_list()
+    assert genres == [
+        ["pop", "rock"],
+        ["pop"],
+        ["rock", "jazz", "pop"],
+        ["rock"],
+        ["jazz"],
+    ]
+    assert unique["listings"].to_list() == [2, 1, 3, 1, 1]
+
+
+def test_duplicate_summary(listings):
+    assert duplicate_summary(listings) == {
+        "listings": 8,
+        "unique_tracks": 5,
+        "duplicated_tracks": 2,
+        "ratio": 1.6,
+    }
+
+
+def test_pipeline_on_unique_tracks(listings, unique):
+    lf = unique.lazy()
+    rock = pipeline.filter_genre(lf, "rock").collect()
+    assert rock["track_name"].to_list() == ["Hello", "Hello Again", "Bye"]
+    assert rock["track_genre"].to_list() == ["rock"] * 3
+    assert pipeline.filter_genre(lf, "metal").collect().is_empty()
+    assert pipeline.genres(lf) == pipeline.genres(listings.lazy())
+    # The same listings, under the row ID of the first listing of each track
+    columns = [name for name in listings.columns if name != pipeline.ROW_ID]
+    assert_frame_equal(
+        pipeline.genre_listings(lf).collect().select(columns),
+        listings.select(columns),
+        check_row_order=False,
+    )
+    assert_frame_equal(
+        pipeline.genre_means(lf).collect(),
+        pipeline.genre_means(listings.lazy()).collect(),
+    )
+    # A track is counted once over all genres
+    counts = pipeline.duration_counts(lf).collect()
+    assert counts["count"].sum() == 5
+
+
+def test_popular_artists_on_unique_tracks(listings, unique):
+    popular = PopularArtists.build(unique, artists=ArtistModel.build(unique))
+    per_listing = PopularArtists.build(listings)
+    for genre in ["pop", "rock", "jazz"]:
+        assert_frame_equal(popular.get(genre), per_listing.get(genre))
+    expected = pipeline.most_popular_artists(unique.lazy()).collect()
+    everything = popular.get(None)
+    assert everything["artists"].to_list() == expected["artists"].to_list()
+    assert everything["tracks_count"].to_list() == expected["tracks_count"].to_list()
+    # "A" has 3 tracks, "Hello" being listed twice and "Hello Again" three times
+    a = everything.filter(pl.col("artists") == "A").row(0, named=True)
+    assert a["popularity"] == pytest.approx((0.8 + 0.7 + 0.4) / 3)
+
+
+def test_collaborations_on_unique_tracks(listings, unique):
+    index = CollaborationIndex.build(unique)
+    per_listing = CollaborationIndex.build(listings)
+    for genre in ["pop", "rock", "jazz"]:
+        assert_frame_equal(index.pairs(genre), per_listing.pairs(genre))
+    everything = index.pairs().sort("artists", "other_artist")
+    assert everything.rows() == [("B", "A", 2), ("C", "A", 1), ("C", "B", 1)]
+    # Per listing, "Hello Again" counts once for each of its 3 genres
+    c = per_listing.pairs().filter(pl.col("artists") == "C")
+    assert c["count"].to_list() == [3, 3]
+
+
+def test_unique_compact_tracks(raw_listings, unique):
+    compact = unique_tracks(
+        compact_tracks(
+            pipeline.clean_tracks(with_track_key(raw_listings.lazy())),
+            genres=["jazz", "pop", "rock"],
+        )
+    )
+    assert pipeline.filter_genre(compact, "metal").collect().is_empty()
+    jazz = pipeline.filter_genre(compact, "jazz").collect()
+    assert jazz[pipeline.ROW_ID].to_list() == [2, 5]
+    assert jazz.schema["track_genre"] == pl.Enum(["jazz", "pop", "rock"])
+
+
+def test_clean_unique_tracks_cache(raw_listings, tmp_path, unique):
+    source = tmp_path / "tracks.parquet"
+    raw_listings.write_parquet(source)
+    cache = TracksCache(tmp_path / "cache")
+    loaded = cache.load(source, clean_unique_tracks)
+    assert_frame_equal(loaded, unique)
+    assert cache.load(source, clean_unique_tracks).height == 5
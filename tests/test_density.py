@@ -0,0 +1,80 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from ci_with_spotify.density import density_grid, filter_ranges, scatter_frame
+
+
+@pytest.fixture
+def points() -> pl.DataFrame:
+    rng = np.random.default_rng(0)
+    n = 10_000
+    return pl.DataFrame(
+        {
+            "energy": rng.random(n),
+            "danceability": rng.random(n),
+            "loudness": rng.normal(-8, 3, n),
+        }
+    )
+
+
+def test_density_grid_counts(points):
+    grid = density_grid(points, "energy", "danceability", "loudness", bins=10)
+    assert grid["count"].sum() == points.height
+    assert grid.height <= 100
+    expected, _, _ = np.histogram2d(
+        points["energy"].to_numpy(), points["danceability"].to_numpy(), bins=10
+    )
+    assert sorted(grid["count"].to_list()) == sorted(expected[expected > 0].astype(int))
+
+
+def test_density_grid_color_means():
+    df = pl.DataFrame(
+        {
+            "x": [0.0, 0.1, 1.0, 1.0],
+            "y": [0.0, 0.0, 1.0, 1.0],
+            "c": [1.0, 3.0, 5.0, None],
+        }
+    )
+    grid = density_grid(df, "x", "y", "c", bins=2).sort("x")
+    assert grid["count"].to_list() == [2, 2]
+    assert grid["c_mean"].to_list() == [2.0, 5.0]
+    assert grid["x"].to_list() == [0.25, 0.75]
+
+
+def test_density_grid_color_on_an_axis():
+    df = pl.DataFrame({"x": [0.0, 0.1, 1.0], "y": [0.0, 0.0, 1.0]})
+    grid = density_grid(df, "x", "y", "x", bins=2).sort("x")
+    # The cell centres are kept, next to the mean of the rows in each cell
+    assert grid["x"].to_list() == [0.25, 0.75]
+    assert grid["x_mean"].to_list() == pytest.approx([0.05, 1.0])
+    assert grid.columns == ["x", "y", "count", "x_mean"]
+
+
+def test_density_grid_constant_and_null_values():
+    df = pl.DataFrame({"x": [1.0, 1.0, None], "y": [2.0, 2.0, 3.0]})
+    grid = density_grid(df, "x", "y", bins=4)
+    assert grid["count"].to_list() == [2]
+
+
+def test_filter_ranges(points):
+    ranges = {"energy": [0.5, 0.2], "danceability": [0.0, 0.5]}
+    result = filter_ranges(points.lazy(), ranges).collect()
+    assert result["energy"].is_between(0.2, 0.5).all()
+    assert result["danceability"].le(0.5).all()
+    assert filter_ranges(points.lazy(), {}).collect().height == points.height
+
+
+def test_scatter_frame_modes(points):
+    raw, binned = scatter_frame(points, "energy", "danceability", threshold=20_000)
+    assert not binned and raw.height == points.height
+
+    grid, binned = scatter_frame(points, "energy", "danceability", threshold=1_000)
+    assert binned and grid["count"].sum() == points.height
+
+    ranges = {"energy": [0.0, 0.5]}
+    zoomed, binned = scatter_frame(
+        points, "energy", "danceability", ranges=ranges, threshold=1_000
+    )
+    assert not binned and zoomed.height == 1_000
+    assert zoomed["energy"].le(0.5).all()
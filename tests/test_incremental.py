@@ -0,0 +1,183 @@
+import os
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.aggregations import PopularArtists
+from ci_with_spotify.collaborations import CollaborationIndex
+from ci_with_spotify.dedup import clean_unique_tracks
+from ci_with_spotify.incremental import IncrementalTracks
+from ci_with_spotify.synthetic import synthetic_tracks
+
+
+@pytest.fixture(scope="module")
+def raw() -> pl.DataFrame:
+    return synthetic_tracks(2_000, seed=3)
+
+
+def _normalize(df: pl.DataFrame) -> pl.DataFrame:
+    return df.with_columns(pl.col("track_name", "album_name").list.sort()).sort(
+        "artists"
+    )
+
+
+def _assert_same_aggregates(tracks: pl.DataFrame, popular, collaborations) -> None:
+    expected_popular = PopularArtists.build(tracks)
+    expected_collaborations = CollaborationIndex.build(tracks)
+    genres = [None, *expected_popular.rows]
+    for genre in genres:
+        assert_frame_equal(
+            _normalize(popular.get(genre)),
+            _normalize(expected_popular.get(genre)),
+            check_dtypes=False,
+        )
+        assert_frame_equal(
+            collaborations.pairs(genre),
+            expected_collaborations.pairs(genre),
+            check_row_order=False,
+            check_dtypes=False,
+        )
+
+
+@pytest.mark.parametrize("transform", [pipeline.clean_tracks, clean_unique_tracks])
+def test_updates_match_a_full_build(raw, transform):
+    tracks = transform(raw.lazy()).collect()
+    old, new = tracks.head(1_500), tracks.tail(tracks.height - 1_500)
+    if pipeline.is_unique_view(tracks):
+        # A track is in a single batch, whatever the genres it is listed under
+        old = tracks.filter(pl.col("track_key").is_in(old["track_key"].implode()))
+        new = tracks.filter(~pl.col("track_key").is_in(old["track_key"].implode()))
+    popular = PopularArtists.build(old)
+    collaborations = CollaborationIndex.build(old)
+    # Cached before the update
+    popular.get("pop")
+    collaborations.pairs("pop")
+    # In a few batches, so the superseded rows are compacted along the way
+    for batch in new.iter_slices(150):
+        touched = popular.update(batch)
+        assert touched == pipeline.genres(batch.lazy())
+        # Only the genres with collaborations in the batch
+        assert set(collaborations.update(batch)) <= set(touched)
+    _assert_same_aggregates(pl.concat([old, new]), popular, collaborations)
+
+
+def test_popular_artists_compacts_superseded_rows(raw_tracks):
+    tracks = pipeline.clean_tracks(raw_tracks.lazy()).collect()
+    pop = tracks.filter(pl.col("track_genre") == "pop")
+    popular = PopularArtists.build(tracks)
+    heights = []
+    for _ in range(4):
+        popular.update(pop)
+        heights.append(popular.grouped.height)
+    # The pop groups are appended again on every update, until they are compacted
+    assert max(heights) > tracks.height
+    live = sum(rows.len() for rows in popular.rows.values())
+    assert popular.grouped.height <= 2 * live
+    assert popular.artist_state.height <= 2 * len(popular._artist_rows)
+    expected = PopularArtists.build(pl.concat([tracks, *[pop] * 4]))
+    for genre in [None, "pop", "rock"]:
+        assert_frame_equal(
+            _normalize(popular.get(genre)),
+            _normalize(expected.get(genre)),
+            check_dtypes=False,
+        )
+
+
+def test_collaborations_relabel_new_artists(raw_tracks):
+    tracks = pipeline.clean_tracks(raw_tracks.lazy()).collect()
+    index = CollaborationIndex.build(tracks.head(2))
+    index.pairs()
+    index.update(tracks.tail(tracks.height - 2))
+    expected = CollaborationIndex.build(tracks)
+    assert index.artists.to_list() == expected.artists.to_list()
+    assert_frame_equal(
+        index.pairs(), expected.pairs(), check_row_order=False, check_dtypes=False
+    )
+
+
+@pytest.fixture
+def shards(raw, tmp_path):
+    directory = tmp_path / "shards"
+    directory.mkdir()
+    for i, shard in enumerate(raw.head(1_200).iter_slices(400)):
+        shard.write_parquet(directory / f"part-{i}.parquet")
+    return directory
+
+
+def test_refresh_only_ingests_new_files(raw, shards):
+    tracks = IncrementalTracks(shards)
+    first = tracks.refresh()
+    assert len(first["files"]) == 3
+    assert not first["rebuilt"]
+    assert tracks.refresh() == {"files": [], "rows": 0, "genres": [], "rebuilt": False}
+
+    batch = raw.slice(1_200, 200)
+    batch.write_parquet(shards / "part-3.parquet")
+    second = tracks.refresh()
+    assert second["files"] == [str(shards / "part-3.parquet")]
+    cleaned = pipeline.clean_tracks(batch.lazy()).collect()
+    assert second["rows"] == cleaned.height
+    assert second["genres"] == pipeline.genres(cleaned.lazy())
+    assert len(tracks.manifest) == 4
+
+    expected = pipeline.clean_tracks(raw.head(1_400).lazy()).collect()
+    assert_frame_equal(tracks.tracks, expected)
+    assert_frame_equal(
+        tracks.duration_counts(),
+        pipeline.duration_counts(expected.lazy()).collect().sort("duration_seconds"),
+        check_dtypes=False,
+    )
+    assert_frame_equal(
+        tracks.genre_means(),
+        pipeline.genre_means(expected.lazy()).collect(),
+        check_dtypes=False,
+    )
+    _assert_same_aggregates(expected, tracks.popular_artists, tracks.collaborations)
+
+
+def test_changed_file_rebuilds(raw, shards):
+    tracks = IncrementalTracks(shards)
+    tracks.refresh()
+    path = shards / "part-0.parquet"
+    raw.head(100).write_parquet(path)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    result = tracks.refresh()
+    assert result["rebuilt"]
+    assert len(result["files"]) == 3
+    expected = pipeline.clean_tracks(
+        pl.concat([raw.head(100), raw.slice(400, 800)]).lazy()
+    ).collect()
+    assert_frame_equal(tracks.tracks.sort(pipeline.ROW_ID), expected)
+
+
+def test_refresh_numbers_new_batches_after_the_ingested_rows(raw, shards):
+    tracks = IncrementalTracks(shards)
+    tracks.refresh()
+    ingested = tracks.tracks[pipeline.ROW_ID].max()
+    # A batch exported on its own, counting from 0 again
+    batch = raw.slice(1_200, 200).with_columns(
+        pl.int_range(200, dtype=pl.Int64).alias("Unnamed: 0")
+    )
+    batch.write_parquet(shards / "part-3.parquet")
+    assert tracks.refresh()["rows"] > 0
+    row_ids = tracks.tracks[pipeline.ROW_ID]
+    assert row_ids.is_unique().all()
+    new = tracks.tracks.filter(pl.col(pipeline.ROW_ID) > ingested)
+    expected = pipeline.clean_tracks(batch.lazy()).collect()
+    assert_frame_equal(
+        new.drop(pipeline.ROW_ID), expected.drop(pipeline.ROW_ID), check_dtypes=False
+    )
+    assert new[pipeline.ROW_ID].to_list() == [
+        row_id + ingested + 1 for row_id in expected[pipeline.ROW_ID]
+    ]
+
+
+def test_refresh_rejects_transforms_that_are_not_row_by_row(shards):
+    tracks = IncrementalTracks(shards, clean_unique_tracks)
+    with pytest.raises(ValueError, match="row by row"):
+        tracks.refresh()
+    # Nothing was ingested
+    assert not tracks.manifest
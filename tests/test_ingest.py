@@ -0,0 +1,148 @@
+import math
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+import main
+from ci_with_spotify import pipeline
+from ci_with_spotify.cache import TracksCache
+from ci_with_spotify.ingest import partition_values, shard_paths, write_partitioned
+
+
+@pytest.fixture
+def shards(raw_tracks, tmp_path):
+    directory = tmp_path / "shards"
+    directory.mkdir()
+    for i, shard in enumerate(raw_tracks.iter_slices(2)):
+        shard.write_parquet(directory / f"part-{i}.parquet")
+    return directory
+
+
+def test_shard_paths(shards, tracks_parquet):
+    expected = [shards / f"part-{i}.parquet" for i in range(3)]
+    assert shard_paths(shards) == expected
+    assert shard_paths(shards / "*.parquet") == expected
+    assert [str(path) for path in shard_paths(tracks_parquet)] == [tracks_parquet]
+    with pytest.raises(FileNotFoundError):
+        shard_paths(shards / "missing.parquet")
+
+
+def test_scan_shards(raw_tracks, shards):
+    for source in [shards, str(shards / "*.parquet")]:
+        assert_frame_equal(
+            pipeline.scan_tracks(source).collect().sort("Unnamed: 0"), raw_tracks
+        )
+
+
+def test_scan_renumbers_overlapping_shards(raw_tracks, tmp_path):
+    # Batches exported separately, each counting from 0
+    for i, shard in enumerate(raw_tracks.iter_slices(3)):
+        shard.with_columns(
+            pl.int_range(3, dtype=pl.Int64).alias("Unnamed: 0")
+        ).write_parquet(tmp_path / f"batch-{i}.parquet")
+    source = tmp_path / "batch-*.parquet"
+    offsets = pipeline.row_id_offsets(source)
+    assert list(offsets.values()) == [0, 3]
+    assert_frame_equal(pipeline.scan_tracks(source).collect(), raw_tracks)
+    cleaned = TracksCache(tmp_path / "cache").load(source)
+    assert cleaned[pipeline.ROW_ID].is_unique().all()
+
+    raw_tracks.with_columns(pl.lit(0, pl.Int64).alias("Unnamed: 0")).write_parquet(
+        tmp_path / "batch-2.parquet"
+    )
+    with pytest.raises(ValueError, match="not unique"):
+        pipeline.scan_tracks(source)
+
+
+def test_row_id_offsets_are_read_once_per_version_of_the_files(
+    raw_tracks, tmp_path, monkeypatch
+):
+    for i, shard in enumerate(raw_tracks.iter_slices(3)):
+        shard.with_columns(
+            pl.int_range(3, dtype=pl.Int64).alias("Unnamed: 0")
+        ).write_parquet(tmp_path / f"batch-{i}.parquet")
+    source = tmp_path / "batch-*.parquet"
+    reads = []
+    collect_all = pl.collect_all
+
+    def counting_collect_all(*args, **kwargs):
+        reads.append(1)
+        return collect_all(*args, **kwargs)
+
+    monkeypatch.setattr(pl, "collect_all", counting_collect_all)
+    for _ in range(3):
+        pipeline.scan_tracks(source)
+    assert len(reads) == 1
+    assert list(pipeline.row_id_offsets(source).values()) == [0, 3]
+
+    # Another version of the files is read again
+    raw_tracks.head(2).with_columns(
+        pl.int_range(2, dtype=pl.Int64).alias("Unnamed: 0")
+    ).write_parquet(tmp_path / "batch-2.parquet")
+    assert list(pipeline.row_id_offsets(source).values()) == [0, 3, 6]
+    assert len(reads) == 2
+
+
+def test_write_partitioned(raw_tracks, tracks_parquet, tmp_path):
+    target = tmp_path / "partitioned"
+    assert write_partitioned(tracks_parquet, target) == ["jazz", "pop", "rock"]
+    assert partition_values(target) == ["jazz", "pop", "rock"]
+    assert partition_values(tracks_parquet) == []
+    assert_frame_equal(
+        pipeline.scan_tracks(target).collect().sort("Unnamed: 0"),
+        raw_tracks,
+        check_column_order=False,
+    )
+    with pytest.raises(FileExistsError):
+        write_partitioned(tracks_parquet, target)
+    # Rewriting a partitioned directory in place
+    write_partitioned(target, target, overwrite=True)
+    assert partition_values(target) == ["jazz", "pop", "rock"]
+
+
+def test_genre_filter_only_reads_its_partition(tracks_parquet, tmp_path):
+    target = tmp_path / "partitioned"
+    write_partitioned(tracks_parquet, target)
+    query = pipeline.filter_genre(
+        pipeline.clean_tracks(pipeline.scan_tracks(target)), "rock"
+    )
+    plan = query.explain()
+    assert "track_genre=rock" in plan
+    assert "track_genre=pop" not in plan
+    assert query.collect()["track_genre"].unique().to_list() == ["rock"]
+
+
+@pytest.mark.parametrize(
+    "bounds",
+    [(130, 250), (130.5, 250.5), (0, 200.999), (-math.inf, 200), (0, math.inf)],
+)
+def test_filter_duration_pushes_down_duration_ms(raw_tracks, bounds):
+    tracks = pipeline.clean_tracks(raw_tracks.lazy())
+    expected = tracks.filter(pipeline.duration_in_range(*bounds)).collect()
+    assert_frame_equal(pipeline.filter_duration(tracks, *bounds).collect(), expected)
+    # Without the source column, only the derived one is filtered
+    seconds_only = tracks.drop("duration_ms")
+    assert_frame_equal(
+        pipeline.filter_duration(seconds_only, *bounds).collect(),
+        expected.drop("duration_ms"),
+    )
+
+
+def test_cache_of_shards(raw_tracks, shards, tmp_path):
+    cache = TracksCache(tmp_path / "cache")
+    df = cache.load(shards)
+    assert df.height == raw_tracks.filter(~pl.col("explicit")).height
+    key = cache.key(shards)
+    assert cache.key(shards) == key
+
+    raw_tracks.head(1).write_parquet(shards / "part-0.parquet")
+    assert cache.key(shards) != key
+    assert cache.load(shards).height == df.height - 1
+
+
+def test_main_partition(tracks_parquet, tmp_path, capsys):
+    target = tmp_path / "partitioned"
+    assert main.main(["partition", tracks_parquet, str(target)]) == 0
+    assert "3 genre partitions" in capsys.readouterr().out
+    assert partition_values(target) == ["jazz", "pop", "rock"]
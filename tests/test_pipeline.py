@@ -0,0 +1,55 @@
+import polars as pl
+import pytest
+
+from ci_with_spotify import pipeline
+
+
+@pytest.fixture
+def tracks(tracks_parquet) -> pl.LazyFrame:
+    return pipeline.clean_tracks(pipeline.scan_tracks(tracks_parquet))
+
+
+def test_clean_tracks(tracks):
+    df = tracks.collect()
+    assert "explicit" not in df.columns
+    assert "track_id" not in df.columns
+    assert df.height == 5
+    assert df["duration_seconds"].to_list() == [200, 130, 361, 250, 90]
+    assert df["popularity"].max() == pytest.approx(0.8)
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_collect_engines_agree(tracks, streaming):
+    result = pipeline.collect(
+        pipeline.genre_means(pipeline.filter_duration(tracks, 120, 360)),
+        streaming=streaming,
+    )
+    assert result["track_genre"].to_list() == ["rock", "pop"]
+    assert result.filter(pl.col("track_genre") == "pop")["popularity"].item() == 0.7
+
+
+def test_most_popular_artists(tracks):
+    result = pipeline.most_popular_artists(tracks).collect()
+    assert result["artists"].to_list()[0] == "A"
+    assert result.filter(pl.col("artists") == "B")["tracks_count"].item() == 3
+
+    rock = pipeline.most_popular_artists(tracks, genre="rock").collect()
+    assert sorted(rock["artists"].to_list()) == ["A", "B", "C"]
+
+
+def test_artist_combinations(tracks):
+    result = pipeline.artist_combinations(tracks).collect()
+    counts = {(r["artists"], r["other_artist"]): r["count"] for r in result.to_dicts()}
+    assert counts == {("B", "A"): 2, ("C", "A"): 1, ("C", "B"): 1}
+
+
+def test_match_tracks(tracks):
+    result = pipeline.match_tracks(tracks, track="hello").collect()
+    assert result["track_name"].to_list() == ["Hello", "Hello Again"]
+    assert pipeline.match_tracks(tracks).collect().is_empty()
+
+
+def test_score_match_text_is_literal():
+    df = pl.DataFrame({"name": ["a.c", "abc"]})
+    scores = df.select(pipeline.score_match_text(pl.col("name"), "A.")).to_series()
+    assert scores.to_list() == [97, -3]
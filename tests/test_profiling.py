@@ -0,0 +1,77 @@
+import json
+
+import polars as pl
+import pytest
+
+from ci_with_spotify.profiling import RECORD_SCHEMA, Profiler
+
+
+@pytest.fixture
+def tracks() -> pl.DataFrame:
+    return pl.DataFrame(
+        {"track_genre": ["pop", "rock", "pop"], "popularity": [1, 2, 3]}
+    )
+
+
+def test_disabled_profiler_records_nothing(tracks):
+    profiler = Profiler()
+    with profiler.stage("stage") as stage:
+        stage.rows_out = 3
+        stage.query = tracks.lazy()
+    assert stage.rows_out is None
+    assert profiler.collect("query", tracks.lazy()).equals(tracks)
+    assert profiler.records == []
+    assert profiler.to_frame().schema == pl.Schema(RECORD_SCHEMA)
+
+
+def test_stage(tracks):
+    profiler = Profiler(enabled=True)
+    with profiler.stage("stage", rows_in=3) as stage:
+        stage.rows_out = 2
+    [record] = profiler.records
+    assert record["stage"] == "stage"
+    assert record["seconds"] >= 0
+    assert (record["rows_in"], record["rows_out"]) == (3, 2)
+    assert record["peak_rss_mb"] > 0
+    assert record["peak_growth_mb"] >= 0
+    assert record["plan"] is None
+
+
+def test_stage_is_recorded_on_errors():
+    profiler = Profiler(enabled=True)
+    with pytest.raises(ValueError, match="boom"), profiler.stage("failing"):
+        raise ValueError("boom")
+    assert profiler.to_frame()["stage"].to_list() == ["failing"]
+
+
+def test_a_plan_that_fails_does_not_mask_the_error():
+    profiler = Profiler(enabled=True)
+    lf = pl.LazyFrame({"a": [1]}).select(pl.col("missing"))
+    with pytest.raises(ValueError, match="boom"), profiler.stage("failing") as stage:
+        stage.query = lf
+        raise ValueError("boom")
+    [record] = profiler.records
+    assert record["plan"] is None
+
+
+def test_collect_records_the_plan(tracks):
+    profiler = Profiler(enabled=True)
+    lf = tracks.lazy().group_by("track_genre").agg(pl.col("popularity").sum())
+    result = profiler.collect("sum", lf, rows_in=tracks.height)
+    assert result.height == 2
+    [record] = profiler.records
+    assert record["rows_out"] == 2
+    assert "AGGREGATE" in record["plan"]
+
+
+def test_export(tracks, tmp_path):
+    profiler = Profiler(enabled=True)
+    for _ in range(2):
+        profiler.collect("a", tracks.lazy())
+    profiler.collect("b", tracks.lazy())
+    assert profiler.summary().filter(pl.col("stage") == "a")["runs"].item() == 2
+    path = tmp_path / "profile.json"
+    document = profiler.to_json(path)
+    assert json.loads(path.read_text()) == json.loads(document) == profiler.records
+    profiler.clear()
+    assert profiler.to_frame().is_empty()
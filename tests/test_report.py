@@ -0,0 +1,72 @@
+import json
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+import main
+from ci_with_spotify import pipeline
+from ci_with_spotify.report import TABLES, build_report, genre_report
+
+
+def test_genre_report(raw_tracks):
+    tracks = pipeline.clean_tracks(raw_tracks.lazy()).collect()
+    pop = tracks.filter(pl.col("track_genre") == "pop")
+    report = genre_report(pop, top=1)
+    assert set(report) == set(TABLES)
+    assert report["durations"]["count"].sum() == pop.height
+    assert report["means"].columns == ["duration_seconds", "popularity"]
+    assert report["top_artists"]["artists"].to_list() == ["A"]
+    assert report["collaborations"].to_dicts() == [
+        {"artists": "B", "other_artist": "A", "count": 1}
+    ]
+
+
+@pytest.fixture
+def serial_report(tracks_parquet, tmp_path) -> dict:
+    return build_report(
+        tracks_parquet, tmp_path / "serial", workers=1, cache_dir=tmp_path / "cache"
+    )
+
+
+def test_build_report(serial_report, tmp_path):
+    output = tmp_path / "serial"
+    assert serial_report["tracks"] == {"jazz": 1, "pop": 2, "rock": 2}
+    assert json.loads((output / "report.json").read_text()) == serial_report
+    durations = pl.read_parquet(output / "durations.parquet")
+    assert durations.columns == ["track_genre", "duration_seconds", "count"]
+    assert durations["track_genre"].unique().sort().to_list() == ["jazz", "pop", "rock"]
+
+
+def test_process_pool_matches_serial(serial_report, tracks_parquet, tmp_path):
+    build_report(
+        tracks_parquet, tmp_path / "pool", workers=2, cache_dir=tmp_path / "cache"
+    )
+    for table in TABLES:
+        assert_frame_equal(
+            pl.read_parquet(tmp_path / "pool" / f"{table}.parquet"),
+            pl.read_parquet(tmp_path / "serial" / f"{table}.parquet"),
+        )
+
+
+def test_filters_and_json(tracks_parquet, tmp_path):
+    summary = build_report(
+        tracks_parquet,
+        tmp_path / "out",
+        workers=1,
+        genres=["pop", "rock"],
+        min_dur=150,
+        fmt="json",
+        cache_dir=tmp_path / "cache",
+    )
+    assert summary["tracks"] == {"pop": 1, "rock": 2}
+    assert summary["files"]["means"] == "means.json"
+    means = pl.read_json(tmp_path / "out" / "means.json")
+    assert means["track_genre"].to_list() == ["pop", "rock"]
+
+
+def test_cli(tracks_parquet, tmp_path, capsys):
+    args = ["report", tracks_parquet, "-o", str(tmp_path / "cli"), "-w", "1"]
+    assert main.main([*args, "--cache-dir", str(tmp_path / "cache")]) == 0
+    assert "Wrote the report of 3 genres" in capsys.readouterr().out
+    assert (tmp_path / "cli" / "top_artists.parquet").exists()
@@ -0,0 +1,97 @@
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.aggregations import PopularArtists
+from ci_with_spotify.cache import TracksCache
+from ci_with_spotify.schema import (
+    clean_compact_tracks,
+    compact_tracks,
+    memory_report,
+)
+from ci_with_spotify.search import SearchIndex
+from ci_with_spotify.selection import take_rows
+from ci_with_spotify.synthetic import synthetic_tracks
+
+
+def test_compact_tracks_dtypes(tracks):
+    compact = compact_tracks(tracks, genres=["pop", "rock", "jazz"])
+    schema = compact.schema
+    assert schema["track_genre"] == pl.Enum(["jazz", "pop", "rock"])
+    assert schema["artists"] == pl.Categorical()
+    assert schema["album_name"] == pl.Categorical()
+    assert schema["track_name"] == pl.String
+    assert schema["key"] == pl.Int8
+    assert schema["mode"] == pl.UInt8
+    assert schema["popularity"] == pl.Float32
+    assert schema["energy"] == pl.Float32
+    assert schema[pipeline.ROW_ID] == pl.UInt32
+    # The values themselves are unchanged
+    assert compact["popularity"].to_list() == pytest.approx(
+        tracks["popularity"].to_list()
+    )
+    assert compact["artists"].cast(pl.String).to_list() == tracks["artists"].to_list()
+
+
+def test_compact_tracks_raw_and_lazy(raw_tracks):
+    compact = compact_tracks(raw_tracks.lazy())
+    assert isinstance(compact, pl.LazyFrame)
+    schema = compact.collect_schema()
+    assert schema["popularity"] == pl.UInt8
+    assert schema["track_genre"] == pl.Categorical()
+    assert (
+        compact.collect()["popularity"].to_list() == raw_tracks["popularity"].to_list()
+    )
+
+
+def test_compact_tracks_rejects_out_of_range_values(raw_tracks):
+    with pytest.raises(pl.exceptions.InvalidOperationError):
+        compact_tracks(raw_tracks.with_columns(pl.col("key") + 1_000))
+
+
+def test_pipeline_on_compact_tracks(tracks):
+    compact = compact_tracks(tracks).lazy()
+    assert_frame_equal(
+        pipeline.artist_combinations(compact).collect(),
+        pipeline.artist_combinations(tracks.lazy()).collect(),
+        check_row_order=False,
+    )
+    popular = pipeline.most_popular_artists(compact, "pop").collect()
+    expected = pipeline.most_popular_artists(tracks.lazy(), "pop").collect()
+    assert popular["artists"].to_list() == expected["artists"].to_list()
+    matches = pipeline.match_tracks(compact, artist="a", track="hello").collect()
+    expected = pipeline.match_tracks(tracks.lazy(), artist="a", track="hello")
+    assert matches["track_name"].to_list() == expected.collect()["track_name"].to_list()
+    assert pipeline.filter_genre(compact, "metal").collect().is_empty()
+
+
+def test_indexes_on_compact_tracks(tracks):
+    compact = compact_tracks(tracks)
+    expected = PopularArtists.build(tracks).get("pop")
+    assert PopularArtists.build(compact).get("pop")["artists"].to_list() == (
+        expected["artists"].to_list()
+    )
+    assert SearchIndex.build(compact).search(track="hello").height == 2
+    assert take_rows(compact, [3, 0])[pipeline.ROW_ID].to_list() == [0, 3]
+
+
+def test_clean_compact_tracks_cache(tracks_parquet, tmp_path):
+    cache = TracksCache(tmp_path / "cache")
+    compact = cache.load(tracks_parquet, clean_compact_tracks)
+    assert compact.schema["artists"] == pl.Categorical()
+    assert cache.load(tracks_parquet, clean_compact_tracks).height == compact.height
+
+
+def test_memory_report():
+    tracks = pipeline.clean_tracks(synthetic_tracks(20_000).lazy()).collect()
+    compact = compact_tracks(tracks, genres=pipeline.genres(tracks.lazy()))
+    report = memory_report(tracks, compact)
+    assert report["column"].to_list()[-1] == "total"
+    assert set(report["column"]) == {*tracks.columns, "total"}
+    total = report.row(-1, named=True)
+    assert total["bytes_after"] < total["bytes_before"]
+    assert total["ratio"] > 1.5
+    key = report.filter(pl.col("column") == "key").row(0, named=True)
+    assert key["ratio"] == 8.0
+    assert key["dtype_after"] == "Int8"
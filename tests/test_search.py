@@ -0,0 +1,95 @@
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.search import SearchIndex
+
+
+@pytest.fixture
+def extra_tracks(raw_tracks) -> pl.DataFrame:
+    return raw_tracks.head(4).with_columns(
+        pl.Series("Unnamed: 0", [6, 7, 8, 9]),
+        pl.Series("artists", ["Helloween;A", "Adele", "b;HELL", None]),
+        pl.Series("track_name", ["Yellow Submarine", "Hello", None, "Hell"]),
+    )
+
+
+@pytest.mark.parametrize(
+    ("artist", "track"),
+    [
+        (None, "hello"),
+        (None, "ELL"),
+        (None, "o"),
+        ("a", None),
+        ("hell", None),
+        ("b", "hello"),
+        ("adele", "yellow"),
+        ("zzz", "qqq"),
+        ("", None),
+    ],
+)
+def test_search_matches_pipeline(tracks, artist, track):
+    index = SearchIndex.build(tracks)
+    expected = pipeline.match_tracks(tracks.lazy(), artist=artist, track=track)
+    result = index.search(artist=artist, track=track, k=1_000)
+    assert_frame_equal(
+        result,
+        expected.collect(),
+        check_row_order=False,
+        check_dtypes=False,
+    )
+    scores = result["match_score"].to_list()
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_search_top_k(tracks):
+    index = SearchIndex.build(tracks)
+    full = index.search(track="l", k=1_000)
+    top = index.search(track="l", k=2)
+    assert top["match_score"].to_list() == full["match_score"].head(2).to_list()
+
+
+def test_search_where(tracks):
+    index = SearchIndex.build(tracks)
+    short = (tracks["duration_seconds"] < 150).to_numpy()
+    result = index.search(track="hello", where=short)
+    assert result["track_name"].to_list() == ["Hello"]
+    assert (result["duration_seconds"] < 150).all()
+
+
+def test_search_empty(tracks):
+    result = SearchIndex.build(tracks).search()
+    assert result.is_empty()
+    assert (
+        result.columns == pipeline.match_tracks(tracks.lazy()).collect_schema().names()
+    )
+
+
+def test_search_large_matches_pipeline():
+    rng = np.random.default_rng(0)
+    words = np.array(["love", "night", "dance", "blue", "fire", "you", "me", "la"])
+    n = 2_000
+    tracks = pl.DataFrame(
+        {
+            "row_id": range(n),
+            "artists": [
+                ";".join(rng.choice(words, rng.integers(1, 4))) for _ in range(n)
+            ],
+            "track_name": [" ".join(rng.choice(words, 2)) for _ in range(n)],
+            "album_name": ["album"] * n,
+            "track_genre": ["pop"] * n,
+            "popularity": rng.random(n),
+            "duration_seconds": rng.integers(100, 300, n),
+        }
+    )
+    index = SearchIndex.build(tracks)
+    for artist, track in [("lo", "ni"), ("fire", None), (None, "blue fire")]:
+        expected = pipeline.match_tracks(tracks.lazy(), artist=artist, track=track)
+        result = index.search(artist=artist, track=track, k=n)
+        assert_frame_equal(
+            result.sort("match_score", "track_name", "artists"),
+            expected.collect().sort("match_score", "track_name", "artists"),
+            check_dtypes=False,
+        )
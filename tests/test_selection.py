@@ -0,0 +1,34 @@
+import polars as pl
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.selection import selected_row_ids, take_rows
+
+
+def test_clean_tracks_keeps_row_ids(raw_tracks, tracks):
+    # The explicit track (row 4) is removed, the other IDs are those of the source
+    assert tracks[pipeline.ROW_ID].to_list() == [0, 1, 2, 3, 5]
+
+
+def test_selected_row_ids():
+    points = [{"energy": 0.5, "row_id": 3}, {"energy": 0.5, "row_id": 3}, {"row_id": 1}]
+    assert sorted(selected_row_ids(points).to_list()) == [1, 3]
+    assert selected_row_ids([{"energy": 0.5, "count": 2}]) is None
+    assert selected_row_ids(None) is None
+    assert selected_row_ids([]) is None
+
+
+def test_take_rows_gathers_from_filtered_tables(tracks):
+    filtered = tracks.filter(pl.col("duration_seconds") > 100)
+    result = take_rows(filtered, [5, 2, 0, 99, 2])
+    assert result[pipeline.ROW_ID].to_list() == [0, 2]
+    assert result.columns == tracks.columns
+
+
+def test_take_rows_unsorted(tracks):
+    shuffled = tracks.reverse()
+    assert take_rows(shuffled, [1, 3])[pipeline.ROW_ID].sort().to_list() == [1, 3]
+
+
+def test_take_rows_empty(tracks):
+    assert take_rows(tracks, []).is_empty()
+    assert take_rows(tracks.clear(), [1]).is_empty()
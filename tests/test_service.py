@@ -0,0 +1,177 @@
+import http.client
+import json
+import math
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.cache import TracksCache
+from ci_with_spotify.service import QueryService, make_server, normalize_query
+
+
+@pytest.fixture
+def server(tracks):
+    with make_server(QueryService(tracks), port=0, workers=4) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        thread.join()
+
+
+def get(server, path, **headers):
+    """The status, headers and decoded JSON body of a GET request."""
+    request = urllib.request.Request(server.url + path, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.headers, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        body = error.read()
+        return error.code, error.headers, json.loads(body) if body else None
+
+
+def test_normalize_query():
+    assert normalize_query("/artists/", "limit=10&genre=%20pop") == normalize_query(
+        "/artists", "genre=pop&limit=10&min_duration=0"
+    )
+    assert normalize_query("/artists", "") == (
+        "/artists",
+        (
+            ("genre", None),
+            ("limit", 20),
+            ("max_duration", math.inf),
+            ("min_duration", 0.0),
+        ),
+    )
+    with pytest.raises(LookupError):
+        normalize_query("/missing", "")
+    for query in [
+        "colour=red",
+        "limit=0",
+        "limit=ten",
+        "genre=pop&genre=rock",
+        "min_duration=nan",
+        "min_duration=300&max_duration=100",
+    ]:
+        with pytest.raises(ValueError):
+            normalize_query("/artists", query)
+
+
+def test_answers_match_the_pipeline(server, tracks):
+    status, headers, body = get(server, "/artists?genre=pop")
+    assert status == 200
+    assert headers["Content-Type"].startswith("application/json")
+    expected = pipeline.most_popular_artists(tracks.lazy(), "pop").collect()
+    assert_frame_equal(pl.DataFrame(body["rows"], schema=expected.schema), expected)
+
+    _, _, body = get(server, "/genres?min_duration=120&max_duration=300")
+    filtered = pipeline.filter_duration(tracks.lazy(), 120, 300)
+    assert body["genres"] == pipeline.genres(filtered)
+
+    _, _, body = get(server, "/genres/means")
+    assert body["rows"] == pipeline.genre_means(tracks.lazy()).collect().to_dicts()
+
+    _, _, body = get(server, "/collaborations?limit=1")
+    assert body["rows"] == [{"artists": "B", "other_artist": "A", "count": 2}]
+    _, _, body = get(server, "/collaborations?artist=C")
+    assert {row["collaborator"] for row in body["rows"]} == {"A", "B"}
+
+    _, _, body = get(server, "/search?track=hello")
+    assert [row["track_name"] for row in body["rows"]] == ["Hello", "Hello Again"]
+    _, _, body = get(server, "/search?track=hello&max_duration=300")
+    assert [row["track_name"] for row in body["rows"]] == ["Hello"]
+
+
+def test_results_are_cached_by_normalized_parameters(server, tracks):
+    _, _, first = get(server, "/artists?genre=pop&limit=5")
+    _, _, second = get(server, "/artists?limit=5&genre=pop")
+    _, _, third = get(server, "/artists?limit=05&genre=pop+")
+    assert first == second == third
+    _, _, health = get(server, "/health")
+    assert health["tracks"] == tracks.height
+    assert health["cache"] == {"entries": 1, "hits": 2, "misses": 1}
+
+
+def test_conditional_requests(server):
+    status, headers, body = get(server, "/genres")
+    etag = headers["ETag"]
+    assert status == 200 and etag.startswith('"')
+    status, headers, body = get(server, "/genres", **{"If-None-Match": etag})
+    assert status == 304 and body is None and headers["ETag"] == etag
+    status, _, _ = get(server, "/genres", **{"If-None-Match": f'"other", W/{etag}'})
+    assert status == 304
+    status, _, _ = get(server, "/genres", **{"If-None-Match": '"other"'})
+    assert status == 200
+    # Another answer has another ETag
+    _, headers, _ = get(server, "/genres?max_duration=100")
+    assert headers["ETag"] != etag
+
+
+def test_errors(server):
+    status, _, body = get(server, "/missing")
+    assert status == 404 and "missing" in body["error"]
+    status, _, body = get(server, "/artists?limit=-1")
+    assert status == 400 and "limit" in body["error"]
+
+
+def test_concurrent_requests(server):
+    paths = [f"/artists?limit={limit}" for limit in range(1, 4)] * 8
+    with ThreadPoolExecutor(8) as pool:
+        answers = list(pool.map(lambda path: get(server, path), paths))
+    assert all(status == 200 for status, _, _ in answers)
+    for limit in range(1, 4):
+        assert len(answers[limit - 1][2]["rows"]) == limit
+        assert answers[limit - 1][2] == answers[limit + 2][2]
+    # Each distinct query was computed once, however many arrived at the same time
+    _, _, health = get(server, "/health")
+    assert health["cache"]["misses"] == 3
+    assert health["cache"]["hits"] == len(paths) - 3
+
+
+def test_idle_connections_do_not_starve_the_workers(tracks):
+    service = QueryService(tracks)
+    with make_server(service, port=0, workers=2, idle_timeout=0.2) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        # More kept-alive clients than workers, each idle after its first request
+        clients = []
+        try:
+            for _ in range(3):
+                client = http.client.HTTPConnection(*server.server_address, timeout=10)
+                clients.append(client)
+                client.request("GET", "/genres")
+                assert client.getresponse().read()
+            status, _, body = get(server, "/health")
+            assert status == 200 and body["tracks"] == tracks.height
+        finally:
+            for client in clients:
+                client.close()
+            server.shutdown()
+            thread.join()
+
+
+def test_failures_are_not_cached(tracks):
+    service = QueryService(tracks)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        raise RuntimeError("boom")
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            service._cached(service.results, "key", compute)
+    assert len(calls) == 2
+    assert "key" not in service.results
+
+
+def test_load_through_the_tracks_cache(tracks_parquet, tmp_path, tracks):
+    service = QueryService.load(tracks_parquet, cache=TracksCache(tmp_path))
+    assert_frame_equal(service.tracks, tracks)
+    assert list(tmp_path.glob("*.arrow"))
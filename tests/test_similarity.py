@@ -0,0 +1,97 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from ci_with_spotify import pipeline
+from ci_with_spotify.schema import FEATURES
+from ci_with_spotify.similarity import SimilarityIndex
+from ci_with_spotify.synthetic import synthetic_tracks
+
+
+@pytest.fixture(scope="module")
+def tracks() -> pl.DataFrame:
+    return pipeline.clean_tracks(synthetic_tracks(5_000, seed=1).lazy()).collect()
+
+
+@pytest.fixture(scope="module")
+def index(tracks) -> SimilarityIndex:
+    return SimilarityIndex.build(tracks, n_lists=32)
+
+
+def brute_force(tracks: pl.DataFrame, index: SimilarityIndex, queries, k):
+    vectors = index.standardize(tracks.select(FEATURES).to_numpy())
+    squared = ((vectors[None, :, :] - index.standardize(queries)[:, None, :]) ** 2).sum(
+        axis=2
+    )
+    nearest = np.argsort(squared, axis=1, kind="stable")[:, :k]
+    return tracks[pipeline.ROW_ID].to_numpy()[nearest]
+
+
+def test_build_groups_the_rows_by_list(tracks, index):
+    assert len(index) == tracks.height
+    assert index.n_lists == 32
+    assert index.offsets[0] == 0 and index.offsets[-1] == tracks.height
+    assert index.vectors.dtype == np.float32
+    assert np.array_equal(np.sort(index.row_ids), tracks[pipeline.ROW_ID].to_numpy())
+    # Standardized features
+    assert np.allclose(index.vectors.mean(axis=0), 0, atol=1e-3)
+    assert np.allclose(index.vectors.std(axis=0), 1, atol=1e-3)
+
+
+def test_query_probing_every_list_is_exact(tracks, index):
+    queries = tracks.select(FEATURES).to_numpy()[:20]
+    neighbours, distances = index.query(queries, k=5, n_probe=index.n_lists)
+    expected = brute_force(tracks, index, queries, 5)
+    assert np.array_equal(neighbours, expected)
+    # Every query is one of the tracks, found at distance 0
+    assert np.allclose(distances[:, 0], 0, atol=1e-3)
+    assert np.all(np.diff(distances, axis=1) >= 0)
+
+
+def test_query_recall(tracks, index):
+    queries = tracks.select(FEATURES).to_numpy()[:200]
+    neighbours, _ = index.query(queries, k=10, n_probe=8)
+    expected = brute_force(tracks, index, queries, 10)
+    recall = np.mean(
+        [
+            len(set(found) & set(truth)) / 10
+            for found, truth in zip(neighbours, expected)
+        ]
+    )
+    assert recall > 0.9
+
+
+def test_similar_excludes_the_track_itself(tracks, index):
+    row_ids = tracks[pipeline.ROW_ID][:3].to_list()
+    similar = index.similar([*row_ids, -1], k=4)
+    assert similar.columns == [pipeline.ROW_ID, "similar_row_id", "distance", "rank"]
+    assert similar.height == 12
+    assert similar[pipeline.ROW_ID].unique().sort().to_list() == sorted(row_ids)
+    assert (similar[pipeline.ROW_ID] != similar["similar_row_id"]).all()
+    assert similar["rank"].to_list() == [1, 2, 3, 4] * 3
+    assert index.similar([], k=4).is_empty()
+
+
+def test_query_pads_missing_neighbours():
+    tracks = pipeline.clean_tracks(synthetic_tracks(5).lazy()).collect()
+    index = SimilarityIndex.build(tracks)
+    neighbours, distances = index.query(tracks.select(FEATURES).to_numpy()[:1], k=8)
+    assert (neighbours[0, tracks.height :] == -1).all()
+    assert np.isinf(distances[0, tracks.height :]).all()
+
+
+def test_save_and_memory_map(tracks, index, tmp_path):
+    index.save(tmp_path / "similarity")
+    loaded = SimilarityIndex.load(tmp_path / "similarity")
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.features == FEATURES
+    queries = tracks.select(FEATURES).to_numpy()[:10]
+    assert np.array_equal(loaded.query(queries)[0], index.query(queries)[0])
+    assert loaded.similar([0]).equals(index.similar([0]))
+
+
+def test_load_rejects_other_versions(index, tmp_path):
+    path = index.save(tmp_path / "similarity")
+    (path / "index.json").write_text('{"version": 0}')
+    with pytest.raises(ValueError):
+        SimilarityIndex.load(path)
@@ -0,0 +1,139 @@
+import io
+import json
+import subprocess
+import sys
+import threading
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+import ci_with_spotify
+import main
+from ci_with_spotify import pipeline
+from ci_with_spotify.aggregations import PopularArtists
+from ci_with_spotify.cache import TracksCache
+from ci_with_spotify.startup import Warmup, lazy_import, start_warmup
+
+
+def test_package_imports_submodules_lazily():
+    code = (
+        "import sys, ci_with_spotify as eda\n"
+        "assert 'polars' not in sys.modules and 'ci_with_spotify.pipeline' not in sys.modules\n"
+        "assert eda.clean_tracks.__module__ == 'ci_with_spotify.pipeline'\n"
+        "assert 'polars' in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_every_export_resolves():
+    assert sorted(ci_with_spotify.__all__) == sorted(ci_with_spotify._EXPORTS)
+    for name in ci_with_spotify.__all__:
+        assert getattr(ci_with_spotify, name) is not None
+    assert set(ci_with_spotify.__all__) <= set(dir(ci_with_spotify))
+    with pytest.raises(AttributeError):
+        ci_with_spotify.missing  # noqa: B018
+
+
+def test_lazy_import(monkeypatch):
+    assert lazy_import("polars") is pl
+    monkeypatch.delitem(sys.modules, "wave", raising=False)
+    wave = lazy_import("wave")
+    assert "wave" not in sys.modules
+    assert wave.Error.__module__ == "wave"
+    assert "wave" in sys.modules
+
+
+def test_warmup_results():
+    warmup = Warmup()
+    release = threading.Event()
+    warmup.submit("slow", lambda: release.wait() and 1)
+    warmup.submit(("double", 2), lambda: warmup.result("slow") * 2)
+    assert warmup.report()["pending"] == ["slow", "double/2"]
+    release.set()
+    assert warmup.get_or_compute(("double", 2), lambda: 0) == 2
+    assert warmup.get_or_compute(("double", 3), lambda: 6) == 6
+    warmup.wait()
+    report = warmup.report()
+    assert report["pending"] == []
+    assert set(report["ready"]) == {"slow", "double/2"}
+    assert set(report["waited"]) <= {"slow", "double/2"}
+    with pytest.raises(KeyError):
+        warmup.result("missing")
+
+
+def test_warmup_keeps_the_last_result_of_a_kind():
+    warmup = Warmup(max_workers=1)
+    release = threading.Event()
+    warmup.submit("slow", release.wait)
+    replaced = [
+        warmup.submit(("index", low, 300), lambda low=low: low, kind="index")
+        for low in [100, 120, 140]
+    ]
+    warmup.submit(("index", 140, 300), lambda: 140, kind="index")
+    # Queued behind the slow task, so the ranges left behind never run
+    assert [future.cancelled() for future in replaced] == [True, True, True]
+    assert [key for key in warmup._futures if key != "slow"] == [("index", 140, 300)]
+    release.set()
+    assert warmup.result(("index", 140, 300)) == 140
+    with pytest.raises(KeyError):
+        warmup.result(("index", 100, 300))
+
+
+def test_warmup_raises_errors_of_the_tasks():
+    warmup = Warmup()
+    warmup.submit("failing", lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        warmup.get_or_compute("failing", lambda: 1)
+    with pytest.raises(ZeroDivisionError):
+        warmup.wait()
+
+
+def test_log_writes_a_json_line():
+    warmup = Warmup()
+    warmup.mark("interactive")
+    out = io.StringIO()
+    report = warmup.log(out)
+    assert json.loads(out.getvalue()) == report
+    assert report["event"] == "startup"
+    assert set(report["marks"]) == {"interactive"}
+
+
+def test_start_warmup_matches_the_notebook_cells(tracks_parquet, tmp_path):
+    warmup = start_warmup(
+        tracks_parquet, duration=(120, 300), cache=TracksCache(tmp_path / "cache")
+    )
+    warmup.wait()
+    tracks = pipeline.clean_tracks(pl.scan_parquet(tracks_parquet)).collect()
+    assert_frame_equal(warmup.result("tracks"), tracks)
+    assert_frame_equal(
+        warmup.result("duration_counts"),
+        pipeline.duration_counts(tracks.lazy()).collect(),
+        check_row_order=False,
+    )
+    filtered = pipeline.filter_duration(tracks.lazy(), 120, 300)
+    assert warmup.result(("genres", 120, 300)) == pipeline.genres(filtered)
+    assert_frame_equal(
+        warmup.result(("genre_means", 120, 300)),
+        pipeline.genre_means(filtered).collect(),
+    )
+    popular = warmup.result(("popular_artists", 120, 300))
+    assert_frame_equal(popular.get(), PopularArtists.build(filtered).get())
+
+
+def test_start_warmup_streaming_only_imports():
+    warmup = start_warmup("missing.parquet", streaming=True)
+    warmup.wait()
+    assert list(warmup.ready) == ["imports"]
+
+
+def test_main_warmup(tracks_parquet, tmp_path, capsys):
+    args = ["warmup", tracks_parquet, "--cache-dir", str(tmp_path / "cache")]
+    assert main.main(args) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["pending"] == []
+    assert {"tracks", "genres/120/360", "popular_artists/120/360"} <= set(
+        report["ready"]
+    )
+    assert "done" in report["marks"]
+    assert list((tmp_path / "cache").glob("*.arrow"))
@@ -0,0 +1,28 @@
+from ci_with_spotify import pipeline
+from ci_with_spotify.synthetic import GENRES, synthetic_tracks
+
+
+def test_same_schema_as_the_source(raw_tracks):
+    assert synthetic_tracks(100).schema == raw_tracks.schema
+
+
+def test_seeded():
+    assert synthetic_tracks(1_000, seed=1).equals(synthetic_tracks(1_000, seed=1))
+    assert not synthetic_tracks(1_000, seed=1).equals(synthetic_tracks(1_000, seed=2))
+
+
+def test_shape():
+    df = synthetic_tracks(20_000)
+    assert df.height == 20_000
+    assert df["track_genre"].n_unique() == GENRES
+    artists = df["artists"].str.split(";")
+    assert artists.list.len().max() == 4
+    assert artists.list.len().gt(1).mean() > 0.1
+    assert artists.explode().n_unique() < df.height / 2
+    assert df["popularity"].is_between(0, 100).all()
+    assert df["track_name"].str.contains("love").any()
+    # The cleaning steps apply to it like to the real dataset
+    cleaned = pipeline.clean_tracks(df.lazy()).collect()
+    assert 0 < cleaned.height < df.height
+    assert cleaned["duration_seconds"].is_between(120, 360).mean() > 0.5
+    assert cleaned["row_id"].is_sorted()
@@ -0,0 +1,80 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from ci_with_spotify.trendline import Trendlines, lowess
+
+
+def _reference(x, y, at, frac):
+    """Unbinned local linear fit with tricube weights, without robustness iterations."""
+    k = int(np.ceil(frac * x.size))
+    fitted = []
+    for anchor in at:
+        distances = np.abs(x - anchor)
+        bandwidth = np.sort(distances)[k - 1]
+        ratio = distances / bandwidth
+        weights = np.where(ratio < 1, (1 - ratio**3) ** 3, 0)
+        slope, intercept = np.polyfit(x, y, 1, w=np.sqrt(weights))
+        fitted.append(intercept + slope * anchor)
+    return np.array(fitted)
+
+
+def test_lowess_matches_unbinned_fit():
+    rng = np.random.default_rng(0)
+    x = rng.permutation(np.arange(200, dtype=float))
+    y = np.sin(x / 30) + rng.normal(0, 0.1, x.size)
+    positions, fitted = lowess(x, y, frac=0.3, anchors=40)
+    assert positions.size == 40
+    assert np.all(np.diff(positions) > 0)
+    np.testing.assert_allclose(fitted, _reference(x, y, positions, 0.3), atol=1e-8)
+
+
+def test_lowess_recovers_a_line_with_many_rows():
+    rng = np.random.default_rng(1)
+    x = rng.random(200_000)
+    y = 3 * x + 1 + rng.normal(0, 0.01, x.size)
+    positions, fitted = lowess(x, y)
+    assert positions.size <= 100
+    np.testing.assert_allclose(fitted, 3 * positions + 1, atol=0.01)
+
+
+def test_lowess_degenerate_inputs():
+    positions, fitted = lowess(np.ones(10), np.arange(10.0))
+    assert positions.tolist() == [1.0]
+    assert fitted.tolist() == [4.5]
+    positions, fitted = lowess(np.array([np.nan]), np.array([1.0]))
+    assert positions.size == fitted.size == 0
+
+
+@pytest.fixture
+def tracks() -> pl.DataFrame:
+    rng = np.random.default_rng(2)
+    n = 1_000
+    return pl.DataFrame(
+        {
+            "energy": rng.random(n),
+            "danceability": rng.random(n),
+            "track_genre": rng.choice(["pop", "rock"], n),
+        }
+    )
+
+
+def test_trendlines_are_cached_per_key(tracks):
+    trendlines = Trendlines()
+    line = trendlines.get(tracks, "energy", "danceability", "pop", version=1)
+    assert line.columns == ["energy", "danceability"]
+    assert trendlines.get(tracks, "energy", "danceability", "pop", version=1) is line
+    assert (
+        trendlines.get(tracks, "energy", "danceability", "rock", version=1) is not line
+    )
+    assert (
+        trendlines.get(tracks, "energy", "danceability", "pop", version=2) is not line
+    )
+    assert len(trendlines.cache) == 3
+
+
+def test_trendlines_filter_the_genre(tracks):
+    line = Trendlines().get(tracks.lazy(), "energy", "danceability", "pop")
+    pop = tracks.filter(pl.col("track_genre") == "pop")
+    _, expected = lowess(pop["energy"].to_numpy(), pop["danceability"].to_numpy())
+    np.testing.assert_allclose(line["danceability"].to_numpy(), expected)
@@ -1,5 +1,48 @@
-def test_placeholder():
-    """A placeholder test function."""
-    pass
+import numpy as np
+import polars as pl
+import pytest
 
-# TODO: Add actual tests for the utility function here.
\ No newline at end of file
+from ci_with_spotify.utils import get_extremes
+
+ROWS = [
+    {"duration_seconds": 200, "count": 3},
+    {"duration_seconds": 120, "count": 1},
+    {"duration_seconds": 360, "count": 2},
+]
+
+
+@pytest.mark.parametrize(
+    "selection",
+    [
+        ROWS,
+        pl.DataFrame(ROWS),
+        pl.DataFrame(ROWS)["duration_seconds"],
+        np.array([200, 120, 360]),
+        {"duration_seconds": [200, 120, 360]},
+        {"duration_seconds": pl.Series([200, 120, 360])},
+    ],
+    ids=["rows", "dataframe", "series", "array", "dict", "dict-of-series"],
+)
+def test_get_extremes(selection):
+    assert get_extremes(selection, "duration_seconds", (0, 0)) == (120, 360)
+
+
+def test_get_extremes_positional():
+    data = [[1, 10, 100], [2, 20, 200], [3, 30, 300]]
+    assert get_extremes(data, 1, (0, 0)) == (10, 30)
+    assert get_extremes(np.array(data), 2, (0, 0)) == (100, 300)
+    assert get_extremes(pl.DataFrame({"a": [5, 4], "b": [1, 9]}), 1, (0, 0)) == (1, 9)
+
+
+@pytest.mark.parametrize(
+    "selection",
+    [None, [], pl.DataFrame({"x": []}), np.array([]), {"x": []}, pl.Series([None])],
+)
+def test_get_extremes_defaults(selection, capsys):
+    assert get_extremes(selection, "x", (120, 360)) == (120, 360)
+    assert "Could not find a selected region" in capsys.readouterr().out
+
+
+def test_get_extremes_returns_python_scalars():
+    low, high = get_extremes(np.array([1.5, 0.5]), 0, (0, 0))
+    assert type(low) is float and type(high) is float